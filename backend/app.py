@@ -5,27 +5,85 @@ Author: ConversAI MVP
 Run: python app.py
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, g
 from flask_cors import CORS
+from flask_sock import Sock
 import json
 import uuid
+import hashlib
 import os
+import time
 import logging
 from datetime import datetime
 
 # Import our modules
-from model import get_response
-from database import init_db, save_conversation, get_recent
+import metrics
+from structured_logging import setup_logging
+from model import get_response, FALLBACK_REPLIES, GENERATION_PROFILES, DEFAULT_PROFILE, get_generation_stats, get_fast_path_stats, get_prompt_cache_stats, upstream_pool, warm_keeper, micro_batcher, HF_TOKEN
+from database import init_db, save_conversation, get_recent_json, get_since_json, get_last_turn_id, get_turn_stats
+import json_codec
+from json_codec import FastJSONProvider, dumps_with_raw
+from voice_session import VoiceSession
+from idempotency import IdempotencyStore
+from warmkeeper import WARMKEEPER_ENABLED
+from telemetry import TelemetryStore, TELEMETRY_ENABLED, MAX_BEACONS_PER_REQUEST
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (JSON lines written off the request thread)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app, origins=['http://localhost:5001', 'http://127.0.0.1:5001'])
+# jsonify and request.get_json through orjson when installed (see json_codec.py)
+app.json = FastJSONProvider(app)
+# Pages allowed to call the API (CORS) and to open voice WebSockets
+ALLOWED_ORIGINS = [origin.strip() for origin in
+                   os.getenv("ALLOWED_ORIGINS", "http://localhost:5001,http://127.0.0.1:5001").split(",")
+                   if origin.strip()]
+CORS(app, origins=ALLOWED_ORIGINS, expose_headers=['ETag'])
+# Keep idle voice connections alive through proxies with periodic pings.
+# For many concurrent connections run under gevent: gunicorn -k gevent -w 1 app:app
+app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25}
+sock = Sock(app)
 # Initialize database
 init_db()
+idempotency_store = IdempotencyStore()
+# Client timing beacons and per-turn server stage timings (buffered writes)
+telemetry_store = TelemetryStore() if TELEMETRY_ENABLED else None
+if telemetry_store:
+    telemetry_store.start()
+# Keep the upstream model warm between bursts of traffic (one worker pings)
+if WARMKEEPER_ENABLED and HF_TOKEN:
+    warm_keeper.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def check_websocket_origin():
+    """
+    Refuse voice WebSocket handshakes from other sites' pages
+    
+    CORS does not apply to WebSockets, so without this any page the user
+    visits could open a session (and spend the upstream token). Browsers
+    always send Origin; clients without one (scripts, tests) are allowed.
+    """
+    if request.path == '/ws/voice':
+        origin = request.headers.get('Origin')
+        if origin is not None and origin not in ALLOWED_ORIGINS:
+            logger.warning("Rejected voice WebSocket from origin %s", origin)
+            return jsonify({"error": True, "message": "Origin not allowed"}), 403
+
+@app.after_request
+def record_request_metrics(response):
+    """Count every request and its latency by route (merged across workers at /api/metrics)"""
+    start_time = g.pop('request_start', None)
+    if start_time is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.http_requests.labels(endpoint, response.status_code).inc()
+        metrics.http_request_seconds.labels(endpoint).observe(time.perf_counter() - start_time)
+    return response
 
 @app.route('/')
 def serve_frontend():
@@ -33,7 +91,7 @@ def serve_frontend():
     try:
         return send_from_directory('../frontend', 'index.html')
     except Exception as e:
-        logger.error(f"Error serving frontend: {e}")
+        logger.error("Error serving frontend: %s", e)
         return jsonify({"error": True, "message": "Frontend not available"}), 500
 
 @app.route('/style.css')
@@ -50,9 +108,44 @@ def serve_js():
 def chat():
     """
     Main chat endpoint
-    Accepts: {"message": "user input", "session_id": "optional session id"}
-    Returns: {"reply": "bot response", "session_id": "session id"}
+    Accepts: {"message": "user input", "session_id": "optional session id",
+              "profile": "optional generation profile, e.g. voice-fast",
+              "turn_id": "optional client turn id, to join its timing beacon"}
+    Returns: {"reply": "bot response", "session_id": "session id", "profile": "profile used"}
+    
+    With an Idempotency-Key header, retries of the same request are answered
+    from the first run (marked with an Idempotent-Replayed header) instead of
+    calling the model and saving the turn again.
     """
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        return chat_turn()
+    
+    try:
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        
+        def run_turn():
+            response, status_code = chat_turn()
+            return status_code, response.get_data(as_text=True)
+        
+        def model_failed(status_code, body):
+            # Apologies for an unreachable model come back as 200s; a retry should try again
+            return status_code == 200 and json_codec.loads(body).get("reply") in FALLBACK_REPLIES
+        
+        status_code, body, replayed = idempotency_store.execute(idempotency_key, fingerprint, run_turn,
+                                                                failed=model_failed)
+        response = app.response_class(body, status=status_code, mimetype='application/json')
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+        
+    except Exception as e:
+        logger.error("Error in idempotent chat request: %s", e)
+        return jsonify({"error": True, "message": "Internal server error occurred"}), 500
+
+def chat_turn():
+    """Handle one chat turn; returns (response, status code)"""
+    start_time = time.perf_counter()
     try:
         # Parse JSON request
         data = request.get_json()
@@ -61,54 +154,170 @@ def chat():
         
         user_message = data.get('message', '').strip()
         session_id = data.get('session_id', str(uuid.uuid4()))
+        profile = data.get('profile') or DEFAULT_PROFILE
         
         if not user_message:
             return jsonify({"error": True, "message": "No message provided"}), 400
         
-        logger.info(f"Received message: '{user_message}' for session: {session_id}")
+        if profile not in GENERATION_PROFILES:
+            return jsonify({"error": True, "message": f"Unknown profile: {profile}"}), 400
+        
+        logger.info("Received message", extra={"fields": {"session_id": session_id, "user_message": user_message}})
         
         # Get response from model
-        bot_response = get_response(user_message, session_id)
+        model_start = time.perf_counter()
+        turn_stats = {}
+        bot_response = get_response(user_message, session_id, profile, turn_stats)
         
-        # Save conversation to database
-        save_conversation(session_id, user_message, bot_response)
+        # Save conversation to database, with the turn's performance figures
+        db_start = time.perf_counter()
+        save_conversation(session_id, user_message, bot_response,
+                          total_ms=(db_start - start_time) * 1000, **turn_stats)
+        db_end = time.perf_counter()
         
-        logger.info(f"Generated response: '{bot_response}'")
+        if telemetry_store:
+            telemetry_store.record_server(
+                data.get('turn_id'), session_id, "http", profile,
+                model_ms=(db_start - model_start) * 1000, db_ms=(db_end - db_start) * 1000,
+                total_ms=(db_end - start_time) * 1000,
+            )
+        
+        logger.info("Generated response", extra={"fields": {"session_id": session_id, "bot_reply": bot_response}})
         
         return jsonify({
             "reply": bot_response,
             "session_id": session_id,
+            "profile": profile,
             "timestamp": datetime.now().isoformat()
-        })
+        }), 200
         
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {e}")
+        logger.error("Error in chat endpoint: %s", e)
         return jsonify({
             "error": True, 
             "message": "Internal server error occurred"
         }), 500
 
+@sock.route('/ws/voice')
+def voice_socket(ws):
+    """
+    Persistent voice session (see voice_session.py for the message protocol)
+    Query params: session_id (optional), profile (optional, default voice-fast)
+    """
+    session_id = request.args.get('session_id') or str(uuid.uuid4())
+    profile = request.args.get('profile') or 'voice-fast'
+    if profile not in GENERATION_PROFILES:
+        profile = DEFAULT_PROFILE
+    logger.info("Voice session connected", extra={"fields": {"session_id": session_id}})
+    VoiceSession(ws, session_id, profile, telemetry_store).run()
+
 @app.route('/api/history/<session_id>')
 def get_history(session_id):
-    """Get conversation history for a session"""
+    """
+    Get conversation history for a session
+    
+    With ?since_id=N only turns newer than N are returned (up to 20, so keep
+    passing the highest id received until has_more is false). The strong ETag
+    is the session's last turn id: a poll with a matching If-None-Match gets
+    an empty 304 after a single index lookup.
+    """
     try:
-        conversations = get_recent(session_id, limit=20)
-        return jsonify({
+        since_id = request.args.get('since_id', type=int)
+        last_id = get_last_turn_id(session_id)
+        etag = f"t{last_id}"
+        if last_id is not None and request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        
+        # Bound the reads by last_id so the body always matches the ETag.
+        # The turns arrive as JSON text from SQLite and are spliced in as is.
+        if since_id is not None:
+            conversations, highest_id = get_since_json(session_id, since_id, limit=20, max_id=last_id)
+            has_more = highest_id > since_id and highest_id < (last_id or 0)
+        else:
+            conversations = get_recent_json(session_id, limit=20, max_id=last_id)
+            has_more = False
+        if conversations is None:
+            raise RuntimeError("history query failed")
+        
+        response = app.response_class(dumps_with_raw({
             "session_id": session_id,
-            "conversations": [
-                {
-                    "id": conv[0],
-                    "user_input": conv[2],
-                    "bot_response": conv[3],
-                    "timestamp": conv[4]
-                }
-                for conv in conversations
-            ]
-        })
+            "last_id": last_id,
+            "has_more": has_more,
+        }, conversations=conversations), mimetype='application/json')
+        if last_id is not None:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
-        logger.error(f"Error getting history: {e}")
+        logger.error("Error getting history: %s", e)
         return jsonify({"error": True, "message": "Failed to retrieve history"}), 500
 
+@app.route('/api/telemetry', methods=['POST'])
+def ingest_telemetry():
+    """
+    Accept a batch of client timing beacons
+    Accepts: {"beacons": [{"turn_id", "session_id", "transport", "recognition_ms",
+              "network_ms", "first_audio_ms", "tts_ms"}, ...]}
+    (sent with navigator.sendBeacon, so the body may arrive as text/plain)
+    """
+    if not telemetry_store:
+        return jsonify({"accepted": 0}), 202
+    data = request.get_json(force=True, silent=True)
+    beacons = data.get('beacons') if isinstance(data, dict) else None
+    if not isinstance(beacons, list):
+        return jsonify({"error": True, "message": "Expected {\"beacons\": [...]}"}), 400
+    accepted = sum(telemetry_store.record_client(beacon) for beacon in beacons[:MAX_BEACONS_PER_REQUEST])
+    return jsonify({"accepted": accepted}), 202
+
+@app.route('/api/telemetry/summary')
+def telemetry_summary():
+    """Latency percentiles over time (?hours=24&bucket_minutes=60), client joined to server timings"""
+    if not telemetry_store:
+        return jsonify({"error": True, "message": "Telemetry is disabled"}), 404
+    hours = request.args.get('hours', 24, type=float)
+    bucket_minutes = request.args.get('bucket_minutes', 60, type=float)
+    if hours <= 0 or bucket_minutes <= 0:
+        return jsonify({"error": True, "message": "hours and bucket_minutes must be positive"}), 400
+    return jsonify(telemetry_store.summary(hours, bucket_minutes))
+
+@app.route('/api/stats')
+def stats_summary():
+    """Turns, throughput, cache/retry rates and latency percentiles (?period=hour|day&buckets=24)"""
+    period = request.args.get('period', 'hour')
+    buckets = request.args.get('buckets', 24, type=int)
+    if period not in ('hour', 'day') or not 1 <= buckets <= 1000:
+        return jsonify({"error": True, "message": "period must be hour or day and buckets 1-1000"}), 400
+    return jsonify(get_turn_stats(period, buckets))
+
+@app.route('/api/profiles')
+def list_profiles():
+    """List generation profiles with their parameters and observed throughput"""
+    stats = get_generation_stats()
+    return jsonify({
+        "default": DEFAULT_PROFILE,
+        "profiles": {
+            name: {"parameters": params, "stats": stats[name]}
+            for name, params in GENERATION_PROFILES.items()
+        }
+    })
+
+@app.route('/api/upstream')
+def upstream_status():
+    """Upstream endpoint health, latency, hedging, warm-keeping and batching counters (all workers)"""
+    merged = metrics.snapshot()
+    return jsonify({**upstream_pool.stats(merged), "warm_keeper": warm_keeper.stats(merged),
+                    "batching": micro_batcher.stats(merged) if micro_batcher else None})
+
+@app.route('/api/metrics')
+def metrics_snapshot():
+    """Counters and latency histograms summed over every worker process, plus fast-path and prompt-cache hit ratios"""
+    merged = metrics.snapshot()
+    return jsonify({**merged, "fast_path": get_fast_path_stats(merged),
+                    "prompt_cache": get_prompt_cache_stats(merged)})
+
 @app.route('/api/health')
 def health_check():
     """Health check endpoint"""
@@ -131,7 +340,14 @@ if __name__ == '__main__':
     print("Frontend will be available at: http://localhost:5001")
     print("API endpoints:")
     print("  POST /api/chat - Main chat endpoint")
+    print("  WS /ws/voice - Persistent voice session")
     print("  GET /api/history/<session_id> - Get conversation history")
+    print("  POST /api/telemetry - Client timing beacons")
+    print("  GET /api/telemetry/summary - Turn latency percentiles")
+    print("  GET /api/stats - Turn throughput and latency rollups")
+    print("  GET /api/metrics - Request, generation, prompt-cache and fast-path metrics from all workers")
+    print("  GET /api/profiles - Generation profiles and tokens/sec")
+    print("  GET /api/upstream - Upstream endpoint health and hedging")
     print("  GET /api/health - Health check")
     print("\nPress Ctrl+C to stop the server")
     
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Micro-batching benchmark for upstream generation calls
+Runs a stub inference endpoint that serves one call at a time (like a single
+GPU), costing a fixed overhead per call plus a little per prompt, and compares
+upstream calls, throughput and end-to-end latency with batching on and off
+Author: ConversAI MVP
+Run: python bench_batching.py [--clients 16] [--turns 10] [--max-size 8] [--wait-ms 10]
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import model
+from prompt_cache import PromptCache
+from upstream import EndpointPool
+
+
+def start_stub(call_seconds: float, prompt_seconds: float):
+    """Start a serialized stub endpoint; returns (url, calls counter)"""
+    busy = threading.Lock()
+    calls = [0]
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            inputs = payload["inputs"] if isinstance(payload["inputs"], list) else [payload["inputs"]]
+            with busy:
+                calls[0] += 1
+                time.sleep(call_seconds + prompt_seconds * len(inputs))
+            body = json.dumps([{"generated_text": f"Reply to: {text}.",
+                                "details": {"finish_reason": "eos_token", "generated_tokens": 5}}
+                               for text in inputs]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/", calls
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(clients: int, turns: int, tag: str):
+    """Each client sends turns distinct prompts back to back; returns latencies (ms) and wall time"""
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(index):
+        for turn in range(turns):
+            prompt = f"{tag} question {turn} from client {index}: explain topic {index * turns + turn}"
+            start_time = time.perf_counter()
+            reply = model._model_reply(prompt, "text-full")
+            elapsed = (time.perf_counter() - start_time) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if not reply.startswith("Reply to:"):
+                    errors.append(reply)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start_time, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batching of upstream calls")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--turns", type=int, default=10, help="turns per client")
+    parser.add_argument("--call-ms", type=float, default=50, help="stub cost per upstream call")
+    parser.add_argument("--prompt-ms", type=float, default=5, help="stub cost per prompt in a call")
+    parser.add_argument("--max-size", type=int, default=8, help="maximum prompts per batch")
+    parser.add_argument("--wait-ms", type=float, default=10, help="batching window")
+    args = parser.parse_args()
+
+    url, calls = start_stub(args.call_ms / 1000, args.prompt_ms / 1000)
+    model.HF_TOKEN = model.HF_TOKEN or "bench"
+    model.upstream_pool = EndpointPool([url], hedge_budget=0.0)
+    # Distinct prompts only: nothing may be answered from the cache
+    model.prompt_caches = {name: PromptCache(capacity=0) for name in model.GENERATION_PROFILES}
+
+    print(f"{args.clients} clients x {args.turns} turns, upstream {args.call_ms:.0f} ms/call "
+          f"+ {args.prompt_ms:.0f} ms/prompt, one call at a time\n")
+    print(f"{'mode':<10} {'calls':>6} {'calls/s':>8} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for mode, batcher in (("unbatched", None),
+                          ("batched", model.MicroBatcher(model._send_batch, args.max_size, args.wait_ms / 1000))):
+        model.micro_batcher = batcher
+        calls[0] = 0
+        before = batcher.stats() if batcher else None
+        latencies, wall, errors = run(args.clients, args.turns, mode)
+        print(f"{mode:<10} {calls[0]:>6} {calls[0] / wall:>8.1f} {len(latencies) / wall:>8.1f} "
+              f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} {len(errors):>7}")
+        if batcher:
+            after = batcher.stats()
+            print(f"\nAverage batch size: {(after['prompts'] - before['prompts']) / (after['batches'] - before['batches']):.1f}")
+
+
+if __name__ == "__main__":
+    main()
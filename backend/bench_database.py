@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the database layer
+Reports ops/sec and latency percentiles of each database.py function against a
+fixture, so schema or pragma changes can be compared run to run
+Author: ConversAI MVP
+Run: python bench_database.py --db fixtures/conversations.db [--setup-sql "CREATE INDEX ..."]
+         [--json after.json] [--compare before.json]
+"""
+
+import argparse
+import json
+import random
+import sqlite3
+import time
+import uuid
+
+import database
+
+
+def sample_sessions(count: int, rng: random.Random) -> list:
+    """Pick existing session ids by probing random row ids (no full scan)"""
+    sessions = []
+    for path in database.shard_paths():
+        conn = sqlite3.connect(path)
+        low, high = conn.execute("SELECT MIN(id), MAX(id) FROM conversations").fetchone()
+        if low is not None:
+            for _ in range(max(1, count // len(database.shard_paths()))):
+                row = conn.execute("SELECT session_id FROM conversations WHERE id >= ? LIMIT 1",
+                                   (rng.randint(low, high),)).fetchone()
+                sessions.append(row[0])
+        conn.close()
+    return sessions
+
+
+def measure(operation, iterations: int, max_seconds: float) -> dict:
+    """Run operation until iterations or max_seconds is reached; return stats"""
+    latencies = []
+    deadline = time.perf_counter() + max_seconds
+    for i in range(iterations):
+        start_time = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - start_time)
+        if start_time > deadline:
+            break
+    latencies.sort()
+    total = sum(latencies)
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / total if total else 0.0,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+    }
+
+
+def run_suite(iterations: int, max_seconds: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    sessions = sample_sessions(200, rng)
+    if not sessions:
+        raise SystemExit("Fixture has no conversations; run generate_fixtures.py first")
+    bench_session = f"bench_{uuid.uuid4()}"
+
+    results = {}
+    # Writes go into the fixture itself (its real size and warm page cache);
+    # the bench session's rows and their rollups are removed again afterwards
+    try:
+        results["save_conversation"] = measure(
+            lambda i: database.save_conversation(bench_session, "benchmark prompt", "benchmark reply"),
+            iterations, max_seconds)
+    finally:
+        database.delete_session(bench_session)
+
+    results["get_recent"] = measure(lambda i: database.get_recent(rng.choice(sessions), 10), iterations, max_seconds)
+    # get_all_sessions reads every row; a few runs are enough
+    results["get_all_sessions"] = measure(lambda i: database.get_all_sessions(), max(3, iterations // 100), max_seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark database.py functions")
+    parser.add_argument("--db", default="fixtures/conversations.db", help="fixture database path")
+    parser.add_argument("--shards", type=int, default=1, help="shard count the fixture was built with")
+    parser.add_argument("--iterations", type=int, default=1000, help="calls per function")
+    parser.add_argument("--max-seconds", type=float, default=30.0, help="time cap per function")
+    parser.add_argument("--setup-sql", action="append", default=[],
+                        help="SQL run on every shard first, e.g. 'PRAGMA journal_mode=WAL' (repeatable)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier --json results to compare against")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    database.DB_PATH = args.db
+    database.DB_SHARDS = args.shards
+    for statement in args.setup_sql:
+        for path in database.shard_paths():
+            conn = sqlite3.connect(path)
+            conn.execute(statement)
+            conn.commit()
+            conn.close()
+
+    results = run_suite(args.iterations, args.max_seconds, args.seed)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print(f"{'function':<20} {'ops':>6} {'ops/sec':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'vs base':>8}")
+    for name, stats in results.items():
+        change = ""
+        if name in baseline and baseline[name]["ops_per_sec"]:
+            change = f"{stats['ops_per_sec'] / baseline[name]['ops_per_sec']:.2f}x"
+        print(f"{name:<20} {stats['ops']:>6} {stats['ops_per_sec']:>10.1f} {stats['p50_ms']:>9.3f} "
+              f"{stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f} {change:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
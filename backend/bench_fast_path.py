@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Classification overhead benchmark for the small-talk fast path
+Times intent lookups for small talk, near misses and ordinary questions, and
+reports the hit ratio over a sample of typical voice transcripts
+Author: ConversAI MVP
+Run: python bench_fast_path.py [--lookups 20000]
+"""
+
+import argparse
+import time
+
+from fast_path import DEFAULT_INTENTS, IntentMatcher
+
+UTTERANCES = {
+    "small talk": ["Hi!", "hello there", "Thanks so much", "ok thanks bye", "How are you doing?",
+                   "good morning conversai", "see you later", "got it, thank you"],
+    "near miss": ["thanks, what's the weather", "hi can you help me", "ok bye, what time is it",
+                  "hello how do I reset my password"],
+    "question": ["What is the capital of France?", "Can you explain how photosynthesis works in plants?",
+                 "Tell me a joke about programmers", "What's the difference between a list and a tuple "
+                 "in Python and when should I use each one?"],
+}
+
+
+def per_call_us(operation, calls: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(calls):
+        operation()
+    return (time.perf_counter() - start_time) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fast-path intent classification")
+    parser.add_argument("--lookups", type=int, default=20000, help="lookups per utterance")
+    args = parser.parse_args()
+
+    matcher = IntentMatcher(DEFAULT_INTENTS)
+    print(f"{'kind':<12} {'utterance':<48} {'intent':<12} {'us/lookup':>9}")
+    hits = total = 0
+    for kind, utterances in UTTERANCES.items():
+        for text in utterances:
+            intent = matcher.classify(text)
+            cost = per_call_us(lambda: matcher.classify(text), args.lookups)
+            print(f"{kind:<12} {text[:48]:<48} {intent or '-':<12} {cost:>9.2f}")
+            hits += intent is not None
+            total += 1
+    print(f"\nHit ratio over the sample: {hits}/{total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tail-latency benchmark for hedged upstream requests
+Runs two local stub endpoints with a slow tail and compares hedging on/off
+Author: ConversAI MVP
+Run: python bench_hedging.py [--requests 400] [--slow-rate 0.05]
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import upstream
+from upstream import EndpointPool
+
+
+def start_stub(fast_seconds, slow_seconds, slow_rate, seed, text="stub reply"):
+    """Start a stub inference endpoint on a free port and return its URL"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                slow = rng.random() < slow_rate
+            time.sleep(slow_seconds if slow else fast_seconds * rng.uniform(0.8, 1.2))
+            body = json.dumps([{"generated_text": text, "details": {"finish_reason": "stop_sequence"}}]).encode()
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # a hedge loser the client aborted
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(urls, hedge_budget, requests_count):
+    pool = EndpointPool(urls, hedge_budget=hedge_budget)
+    hedges_before = pool.stats()["hedges"]
+    latencies = []
+    for _ in range(requests_count):
+        start_time = time.perf_counter()
+        pool.post({}, {"inputs": "hello"}, timeout=10)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    extra = (pool.stats()["hedges"] - hedges_before) / requests_count
+    return percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99), extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hedged upstream requests")
+    parser.add_argument("--requests", type=int, default=400, help="sequential requests per run")
+    parser.add_argument("--fast-ms", type=float, default=20, help="typical endpoint latency")
+    parser.add_argument("--slow-ms", type=float, default=500, help="tail endpoint latency")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fraction of slow responses")
+    parser.add_argument("--budget", type=float, default=0.1, help="hedge budget for the hedged run")
+    args = parser.parse_args()
+
+    upstream.HEDGE_DELAY_SECONDS = args.fast_ms * 2 / 1000
+    urls = [
+        start_stub(args.fast_ms / 1000, args.slow_ms / 1000, args.slow_rate, seed)
+        for seed in (1, 2)
+    ]
+
+    print(f"{'mode':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'extra calls':>12}")
+    for mode, budget in (("no hedge", 0.0), ("hedged", args.budget)):
+        p50, p95, p99, extra = run(urls, budget, args.requests)
+        print(f"{mode:<10} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {extra:>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
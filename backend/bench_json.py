@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+JSON serialization benchmark for ConversAI MVP
+Compares how history responses are built (rows -> dicts -> stdlib json, as
+before; rows -> dicts -> json_codec; rows -> JSON in SQLite, spliced) and how
+fast request/upstream bodies parse, for large history payloads
+Author: ConversAI MVP
+Run: python bench_json.py [--turns 100 1000 5000]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import database
+import json_codec
+
+
+def per_call_ms(operation, min_seconds: float = 0.5) -> float:
+    calls, start_time = 0, time.perf_counter()
+    while True:
+        operation()
+        calls += 1
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= min_seconds:
+            return elapsed / calls * 1000
+
+
+def fill_session(session_id: str, turns: int):
+    rows = [(session_id, f"Can you tell me about topic number {i}? I'd like a short answer.",
+             f"Sure! Topic {i} is an interesting one. " * 6, None) for i in range(turns)]
+    database.insert_conversations(rows)
+
+
+def history_builders(session_id: str, limit: int) -> dict:
+    envelope = {"session_id": session_id, "last_id": 0, "has_more": False}
+
+    def as_dicts():
+        return [{"id": conv[0], "user_input": conv[2], "bot_response": conv[3], "timestamp": conv[4]}
+                for conv in database.get_recent(session_id, limit)]
+
+    return {
+        # What /api/history did before: tuples -> dicts -> Flask's stdlib provider
+        "dicts + stdlib json": lambda: json.dumps({**envelope, "conversations": as_dicts()},
+                                                  sort_keys=True).encode("utf-8"),
+        f"dicts + {json_codec.BACKEND}": lambda: json_codec.dumps({**envelope, "conversations": as_dicts()}),
+        "SQLite JSON, spliced": lambda: json_codec.dumps_with_raw(
+            envelope, conversations=database.get_recent_json(session_id, limit)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization of history payloads")
+    parser.add_argument("--turns", type=int, nargs="+", default=[20, 200, 2000], help="turns per history response")
+    args = parser.parse_args()
+
+    print(f"JSON codec: {json_codec.BACKEND}\n")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "conversations.db")
+        database.DB_SHARDS = 1
+        database.init_db()
+
+        print(f"{'turns':>6} {'method':<24} {'ms/response':>12} {'KB':>8}")
+        for turns in args.turns:
+            session_id = f"bench_{turns}"
+            fill_session(session_id, turns)
+            for name, build in history_builders(session_id, turns).items():
+                size = len(build()) / 1024
+                print(f"{turns:>6} {name:<24} {per_call_ms(build):>12.3f} {size:>8.1f}")
+            print()
+
+        body = json.dumps({"message": "What's the weather like today?", "session_id": "session_1",
+                           "profile": "voice-fast"}).encode()
+        reply = json.dumps([{"generated_text": "It looks sunny. " * 40,
+                             "details": {"finish_reason": "eos_token", "generated_tokens": 160}}]).encode()
+        print(f"{'parse':<30} {'stdlib us':>10} {json_codec.BACKEND + ' us':>12}")
+        for name, data in (("chat request body", body), ("upstream reply", reply)):
+            stdlib = per_call_ms(lambda: json.loads(data), 0.2) * 1000
+            codec = per_call_ms(lambda: json_codec.loads(data), 0.2) * 1000
+            print(f"{name:<30} {stdlib:>10.2f} {codec:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
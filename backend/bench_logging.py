@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Per-request logging overhead benchmark
+Compares the old synchronous f-string chat logs with the structured pipeline
+Author: ConversAI MVP
+Run: python bench_logging.py [--requests 20000] [--payload-chars 600]
+"""
+
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import QueueListener
+
+from structured_logging import JsonFormatter, RateLimitFilter, AsyncQueueHandler
+
+
+def build_logger(mode, path):
+    """Return (logger, listener) writing to path in the given mode"""
+    logger = logging.getLogger(f"bench.{mode}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    output = logging.FileHandler(path)
+    listener = None
+
+    if mode == "sync-text":
+        output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+        handler = output
+    elif mode == "sync-json":
+        output.setFormatter(JsonFormatter())
+        handler = output
+    else:
+        output.setFormatter(JsonFormatter())
+        handler = AsyncQueueHandler(queue.Queue())
+        listener = QueueListener(handler.queue, output)
+    handler.addFilter(RateLimitFilter())
+    logger.addHandler(handler)
+    return logger, listener
+
+
+def chat_turn_logs(logger, mode, session_id, user_message, bot_response):
+    """The two log lines /api/chat writes per turn, old style vs structured"""
+    if mode == "sync-text":
+        logger.info(f"Received message: '{user_message}' for session: {session_id}")
+        logger.info(f"Generated response: '{bot_response}'")
+    else:
+        logger.info("Received message", extra={"fields": {"session_id": session_id, "user_message": user_message}})
+        logger.info("Generated response", extra={"fields": {"session_id": session_id, "bot_reply": bot_response}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request logging overhead")
+    parser.add_argument("--requests", type=int, default=20000, help="simulated chat turns")
+    parser.add_argument("--payload-chars", type=int, default=600, help="length of message and reply")
+    args = parser.parse_args()
+
+    user_message = "u" * args.payload_chars
+    bot_response = "b" * args.payload_chars
+
+    # Request-thread cost is timed with the async listener paused, so it is not
+    # charged for the listener's work. On a busy single core that work competes
+    # for the GIL, so the listener's drain time is reported separately.
+    print(f"{'mode':<12} {'request us':>11} {'drain us':>9} {'log bytes/request':>18}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ("sync-text", "sync-json", "async-json"):
+            path = os.path.join(tmp_dir, f"{mode}.log")
+            logger, listener = build_logger(mode, path)
+
+            start_time = time.perf_counter()
+            for i in range(args.requests):
+                chat_turn_logs(logger, mode, f"session_{i % 100}", user_message, bot_response)
+            elapsed = time.perf_counter() - start_time
+
+            drain = 0.0
+            if listener is not None:
+                start_time = time.perf_counter()
+                listener.start()
+                listener.stop()
+                drain = time.perf_counter() - start_time
+            for handler in logger.handlers:
+                handler.close()
+            size = os.path.getsize(path)
+            print(f"{mode:<12} {elapsed / args.requests * 1e6:>11.1f} {drain / args.requests * 1e6:>9.1f} "
+                  f"{size / args.requests:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
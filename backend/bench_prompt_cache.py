@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Lookup latency benchmark for the near-duplicate prompt cache
+Fills the cache with synthetic prompts and times hits and misses
+Author: ConversAI MVP
+Run: python bench_prompt_cache.py [--entries 100000] [--lookups 2000]
+"""
+
+import argparse
+import random
+import time
+
+from prompt_cache import PromptCache
+
+FUNCTION_WORDS = (
+    "what who how why when where is are the a my your name tell me about can you "
+    "please do i to of in for on with it this that"
+).split()
+VOCABULARY_SIZE = 5000
+
+
+def build_vocabulary(rng):
+    """Function words first, then pseudo-words, so Zipf sampling favours the former"""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = list(FUNCTION_WORDS)
+    while len(words) < VOCABULARY_SIZE:
+        words.append("".join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    return words, weights
+
+
+def random_prompt(rng, vocabulary):
+    words, weights = vocabulary
+    return " ".join(rng.choices(words, weights, k=rng.randint(3, 10)))
+
+
+def transcription_noise(rng, prompt):
+    """Drop, duplicate or swap one character, like a misheard transcript"""
+    i = rng.randrange(len(prompt) - 1)
+    edit = rng.randrange(3)
+    if edit == 0:
+        return prompt[:i] + prompt[i + 1:]
+    if edit == 1:
+        return prompt[:i] + prompt[i] + prompt[i:]
+    return prompt[:i] + prompt[i + 1] + prompt[i] + prompt[i + 2:]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt cache lookups")
+    parser.add_argument("--entries", type=int, default=100000, help="entries to preload")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups to time per case")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = build_vocabulary(rng)
+    cache = PromptCache(capacity=args.entries)
+    prompts = list({random_prompt(rng, vocabulary) for _ in range(args.entries)})
+
+    start_time = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        cache.put(prompt, f"reply {i}")
+    fill_time = time.perf_counter() - start_time
+    print(f"Filled {len(cache)} entries in {fill_time:.1f}s ({fill_time / len(cache) * 1e6:.0f}us/put)")
+
+    cases = {
+        "hit (exact)": [rng.choice(prompts) for _ in range(args.lookups)],
+        "hit (noisy)": [transcription_noise(rng, rng.choice(prompts)) for _ in range(args.lookups)],
+        "miss": [random_prompt(rng, vocabulary) for _ in range(args.lookups)],
+    }
+    for name, queries in cases.items():
+        latencies = []
+        hits = 0
+        for query in queries:
+            start_time = time.perf_counter()
+            hits += cache.get(query) is not None
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        print(f"{name:<12} hit rate {hits / len(queries):6.1%}  "
+              f"p50 {percentile(latencies, 50):.3f}ms  p99 {percentile(latencies, 99):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
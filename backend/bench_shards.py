@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Write-throughput benchmark for sharded conversation storage
+Runs concurrent writer processes against 1..N shards and reports rows/sec
+Author: ConversAI MVP
+Run: python bench_shards.py [--writers 8] [--rows 500] [--shards 1 2 4 8]
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+
+import database
+
+
+def _writer(db_path, shards, rows, sessions, results):
+    """Insert rows through save_conversation, spreading them over sessions"""
+    database.DB_PATH = db_path
+    database.DB_SHARDS = shards
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    failures = 0
+    for i in range(rows):
+        if not database.save_conversation(session_ids[i % sessions], "benchmark prompt", "benchmark reply"):
+            failures += 1
+    results.put(failures)
+
+
+def run_benchmark(shards, writers, rows, sessions):
+    """Return (rows_per_second, failures) for one shard count"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "conversations.db")
+        database.DB_SHARDS = shards
+        database.init_db()
+
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=_writer, args=(database.DB_PATH, shards, rows, sessions, results))
+            for _ in range(writers)
+        ]
+        start_time = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        failures = sum(results.get() for _ in procs)
+        for proc in procs:
+            proc.join()
+        elapsed = time.perf_counter() - start_time
+
+    return (writers * rows - failures) / elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharded SQLite write throughput")
+    parser.add_argument("--writers", type=int, default=8, help="concurrent writer processes")
+    parser.add_argument("--rows", type=int, default=500, help="rows written by each writer")
+    parser.add_argument("--sessions", type=int, default=64, help="sessions per writer")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="shard counts to compare")
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers x {args.rows} rows each")
+    print(f"{'shards':>8} {'rows/sec':>12} {'speedup':>9} {'failed':>8}")
+    baseline = None
+    for shards in args.shards:
+        throughput, failures = run_benchmark(shards, args.writers, args.rows, args.sessions)
+        baseline = baseline or throughput
+        print(f"{shards:>8} {throughput:>12.0f} {throughput / baseline:>8.2f}x {failures:>8}")
+
+
+if __name__ == "__main__":
+    main()
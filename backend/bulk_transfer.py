@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Bulk export/import of conversations for ConversAI MVP
+Streams rows between conversations.db (any shard layout) and gzip-compressed
+JSONL or CSV files in bounded chunks, so memory use stays flat however large
+the table is. Exports can be incremental from a per-shard id watermark.
+Author: ConversAI MVP
+Run: python bulk_transfer.py export conversations.jsonl.gz [--since 0,0]
+     python bulk_transfer.py import conversations.jsonl.gz
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import sys
+from typing import Iterator, List, Optional
+
+import database
+
+FIELDS = ["shard", "id", "session_id", "user_input", "bot_response", "timestamp",
+          "upstream_ms", "total_ms", "retries", "cache_hit", "tokens"]
+PERFORMANCE_FIELDS = FIELDS[6:]
+
+
+def detect_format(path: str, fmt: Optional[str]) -> str:
+    """Pick jsonl or csv from --format or the file name"""
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "jsonl"
+
+
+def open_file(path: str, mode: str):
+    """Open a text file, gzip-compressed if its name ends in .gz; '-' is stdin/stdout"""
+    if path == "-":
+        return sys.stdout if mode == "w" else sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="", compresslevel=6)
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def parse_watermark(value: Optional[str]) -> Optional[List[int]]:
+    """'120,340' -> [120, 340] (one id per shard)"""
+    if not value:
+        return None
+    return [int(part) for part in value.split(",")]
+
+
+def export_rows(path: str, fmt: str, since_ids: Optional[List[int]] = None,
+                chunk_size: int = 1000) -> tuple:
+    """
+    Write every row newer than the watermark to path
+
+    Returns:
+        Tuple of (rows written, next watermark as a per-shard id list)
+    """
+    # Databases from before the performance columns are migrated first (not
+    # init_db(): it prints to stdout, which may be the export stream)
+    for shard_path in database.shard_paths():
+        database._create_schema(shard_path)
+    watermark = list(since_ids or [0] * len(database.shard_paths()))
+    written = 0
+    out = open_file(path, "w")
+    try:
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(FIELDS)
+            write = writer.writerow
+        else:
+            def write(row):
+                out.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False))
+                out.write("\n")
+
+        for row in database.iter_conversations(watermark, chunk_size):
+            write(row)
+            watermark[row[0]] = row[1]
+            written += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return written, watermark
+
+
+def read_rows(path: str, fmt: str) -> Iterator[tuple]:
+    """
+    Yield (session_id, user_input, bot_response, timestamp, upstream_ms,
+    total_ms, retries, cache_hit, tokens) from an export file
+
+    Files exported before the performance columns existed import with NULLs.
+    """
+    source = open_file(path, "r")
+    try:
+        records = csv.DictReader(source) if fmt == "csv" else (json.loads(line) for line in source if line.strip())
+        for record in records:
+            # CSV has no NULL: empty cells are missing values (SQLite converts numeric text)
+            yield (record["session_id"], record["user_input"], record["bot_response"],
+                   record.get("timestamp") or None,
+                   *(record.get(name) if record.get(name) != "" else None for name in PERFORMANCE_FIELDS))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream conversations to or from JSONL/CSV files")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("file", help="file to write or read ('-' for stdout/stdin; .gz is compressed)")
+    parser.add_argument("--db", default=database.DB_PATH, help="database path")
+    parser.add_argument("--shards", type=int, default=database.DB_SHARDS, help="shard count of --db")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="default: from the file name")
+    parser.add_argument("--since", help="export only rows after this watermark, e.g. 120 or 120,340 when sharded")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="rows per read query (export, default 1000) or per transaction (import, default 10000)")
+    args = parser.parse_args()
+
+    database.DB_PATH = args.db
+    database.DB_SHARDS = args.shards
+    fmt = detect_format(args.file, args.format)
+
+    if args.command == "export":
+        written, watermark = export_rows(args.file, fmt, parse_watermark(args.since), args.chunk_size or 1000)
+        print(f"Exported {written} rows; next incremental export: --since {','.join(map(str, watermark))}",
+              file=sys.stderr)
+    else:
+        database.init_db()
+        inserted = database.insert_conversations(read_rows(args.file, fmt), args.chunk_size or 10000)
+        print(f"Imported {inserted} rows into {args.db}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
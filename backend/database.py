@@ -7,15 +7,218 @@ Run: python -c "from database import init_db; init_db()"
 
 import sqlite3
 import os
+import sys
+import zlib
+import logging
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Tuple, Optional
 
+logger = logging.getLogger(__name__)
+
 DB_PATH = "conversations.db"
 
-def init_db():
-    """Initialize the SQLite database with conversations table"""
-    conn = sqlite3.connect(DB_PATH)
+# Optional sharded storage: with DB_SHARDS > 1 conversations are spread over
+# N database files and each session is routed to one of them by a stable hash
+# of its session_id. SQLite allows a single writer per file, so this lets
+# concurrent workers write to different shards without waiting on one lock.
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+
+def shard_index(session_id: str, shards: Optional[int] = None) -> int:
+    """Return the shard owning a session (stable across processes and restarts)"""
+    shards = shards or DB_SHARDS
+    if shards <= 1:
+        return 0
+    return zlib.crc32(session_id.encode("utf-8")) % shards
+
+def shard_paths(shards: Optional[int] = None) -> List[str]:
+    """Return the database file of every shard, in shard order"""
+    shards = shards or DB_SHARDS
+    if shards <= 1:
+        return [DB_PATH]
+    root, ext = os.path.splitext(DB_PATH)
+    return [f"{root}_shard{i}{ext}" for i in range(shards)]
+
+def get_db_path(session_id: str) -> str:
+    """Return the database file that stores a session"""
+    return shard_paths()[shard_index(session_id)]
+
+# Per-turn performance columns, added to existing databases on startup
+PERFORMANCE_COLUMNS = {
+    "upstream_ms": "REAL",       # time spent waiting on the inference API
+    "total_ms": "REAL",          # request received -> reply ready
+    "retries": "INTEGER",        # upstream attempts beyond the first
+    "cache_hit": "INTEGER",      # 1 if answered from the prompt cache
+    "tokens": "INTEGER",         # tokens generated
+}
+
+# Hourly and daily rollups are kept up to date by a trigger on every insert, so
+# /api/stats reads a handful of rows whatever the table size. Latency
+# percentiles come from per-bucket histograms with these upper bounds (ms).
+LATENCY_BOUNDS_MS = (25, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 30000, 60000)
+ROLLUP_PERIODS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}
+
+def _latency_bucket_sql(column: str) -> str:
+    """SQL expression mapping a latency to its histogram bucket index"""
+    cases = " ".join(f"WHEN {column} <= {bound} THEN {i}" for i, bound in enumerate(LATENCY_BOUNDS_MS))
+    return f"CASE {cases} ELSE {len(LATENCY_BOUNDS_MS)} END"
+
+def _rollup_trigger_sql() -> str:
+    statements = []
+    for period, fmt in ROLLUP_PERIODS.items():
+        statements.append(f'''
+            INSERT INTO turn_rollups (period, bucket, turns, timed_turns, upstream_turns, cache_hits,
+                                      retries, retried_turns, tokens, total_ms_sum, upstream_ms_sum)
+            VALUES ('{period}', strftime('{fmt}', NEW.timestamp), 1, NEW.total_ms IS NOT NULL,
+                    NEW.upstream_ms IS NOT NULL, COALESCE(NEW.cache_hit, 0), COALESCE(NEW.retries, 0), COALESCE(NEW.retries, 0) > 0,
+                    COALESCE(NEW.tokens, 0), COALESCE(NEW.total_ms, 0), COALESCE(NEW.upstream_ms, 0))
+            ON CONFLICT (period, bucket) DO UPDATE SET
+                turns = turns + 1,
+                timed_turns = timed_turns + excluded.timed_turns,
+                upstream_turns = upstream_turns + excluded.upstream_turns,
+                cache_hits = cache_hits + excluded.cache_hits,
+                retries = retries + excluded.retries,
+                retried_turns = retried_turns + excluded.retried_turns,
+                tokens = tokens + excluded.tokens,
+                total_ms_sum = total_ms_sum + excluded.total_ms_sum,
+                upstream_ms_sum = upstream_ms_sum + excluded.upstream_ms_sum;
+            INSERT INTO turn_latency_rollups (period, bucket, le_index, count)
+            SELECT '{period}', strftime('{fmt}', NEW.timestamp), {_latency_bucket_sql("NEW.total_ms")}, 1
+            WHERE NEW.total_ms IS NOT NULL
+            ON CONFLICT (period, bucket, le_index) DO UPDATE SET count = count + 1;''')
+    return "CREATE TRIGGER IF NOT EXISTS conversations_rollup AFTER INSERT ON conversations BEGIN" + \
+        "".join(statements) + "\nEND"
+
+def _backfill_rollups(cursor: sqlite3.Cursor, after_id: int = 0,
+                      session_id: Optional[str] = None, sign: int = 1):
+    """Add rows with id > after_id (optionally of one session) to the rollups in one pass, or subtract them with sign=-1"""
+    # One scan groups the new rows by hour and latency bucket; the hourly and
+    # daily rollups and histograms are then summed from that small table.
+    where, params = "id > ?", (after_id,)
+    if session_id is not None:
+        where, params = "session_id = ? AND id > ?", (session_id, after_id)
+    cursor.execute("DROP TABLE IF EXISTS temp.rollup_delta")
+    cursor.execute(f'''
+        CREATE TEMP TABLE rollup_delta AS
+        SELECT strftime('{ROLLUP_PERIODS["hour"]}', timestamp) AS hour,
+               CASE WHEN total_ms IS NULL THEN NULL ELSE {_latency_bucket_sql("total_ms")} END AS le_index,
+               COUNT(*) AS turns, COUNT(total_ms) AS timed_turns, COUNT(upstream_ms) AS upstream_turns,
+               TOTAL(cache_hit) AS cache_hits, TOTAL(retries) AS retries,
+               SUM(COALESCE(retries, 0) > 0) AS retried_turns, TOTAL(tokens) AS tokens,
+               TOTAL(total_ms) AS total_ms_sum, TOTAL(upstream_ms) AS upstream_ms_sum
+        FROM conversations
+        WHERE {where}
+        GROUP BY 1, 2
+    ''', params)
+    buckets = {"hour": "hour", "day": "substr(hour, 1, 10)"}  # '%Y-%m-%d %H:00' -> '%Y-%m-%d'
+    for period, bucket in buckets.items():
+        cursor.execute(f'''
+            INSERT INTO turn_rollups (period, bucket, turns, timed_turns, upstream_turns, cache_hits,
+                                      retries, retried_turns, tokens, total_ms_sum, upstream_ms_sum)
+            SELECT '{period}', {bucket}, {sign} * SUM(turns), {sign} * SUM(timed_turns), {sign} * SUM(upstream_turns),
+                   {sign} * SUM(cache_hits), {sign} * SUM(retries), {sign} * SUM(retried_turns), {sign} * SUM(tokens),
+                   {sign} * SUM(total_ms_sum), {sign} * SUM(upstream_ms_sum)
+            FROM rollup_delta
+            WHERE true
+            GROUP BY 2
+            ON CONFLICT (period, bucket) DO UPDATE SET
+                turns = turns + excluded.turns,
+                timed_turns = timed_turns + excluded.timed_turns,
+                upstream_turns = upstream_turns + excluded.upstream_turns,
+                cache_hits = cache_hits + excluded.cache_hits,
+                retries = retries + excluded.retries,
+                retried_turns = retried_turns + excluded.retried_turns,
+                tokens = tokens + excluded.tokens,
+                total_ms_sum = total_ms_sum + excluded.total_ms_sum,
+                upstream_ms_sum = upstream_ms_sum + excluded.upstream_ms_sum
+        ''')
+        cursor.execute(f'''
+            INSERT INTO turn_latency_rollups (period, bucket, le_index, count)
+            SELECT '{period}', {bucket}, le_index, {sign} * SUM(timed_turns)
+            FROM rollup_delta
+            WHERE le_index IS NOT NULL
+            GROUP BY 2, 3
+            ON CONFLICT (period, bucket, le_index) DO UPDATE SET count = count + excluded.count
+        ''')
+    cursor.execute("DROP TABLE temp.rollup_delta")
+
+# Each bulk load that has dropped the trigger leaves a row here (its pid and the
+# last id rolled up before it started), so a schema run during the load knows
+# not to recreate the trigger and whoever finishes last knows where to catch up.
+DEFERRALS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS rollup_deferrals (
+        id INTEGER PRIMARY KEY,
+        pid INTEGER NOT NULL,
+        after_id INTEGER NOT NULL
+    )
+'''
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _resume_rollups(cursor: sqlite3.Cursor, finished: Optional[int] = None):
+    """Recreate the rollup trigger unless a running bulk load still defers it"""
+    # Rows added since the earliest deferral are rolled up first. Deferrals
+    # whose process died are treated as finished, so a crashed load is caught
+    # up by the next schema run instead of leaving the trigger dropped.
+    if finished is not None:
+        cursor.execute("UPDATE rollup_deferrals SET pid = 0 WHERE id = ?", (finished,))
+    deferrals = cursor.execute("SELECT pid, after_id FROM rollup_deferrals").fetchall()
+    if any(pid and _pid_alive(pid) for pid, _ in deferrals):
+        return
+    if deferrals:
+        _backfill_rollups(cursor, min(after_id for _, after_id in deferrals))
+        cursor.execute("DELETE FROM rollup_deferrals")
+    cursor.execute(_rollup_trigger_sql())
+
+@contextmanager
+def rollups_deferred(paths: Optional[List[str]] = None):
+    """
+    Suspend the per-row rollup trigger for a bulk load, then catch up in one pass
+    
+    The trigger costs four upserts per row; bulk loaders insert with it dropped
+    and every row added meanwhile (by anyone) is rolled up on exit, before the
+    trigger is recreated in the same transaction. The deferral is recorded in
+    the database, so init_db() in another worker leaves the trigger dropped
+    until the load ends (rows are never rolled up twice).
+    """
+    paths = paths or shard_paths()
+    deferrals = []
+    for path in paths:
+        conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(DEFERRALS_TABLE_SQL)
+        conn.execute("DROP TRIGGER IF EXISTS conversations_rollup")
+        after_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversations").fetchone()[0]
+        deferrals.append(conn.execute(
+            "INSERT INTO rollup_deferrals (pid, after_id) VALUES (?, ?)", (os.getpid(), after_id)
+        ).lastrowid)
+        conn.execute("COMMIT")
+        conn.close()
+    try:
+        yield
+    finally:
+        for path, deferral in zip(paths, deferrals):
+            conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            _resume_rollups(cursor, finished=deferral)
+            cursor.execute("COMMIT")
+            conn.close()
+
+def _create_schema(path: str):
+    """Create the conversations table (and its rollups) in a single database file"""
+    # Every worker runs this at import: take the write lock before reading the
+    # schema so only the first one migrates and the others see its result
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
     cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
     
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS conversations (
@@ -26,12 +229,64 @@ def init_db():
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(conversations)")}
+    for column, column_type in PERFORMANCE_COLUMNS.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE conversations ADD COLUMN {column} {column_type}")
+    # Per-session lookups (history, delta sync, last turn id) read the index, not the table
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversations_session
+        ON conversations (session_id, id)
+    ''')
+    
+    has_rollups = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'turn_rollups'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS turn_rollups (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            turns INTEGER NOT NULL DEFAULT 0,
+            timed_turns INTEGER NOT NULL DEFAULT 0,
+            upstream_turns INTEGER NOT NULL DEFAULT 0,
+            cache_hits INTEGER NOT NULL DEFAULT 0,
+            retries INTEGER NOT NULL DEFAULT 0,
+            retried_turns INTEGER NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            total_ms_sum REAL NOT NULL DEFAULT 0,
+            upstream_ms_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS turn_latency_rollups (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            le_index INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, le_index)
+        )
+    ''')
+    cursor.execute(DEFERRALS_TABLE_SQL)
+    if not has_rollups:
+        _backfill_rollups(cursor)
+    _resume_rollups(cursor)
     
-    conn.commit()
+    cursor.execute("COMMIT")
     conn.close()
-    print(f"Database initialized at {DB_PATH}")
 
-def save_conversation(session_id: str, user_input: str, bot_response: str) -> bool:
+def init_db():
+    """Initialize the SQLite database (every shard) with conversations table"""
+    for path in shard_paths():
+        _create_schema(path)
+    if DB_SHARDS > 1:
+        print(f"Database initialized with {DB_SHARDS} shards at {DB_PATH}")
+    else:
+        print(f"Database initialized at {DB_PATH}")
+
+def save_conversation(session_id: str, user_input: str, bot_response: str,
+                      upstream_ms: Optional[float] = None, total_ms: Optional[float] = None,
+                      retries: int = 0, cache_hit: bool = False, tokens: Optional[int] = None) -> bool:
     """
     Save a conversation turn to the database
     
@@ -39,76 +294,527 @@ def save_conversation(session_id: str, user_input: str, bot_response: str) -> bo
         session_id: Unique identifier for the conversation session
         user_input: What the user said
         bot_response: What the bot replied
+        upstream_ms: Time spent waiting on the inference API
+        total_ms: Time from receiving the request to having the reply
+        retries: Upstream attempts beyond the first
+        cache_hit: Whether the reply came from the prompt cache
+        tokens: Tokens generated
         
     Returns:
         bool: True if successful, False otherwise
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(get_db_path(session_id))
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO conversations (session_id, user_input, bot_response)
-            VALUES (?, ?, ?)
-        ''', (session_id, user_input, bot_response))
+            INSERT INTO conversations (session_id, user_input, bot_response,
+                                       upstream_ms, total_ms, retries, cache_hit, tokens)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (session_id, user_input, bot_response, upstream_ms, total_ms, retries, int(cache_hit), tokens))
         
         conn.commit()
         conn.close()
         return True
     except Exception as e:
-        print(f"Error saving conversation: {e}")
+        logger.error("Error saving conversation: %s", e)
         return False
 
-def get_recent(session_id: str, limit: int = 10) -> List[Tuple]:
+def delete_session(session_id: str) -> int:
+    """
+    Delete every turn of a session and take them out of the rollups
+    
+    Returns:
+        int: Number of turns deleted (0 on error)
+    """
+    try:
+        conn = sqlite3.connect(get_db_path(session_id), timeout=60, isolation_level=None)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            _backfill_rollups(cursor, session_id=session_id, sign=-1)
+            cursor.execute("DELETE FROM turn_rollups WHERE turns <= 0")
+            cursor.execute("DELETE FROM turn_latency_rollups WHERE count <= 0")
+            deleted = cursor.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,)).rowcount
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return deleted
+    except Exception as e:
+        logger.error("Error deleting session: %s", e)
+        return 0
+
+def get_recent(session_id: str, limit: int = 10, max_id: Optional[int] = None) -> List[Tuple]:
     """
     Get recent conversations for a session
     
     Args:
         session_id: Session to retrieve conversations for
         limit: Maximum number of conversations to return
+        max_id: Ignore turns newer than this id (e.g. saved after an ETag was computed)
         
     Returns:
         List of tuples: (id, session_id, user_input, bot_response, timestamp)
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(get_db_path(session_id))
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT id, session_id, user_input, bot_response, timestamp
             FROM conversations
-            WHERE session_id = ?
-            ORDER BY timestamp DESC
+            WHERE session_id = ? AND (? IS NULL OR id <= ?)
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
-        ''', (session_id, limit))
+        ''', (session_id, max_id, max_id, limit))
         
         results = cursor.fetchall()
         conn.close()
         return results
     except Exception as e:
-        print(f"Error retrieving conversations: {e}")
+        logger.error("Error retrieving conversations: %s", e)
         return []
 
-def get_all_sessions() -> List[str]:
-    """Get all unique session IDs from the database"""
+def get_last_turn_id(session_id: str) -> Optional[int]:
+    """
+    Get the id of a session's newest turn (an index lookup; no rows are read)
+    
+    Returns:
+        int: Last turn id, 0 if the session has no turns, None on error
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(get_db_path(session_id))
+        row = conn.execute(
+            "SELECT MAX(id) FROM conversations WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        conn.close()
+        return row[0] or 0
+    except Exception as e:
+        logger.error("Error retrieving last turn id: %s", e)
+        return None
+
+def get_since(session_id: str, since_id: int, limit: int = 20,
+              max_id: Optional[int] = None) -> List[Tuple]:
+    """
+    Get the turns of a session newer than since_id, oldest first
+    
+    Args:
+        session_id: Session to retrieve conversations for
+        since_id: Last turn id the caller already has
+        limit: Maximum number of turns to return (the oldest ones, so the
+            caller can continue from the last id returned without gaps)
+        max_id: Ignore turns newer than this id
+        
+    Returns:
+        List of tuples: (id, session_id, user_input, bot_response, timestamp)
+    """
+    try:
+        conn = sqlite3.connect(get_db_path(session_id))
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT DISTINCT session_id
+            SELECT id, session_id, user_input, bot_response, timestamp
             FROM conversations
-            ORDER BY timestamp DESC
-        ''')
+            WHERE session_id = ? AND id > ? AND (? IS NULL OR id <= ?)
+            ORDER BY id
+            LIMIT ?
+        ''', (session_id, since_id, max_id, max_id, limit))
         
-        results = [row[0] for row in cursor.fetchall()]
+        results = cursor.fetchall()
         conn.close()
         return results
     except Exception as e:
-        print(f"Error retrieving sessions: {e}")
+        logger.error("Error retrieving conversations: %s", e)
+        return []
+
+# Rows as one JSON array built by SQLite, so history responses are serialized
+# straight from the rows without a Python tuple or dict per turn. The row
+# subquery's ORDER BY ... LIMIT keeps SQLite from flattening it, so rows reach
+# json_group_array in that order.
+_TURNS_AS_JSON = '''
+    SELECT json_group_array(json_object(
+               'id', id, 'user_input', user_input, 'bot_response', bot_response, 'timestamp', timestamp
+           )), MAX(id)
+    FROM ({rows})
+'''
+
+def _turns_json(session_id: str, rows_sql: str, params: tuple) -> Tuple[Optional[str], int]:
+    try:
+        conn = sqlite3.connect(get_db_path(session_id))
+        turns, highest_id = conn.execute(_TURNS_AS_JSON.format(rows=rows_sql), params).fetchone()
+        conn.close()
+        return turns, highest_id or 0
+    except Exception as e:
+        logger.error("Error retrieving conversations: %s", e)
+        return None, 0
+
+def get_recent_json(session_id: str, limit: int = 10, max_id: Optional[int] = None) -> Optional[str]:
+    """
+    Same turns as get_recent, as a JSON array of {id, user_input, bot_response, timestamp}
+    
+    Returns:
+        str: JSON array text (newest first), or None on error
+    """
+    turns, _ = _turns_json(session_id, '''
+        SELECT id, user_input, bot_response, timestamp
+        FROM conversations
+        WHERE session_id = ? AND (? IS NULL OR id <= ?)
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', (session_id, max_id, max_id, limit))
+    return turns
+
+def get_since_json(session_id: str, since_id: int, limit: int = 20,
+                   max_id: Optional[int] = None) -> Tuple[Optional[str], int]:
+    """
+    Same turns as get_since (the oldest ones after since_id), as a JSON array
+    
+    Returns:
+        Tuple of (JSON array text newest first or None on error, highest id returned or 0)
+    """
+    return _turns_json(session_id, '''
+        SELECT * FROM (
+            SELECT id, user_input, bot_response, timestamp
+            FROM conversations
+            WHERE session_id = ? AND id > ? AND (? IS NULL OR id <= ?)
+            ORDER BY id
+            LIMIT ?
+        )
+        ORDER BY id DESC
+    ''', (session_id, since_id, max_id, max_id, limit))
+
+def get_all_sessions() -> List[str]:
+    """Get all unique session IDs from the database (fans out over all shards)"""
+    try:
+        latest = []
+        for path in shard_paths():
+            conn = sqlite3.connect(path)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT session_id, MAX(timestamp) AS last_seen
+                FROM conversations
+                GROUP BY session_id
+            ''')
+            
+            latest.extend(cursor.fetchall())
+            conn.close()
+        
+        latest.sort(key=lambda row: row[1] or "", reverse=True)
+        return [row[0] for row in latest]
+    except Exception as e:
+        logger.error("Error retrieving sessions: %s", e)
         return []
 
+def _histogram_percentile(counts: List[int], quantile: float) -> Optional[float]:
+    """Estimate a percentile (ms) from latency histogram counts, interpolating within a bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if index == len(LATENCY_BOUNDS_MS):  # overflow bucket: no upper bound to interpolate to
+                return float(LATENCY_BOUNDS_MS[-1])
+            lower = LATENCY_BOUNDS_MS[index - 1] if index else 0
+            return round(lower + (LATENCY_BOUNDS_MS[index] - lower) * (rank - seen) / count, 1)
+        seen += count
+    return float(LATENCY_BOUNDS_MS[-1])
+
+def get_turn_stats(period: str = "hour", buckets: int = 24) -> dict:
+    """
+    Per-period turn counts, throughput, cache/retry rates and latency percentiles
+    
+    Reads only the rollup rows of the most recent buckets (a few per shard),
+    so the cost does not depend on how many conversations are stored.
+    
+    Args:
+        period: "hour" or "day"
+        buckets: Number of most recent buckets to return
+        
+    Returns:
+        {"period", "buckets": [...newest first], "overall": {...}}
+    """
+    if period not in ROLLUP_PERIODS:
+        raise ValueError(f"period must be one of {', '.join(ROLLUP_PERIODS)}")
+    
+    fields = ("turns", "timed_turns", "upstream_turns", "cache_hits", "retries", "retried_turns",
+              "tokens", "total_ms_sum", "upstream_ms_sum")
+    merged = {}
+    try:
+        for path in shard_paths():
+            if not os.path.exists(path):
+                continue
+            conn = sqlite3.connect(path)
+            try:
+                rows = conn.execute(f'''
+                    SELECT bucket, {", ".join(fields)}
+                    FROM turn_rollups
+                    WHERE period = ?
+                    ORDER BY bucket DESC
+                    LIMIT ?
+                ''', (period, buckets)).fetchall()
+                for row in rows:
+                    entry = merged.setdefault(row[0], {"sums": [0] * len(fields),
+                                                       "latency": [0] * (len(LATENCY_BOUNDS_MS) + 1)})
+                    entry["sums"] = [a + b for a, b in zip(entry["sums"], row[1:])]
+                if rows:
+                    histogram = conn.execute('''
+                        SELECT bucket, le_index, count
+                        FROM turn_latency_rollups
+                        WHERE period = ? AND bucket >= ?
+                    ''', (period, rows[-1][0])).fetchall()
+                    for bucket, le_index, count in histogram:
+                        merged[bucket]["latency"][le_index] += count
+            finally:
+                conn.close()
+    except Exception as e:
+        logger.error("Error reading turn stats: %s", e)
+        return {"period": period, "buckets": [], "overall": {}, "error": str(e)}
+    
+    bucket_seconds = 3600 if period == "hour" else 86400
+    
+    def summarize(sums: List[float], latency: List[int]) -> dict:
+        totals = dict(zip(fields, sums))
+        turns, timed = totals["turns"], totals["timed_turns"]  # timed: turns with a total_ms
+        return {
+            "turns": turns,
+            "turns_per_minute": round(turns / (bucket_seconds / 60), 3),
+            "cache_hit_rate": round(totals["cache_hits"] / turns, 4) if turns else None,
+            "retry_rate": round(totals["retried_turns"] / turns, 4) if turns else None,
+            "retries": totals["retries"],
+            "tokens": totals["tokens"],
+            "avg_total_ms": round(totals["total_ms_sum"] / timed, 1) if timed else None,
+            "avg_upstream_ms": round(totals["upstream_ms_sum"] / totals["upstream_turns"], 1)
+                               if totals["upstream_turns"] else None,
+            "p50_ms": _histogram_percentile(latency, 0.50),
+            "p95_ms": _histogram_percentile(latency, 0.95),
+            "p99_ms": _histogram_percentile(latency, 0.99),
+        }
+    
+    selected = sorted(merged, reverse=True)[:buckets]
+    result = [{"bucket": bucket, **summarize(merged[bucket]["sums"], merged[bucket]["latency"])}
+              for bucket in selected]
+    
+    overall_sums = [sum(merged[bucket]["sums"][i] for bucket in selected) for i in range(len(fields))]
+    overall_latency = [sum(merged[bucket]["latency"][i] for bucket in selected)
+                       for i in range(len(LATENCY_BOUNDS_MS) + 1)]
+    overall = summarize(overall_sums, overall_latency)
+    overall["turns_per_minute"] = round(overall["turns"] / (len(selected) * bucket_seconds / 60), 3) \
+        if selected else 0.0
+    return {"period": period, "buckets": result, "overall": overall}
+
+def iter_conversations(since_ids: Optional[List[int]] = None, chunk_size: int = 1000):
+    """
+    Stream every conversation row, shard by shard, in id order
+    
+    Rows are read in keyset-paginated chunks (WHERE id > last id LIMIT n), so
+    no query holds more than chunk_size rows and no read lock is held between
+    chunks; memory use does not grow with the table.
+    
+    Args:
+        since_ids: Per-shard watermark; only rows with a larger id are returned
+        chunk_size: Rows fetched per query
+        
+    Yields:
+        Tuples: (shard, id, session_id, user_input, bot_response, timestamp,
+                 upstream_ms, total_ms, retries, cache_hit, tokens)
+    """
+    paths = shard_paths()
+    since_ids = since_ids or [0] * len(paths)
+    if len(since_ids) != len(paths):
+        raise ValueError(f"Expected {len(paths)} watermark ids (one per shard), got {len(since_ids)}")
+    
+    for shard, path in enumerate(paths):
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path)
+        try:
+            last_id = since_ids[shard]
+            while True:
+                rows = conn.execute('''
+                    SELECT id, session_id, user_input, bot_response, timestamp,
+                           upstream_ms, total_ms, retries, cache_hit, tokens
+                    FROM conversations
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (last_id, chunk_size)).fetchall()
+                for row in rows:
+                    yield (shard,) + row
+                if len(rows) < chunk_size:
+                    break
+                last_id = rows[-1][0]
+        finally:
+            conn.close()
+
+def insert_conversations(rows, chunk_size: int = 10000) -> int:
+    """
+    Bulk-insert conversation rows, committing one transaction per chunk
+    
+    Each row is routed to its session's shard. Row ids are assigned by the
+    target database; timestamps are kept (the current time if missing). The
+    rollups are brought up to date once at the end rather than per row.
+    
+    Args:
+        rows: Iterable of (session_id, user_input, bot_response, timestamp,
+              upstream_ms, total_ms, retries, cache_hit, tokens); the
+              performance columns may be left off (stored as NULL)
+        chunk_size: Rows per shard per transaction
+        
+    Returns:
+        int: Number of rows inserted
+    """
+    connections = [sqlite3.connect(path) for path in shard_paths()]
+    batches = [[] for _ in connections]
+    inserted = 0
+    padding = (None,) * len(PERFORMANCE_COLUMNS)
+    
+    def flush(index):
+        with connections[index]:
+            connections[index].executemany('''
+                INSERT INTO conversations (session_id, user_input, bot_response, timestamp,
+                                           upstream_ms, total_ms, retries, cache_hit, tokens)
+                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?)
+            ''', batches[index])
+        batches[index].clear()
+    
+    try:
+        with rollups_deferred():
+            for row in rows:
+                index = shard_index(row[0])
+                batches[index].append(tuple(row) + padding[:9 - len(row)])
+                if len(batches[index]) >= chunk_size:
+                    flush(index)
+                inserted += 1
+            for index in range(len(connections)):
+                if batches[index]:
+                    flush(index)
+    finally:
+        for conn in connections:
+            conn.close()
+    return inserted
+
+def rebalance_shards(old_shards: int, new_shards: int) -> int:
+    """
+    Move every conversation from an old shard layout to a new one
+    
+    Rows are copied session by session in their original order into fresh
+    database files, which then replace the new layout's files. Row ids are
+    reassigned by the target shard. Old files are deleted only once every new
+    file is in place. Stop the server before running this.
+    
+    Args:
+        old_shards: Shard count the data is currently stored with
+        new_shards: Shard count to move the data to
+        
+    Returns:
+        int: Number of rows moved
+        
+    Raises:
+        ValueError: If a file of the new layout that is not part of the old one
+            already holds conversations (e.g. a stray conversations.db)
+    """
+    old_paths = shard_paths(old_shards)
+    new_paths = shard_paths(new_shards)
+    tmp_paths = [path + ".rebalance" for path in new_paths]
+    
+    for path in new_paths:
+        if path not in old_paths and os.path.exists(path) and _count_rows(path):
+            raise ValueError(f"{path} is not part of the {old_shards}-shard layout but holds "
+                             "conversations; move it away before rebalancing")
+    
+    for path in tmp_paths:
+        _remove_database_file(path)
+        _create_schema(path)
+    
+    moved = 0
+    # The target shards' rollups are built in one pass once every row is in
+    with rollups_deferred(tmp_paths):
+        targets = [sqlite3.connect(path) for path in tmp_paths]
+        try:
+            for path in old_paths:
+                if not os.path.exists(path):
+                    continue
+                _create_schema(path)  # older files may predate the performance columns
+                conn = sqlite3.connect(path)
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT session_id, user_input, bot_response, timestamp,
+                           upstream_ms, total_ms, retries, cache_hit, tokens
+                    FROM conversations
+                    ORDER BY session_id, id
+                ''')
+                for row in cursor:
+                    target = targets[shard_index(row[0], new_shards)]
+                    target.execute('''
+                        INSERT INTO conversations (session_id, user_input, bot_response, timestamp,
+                                                   upstream_ms, total_ms, retries, cache_hit, tokens)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', row)
+                    moved += 1
+                conn.close()
+            for target in targets:
+                target.commit()
+        finally:
+            for target in targets:
+                target.close()
+    
+    # A replaced file's WAL would be applied to the new file, so fold it in first
+    for path in set(old_paths) | set(new_paths):
+        _checkpoint_to_single_file(path)
+    for tmp_path, path in zip(tmp_paths, new_paths):
+        os.replace(tmp_path, path)
+    for path in old_paths:
+        if path not in new_paths:
+            _remove_database_file(path)
+    
+    return moved
+
+def _count_rows(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0  # no conversations table
+    finally:
+        conn.close()
+
+def _checkpoint_to_single_file(path: str):
+    """
+    Leave the database entirely in its main file, with no -wal or -journal beside it
+
+    Raises:
+        RuntimeError: If a sidecar file remains (e.g. another process still has it open)
+    """
+    if not os.path.exists(path):
+        return
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=DELETE")  # checkpoints and removes the WAL
+    finally:
+        conn.close()
+    for suffix in ("-wal", "-journal"):
+        if os.path.exists(path + suffix):
+            raise RuntimeError(f"{path}{suffix} still exists; is the server stopped?")
+
+def _remove_database_file(path: str):
+    """Delete a database file together with its -wal, -shm and -journal files"""
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
 if __name__ == "__main__":
-    # Test database initialization
-    init_db()
-    print("Database setup complete!")
+    if len(sys.argv) == 4 and sys.argv[1] == "rebalance":
+        # python database.py rebalance <old_shards> <new_shards>
+        old_count, new_count = int(sys.argv[2]), int(sys.argv[3])
+        moved = rebalance_shards(old_count, new_count)
+        print(f"Moved {moved} conversations from {old_count} to {new_count} shards")
+    else:
+        # Test database initialization
+        init_db()
+        print("Database setup complete!")
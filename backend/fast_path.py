@@ -0,0 +1,139 @@
+"""
+Local fast path for small talk in ConversAI MVP
+Answers greetings, thanks, goodbyes and similar one-liners in-process from
+reply templates, so they never wait on the inference API; anything else
+falls through to the model
+Author: ConversAI MVP
+Run: python bench_fast_path.py
+"""
+
+import os
+import json
+import random
+import logging
+from typing import Dict, List, Optional
+
+from prompt_cache import normalize
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+# Optional JSON file replacing the built-in intents:
+# {"intent": {"phrases": ["..."], "replies": ["..."]}, ...}
+FAST_PATH_INTENTS = os.getenv("FAST_PATH_INTENTS", "")
+
+# Small talk is short; anything longer goes to the model without being parsed
+MAX_CHARS = 60
+MAX_WORDS = 10
+
+# Words that may surround an intent without changing it ("hey there, thanks so much")
+FILLERS = ("oh", "um", "uh", "hmm", "well", "so", "there", "please", "very", "so much", "a lot",
+           "again", "man", "buddy", "friend", "conversai", "assistant", "bot")
+FILLER = ""
+
+DEFAULT_INTENTS = {
+    "greeting": {
+        "phrases": ["hi", "hello", "hey", "hiya", "howdy", "yo", "greetings", "good morning",
+                    "good afternoon", "good evening", "hello hello"],
+        "replies": ["Hi! What can I help you with?", "Hello! What would you like to talk about?",
+                    "Hey there! How can I help?"],
+    },
+    "how_are_you": {
+        "phrases": ["how are you", "how are you doing", "how r u", "how are u", "hows it going",
+                    "how is it going", "whats up", "sup", "how do you do"],
+        "replies": ["I'm doing well, thanks for asking! How can I help you today?",
+                    "All good here! What's on your mind?"],
+    },
+    "thanks": {
+        "phrases": ["thanks", "thank you", "thank u", "thx", "ty", "cheers", "much appreciated",
+                    "appreciate it", "i appreciate it", "great thanks", "perfect thanks"],
+        "replies": ["You're welcome!", "Happy to help!", "Anytime!"],
+    },
+    "goodbye": {
+        "phrases": ["bye", "goodbye", "bye bye", "bye for now", "see you", "see ya", "see you later",
+                    "later", "good night", "goodnight", "talk to you later", "thats all", "that is all",
+                    "im done", "i am done"],
+        "replies": ["Goodbye! Talk to you soon.", "See you later!", "Bye! Have a great day."],
+    },
+    "acknowledge": {
+        "phrases": ["ok", "okay", "k", "got it", "cool", "nice", "great", "awesome", "alright",
+                    "all right", "sounds good", "i see", "makes sense"],
+        "replies": ["Great! Anything else I can help with?", "Got it. What else would you like to know?"],
+    },
+}
+
+
+class IntentMatcher:
+    """
+    Whole-utterance intent classifier over a word trie of known phrases
+
+    An utterance matches only if it splits entirely into known phrases and
+    fillers ("ok thanks bye" -> goodbye, the last intent said); a single
+    unknown word ("thanks, what's the weather") sends it to the model. The
+    trie is built once, so a lookup is a few dict probes per word.
+    """
+
+    def __init__(self, intents: Dict[str, dict]):
+        self.replies: Dict[str, List[str]] = {}
+        self._trie: dict = {}
+        for name, intent in intents.items():
+            replies = [reply for reply in intent.get("replies", []) if isinstance(reply, str) and reply]
+            if not replies:
+                raise ValueError(f"Fast-path intent {name!r} has no replies")
+            self.replies[name] = replies
+            for phrase in intent.get("phrases", []):
+                self._add(phrase, name)
+        for phrase in FILLERS:
+            self._add(phrase, FILLER, overwrite=False)
+
+    def _add(self, phrase: str, intent: str, overwrite: bool = True):
+        words = normalize(phrase).split()
+        if not words:
+            return
+        node = self._trie
+        for word in words:
+            node = node.setdefault(word, {})
+        if overwrite or None not in node:
+            node[None] = intent  # None marks the end of a phrase
+
+    def classify(self, text: str) -> Optional[str]:
+        """Return the intent of a small-talk utterance, or None if the model should answer"""
+        if len(text) > MAX_CHARS:
+            return None
+        words = normalize(text).split()
+        if not words or len(words) > MAX_WORDS:
+            return None
+
+        # reached[i]: the last intent of some split of words[:i] into phrases
+        # (FILLER if only fillers so far), or None if words[:i] can't be split
+        reached: List[Optional[str]] = [FILLER] + [None] * len(words)
+        for start in range(len(words)):
+            current = reached[start]
+            if current is None:
+                continue
+            node = self._trie
+            for end in range(start, len(words)):
+                node = node.get(words[end])
+                if node is None:
+                    break
+                intent = node.get(None)
+                if intent is not None:
+                    reached[end + 1] = intent or current
+        return reached[-1] or None
+
+    def reply(self, intent: str) -> str:
+        return random.choice(self.replies[intent])
+
+
+def load_intents(path: str = FAST_PATH_INTENTS) -> Dict[str, dict]:
+    """Intents from a JSON file, or the built-in ones (also if the file is unusable)"""
+    if not path:
+        return DEFAULT_INTENTS
+    try:
+        with open(path, encoding="utf-8") as f:
+            intents = json.load(f)
+        IntentMatcher(intents)  # validate before using
+        return intents
+    except Exception as e:
+        logger.error("Error loading fast-path intents from %s, using the built-in ones: %s", path, e)
+        return DEFAULT_INTENTS
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Synthetic conversations.db fixture generator for ConversAI MVP
+Builds realistic databases for benchmarking the database layer at scale
+Author: ConversAI MVP
+Run: python generate_fixtures.py --rows 1000000 --db fixtures/conversations.db
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import database
+
+WORDS = (
+    "the a to and of i you it is that what how can my your me do for in this "
+    "tell about please help know why when where time weather today name music "
+    "play song news story joke remind set alarm call message thanks hello okay "
+    "sure really think like want need could would should maybe great good yes no"
+).split()
+CORPUS_CHARS = 1 << 20
+
+
+def build_corpus(rng: np.random.Generator) -> str:
+    """A long string of random words; messages are slices of it"""
+    words = rng.choice(WORDS, size=CORPUS_CHARS // 4)
+    return " ".join(words)[:CORPUS_CHARS]
+
+
+def session_lengths(rng: np.random.Generator, total_rows: int, mean_turns: float) -> np.ndarray:
+    """Turns per session: geometric (many short sessions, a long tail), summing to total_rows"""
+    lengths = []
+    remaining = total_rows
+    while remaining > 0:
+        batch = rng.geometric(1.0 / mean_turns, size=max(1024, int(remaining / mean_turns)))
+        batch = batch[np.cumsum(batch) <= remaining] if batch.sum() > remaining else batch
+        if batch.size == 0:
+            batch = np.array([remaining])
+        lengths.append(batch)
+        remaining -= int(batch.sum())
+    return np.concatenate(lengths)
+
+
+def generate_rows(rng, corpus, lengths, user_chars, bot_chars, days, chunk_sessions=4096):
+    """Yield (session_id, user_input, bot_response, timestamp) session by session"""
+    start = np.datetime64(datetime.now() - timedelta(days=days), "s")
+    span = days * 86400
+    max_offset = len(corpus) - 4096
+
+    # Sample a chunk of sessions at a time so the per-row work is plain list access
+    for first in range(0, lengths.size, chunk_sessions):
+        turns = lengths[first:first + chunk_sessions]
+        rows = int(turns.sum())
+        session_of_row = np.repeat(np.arange(turns.size), turns)
+        session_ids = [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(turns.size)]
+
+        # Each session starts at a random time; turns follow exponential gaps
+        gaps = rng.exponential(20.0, size=rows)
+        session_start = np.cumsum(turns) - turns
+        elapsed = np.cumsum(gaps)
+        elapsed -= np.repeat(elapsed[session_start] - gaps[session_start], turns)
+        seconds = rng.uniform(0, span, size=turns.size)[session_of_row] + elapsed
+        timestamps = np.datetime_as_string(start + seconds.astype("timedelta64[s]"), unit="s")
+
+        # Log-normal message lengths, clipped to the slice window
+        user_lens = np.clip(rng.lognormal(np.log(user_chars), 0.6, size=rows), 2, 4000).astype(int)
+        bot_lens = np.clip(rng.lognormal(np.log(bot_chars), 0.6, size=rows), 2, 4000).astype(int)
+        user_offsets = rng.integers(0, max_offset, size=rows)
+        bot_offsets = rng.integers(0, max_offset, size=rows)
+
+        for s, u, ul, b, bl, ts in zip(session_of_row.tolist(), user_offsets.tolist(), user_lens.tolist(),
+                                       bot_offsets.tolist(), bot_lens.tolist(), timestamps.tolist()):
+            yield session_ids[s], corpus[u:u + ul], corpus[b:b + bl], ts.replace("T", " ")
+
+
+def generate(db_path: str, rows: int, mean_turns: float = 6.0, user_chars: float = 40.0,
+             bot_chars: float = 160.0, days: int = 30, shards: int = 1, seed: int = 0,
+             batch_size: int = 50000) -> int:
+    """
+    Bulk-load synthetic conversations into db_path (or its shard files)
+
+    Returns:
+        int: Number of rows written
+    """
+    database.DB_PATH = db_path
+    database.DB_SHARDS = shards
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    database.init_db()
+
+    connections = []
+    for path in database.shard_paths():
+        conn = sqlite3.connect(path)
+        # Bulk-load settings: the fixture can simply be regenerated if interrupted
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-262144")
+        # Building the session index once at the end is cheaper than row by row
+        conn.execute("DROP INDEX IF EXISTS idx_conversations_session")
+        connections.append(conn)
+
+    rng = np.random.default_rng(seed)
+    corpus = build_corpus(rng)
+    lengths = session_lengths(rng, rows, mean_turns)
+
+    batches = [[] for _ in connections]
+    written = 0
+    insert = "INSERT INTO conversations (session_id, user_input, bot_response, timestamp) VALUES (?, ?, ?, ?)"
+
+    def flush(index):
+        connections[index].executemany(insert, batches[index])
+        connections[index].commit()
+        batches[index].clear()
+
+    # No per-row rollup trigger while loading; the rollups are built in one pass after
+    with database.rollups_deferred():
+        for row in generate_rows(rng, corpus, lengths, user_chars, bot_chars, days):
+            index = database.shard_index(row[0])
+            batches[index].append(row)
+            if len(batches[index]) >= batch_size:
+                flush(index)
+            written += 1
+        for index in range(len(connections)):
+            if batches[index]:
+                flush(index)
+            connections[index].close()
+    for path in database.shard_paths():
+        database._create_schema(path)  # recreates the index
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic conversations.db fixture")
+    parser.add_argument("--db", default="fixtures/conversations.db", help="output database path")
+    parser.add_argument("--rows", type=int, default=1000000, help="conversation turns to generate")
+    parser.add_argument("--mean-turns", type=float, default=6.0, help="mean turns per session (geometric)")
+    parser.add_argument("--user-chars", type=float, default=40.0, help="median user message length (log-normal)")
+    parser.add_argument("--bot-chars", type=float, default=160.0, help="median bot reply length (log-normal)")
+    parser.add_argument("--days", type=int, default=30, help="time span the sessions are spread over")
+    parser.add_argument("--shards", type=int, default=1, help="shard count (see DB_SHARDS)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per insert transaction")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    written = generate(args.db, args.rows, args.mean_turns, args.user_chars, args.bot_chars,
+                       args.days, args.shards, args.seed, args.batch_size)
+    elapsed = time.perf_counter() - start_time
+    print(f"Wrote {written} rows to {args.db} in {elapsed:.1f}s ({written / elapsed:,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
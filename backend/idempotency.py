@@ -0,0 +1,187 @@
+"""
+Idempotency-Key support for ConversAI MVP
+Deduplicates client/proxy retries of POST requests across worker processes
+Author: ConversAI MVP
+Run: python -c "from idempotency import IdempotencyStore; IdempotencyStore()"
+"""
+
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+from typing import Callable, Optional, Tuple
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Keys live in their own SQLite file (shared by all workers on the host) so
+# they never contend with conversation writes.
+IDEMPOTENCY_DB_PATH = os.getenv(
+    "IDEMPOTENCY_DB_PATH", os.path.splitext(database.DB_PATH)[0] + "_idempotency.db"
+)
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+# How long a retry waits for the original request, and after how long an
+# unfinished request is presumed dead (its worker crashed) and taken over. A
+# turn can take minutes (model loading waits, retries), so the worker running
+# it renews its lease every third of this instead of racing a fixed deadline.
+IDEMPOTENCY_WAIT_SECONDS = 120.0
+IDEMPOTENCY_LEASE_SECONDS = 30.0
+POLL_SECONDS = 0.05
+PURGE_PROBABILITY = 0.01
+
+
+class IdempotencyStore:
+    """
+    Runs a handler at most once per Idempotency-Key
+
+    The first request claims the key and runs the handler. A retry that arrives
+    while it runs waits for the stored result, and a later retry gets the stored
+    result straight away. Reusing a key with a different request body is
+    rejected. Server errors (5xx), and results the caller marks as failed, are
+    not stored, so those requests can be retried.
+    """
+
+    def __init__(self, path: str = IDEMPOTENCY_DB_PATH, ttl: float = IDEMPOTENCY_TTL_SECONDS,
+                 max_keys: int = IDEMPOTENCY_MAX_KEYS, wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS,
+                 lease_seconds: float = IDEMPOTENCY_LEASE_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait_seconds = wait_seconds
+        self.lease_seconds = lease_seconds
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                completed INTEGER NOT NULL DEFAULT 0,
+                status_code INTEGER,
+                body TEXT
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _claim(self, conn: sqlite3.Connection, key: str, fingerprint: str,
+               claimed_at: float) -> Optional[tuple]:
+        """Claim the key; returns None if claimed, else the existing row"""
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, created_at) VALUES (?, ?, ?)",
+            (key, fingerprint, claimed_at),
+        )
+        if cursor.rowcount == 1:
+            return None
+        return conn.execute(
+            "SELECT fingerprint, created_at, completed, status_code, body FROM idempotency_keys WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+    def _purge(self, conn: sqlite3.Connection):
+        """Drop expired keys, then the oldest ones beyond max_keys"""
+        conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (time.time() - self.ttl,))
+        conn.execute('''
+            DELETE FROM idempotency_keys WHERE key IN (
+                SELECT key FROM idempotency_keys ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_keys,))
+
+    def _renew(self, key: str, lease: dict, done: threading.Event):
+        """Keep moving the claim's timestamp forward until the handler is done"""
+        conn = self._connect()
+        try:
+            while not done.wait(self.lease_seconds / 3):
+                renewed_at = time.time()
+                cursor = conn.execute(
+                    "UPDATE idempotency_keys SET created_at = ? WHERE key = ? AND created_at = ? AND completed = 0",
+                    (renewed_at, key, lease["claimed_at"]),
+                )
+                if cursor.rowcount != 1:
+                    logger.warning("Lost the lease on Idempotency-Key %s", key)
+                    return
+                lease["claimed_at"] = renewed_at
+        except sqlite3.Error as e:
+            logger.warning("Could not renew the lease on Idempotency-Key %s: %s", key, e)
+        finally:
+            conn.close()
+
+    def execute(self, key: str, fingerprint: str, handler: Callable[[], Tuple[int, str]],
+                failed: Optional[Callable[[int, str], bool]] = None) -> Tuple[int, str, bool]:
+        """
+        Run handler once for this key, or return the stored result of the run that did
+
+        Args:
+            key: Client-supplied Idempotency-Key
+            fingerprint: Hash of the request body, to detect key reuse
+            handler: Returns (status_code, JSON body) for the request
+            failed: Optional check for results that must not be replayed beyond 5xx
+                    (e.g. a 200 carrying an apology because the model was unreachable)
+
+        Returns:
+            Tuple of (status_code, JSON body, replayed)
+        """
+        conn = self._connect()
+        try:
+            deadline = time.monotonic() + self.wait_seconds
+            while True:
+                claimed_at = time.time()
+                row = self._claim(conn, key, fingerprint, claimed_at)
+                if row is None:
+                    break
+
+                stored_fingerprint, created_at, completed, status_code, body = row
+                age = time.time() - created_at
+                if age > self.ttl or (not completed and age > self.lease_seconds):
+                    # Expired, or abandoned by a crashed worker: take it over
+                    conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND created_at = ?", (key, created_at))
+                    continue
+                if stored_fingerprint != fingerprint:
+                    return 422, '{"error": true, "message": "Idempotency-Key reused with a different request"}', False
+                if completed:
+                    return status_code, body, True
+                if time.monotonic() >= deadline:
+                    return 409, '{"error": true, "message": "A request with this Idempotency-Key is still in progress"}', False
+                time.sleep(POLL_SECONDS)
+
+            if random.random() < PURGE_PROBABILITY:
+                self._purge(conn)
+
+            lease = {"claimed_at": claimed_at}
+            done = threading.Event()
+            renewer = threading.Thread(target=self._renew, args=(key, lease, done),
+                                       name="idempotency-lease", daemon=True)
+            renewer.start()
+            try:
+                status_code, body = handler()
+            except Exception:
+                done.set()
+                renewer.join()
+                conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND created_at = ?",
+                             (key, lease["claimed_at"]))
+                raise
+            done.set()
+            renewer.join()
+
+            # Only touch the row if it is still ours (not taken over after a lost lease)
+            if status_code >= 500 or (failed is not None and failed(status_code, body)):
+                conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND created_at = ?",
+                             (key, lease["claimed_at"]))
+            else:
+                conn.execute(
+                    "UPDATE idempotency_keys SET completed = 1, status_code = ?, body = ? "
+                    "WHERE key = ? AND created_at = ?",
+                    (status_code, body, key, lease["claimed_at"]),
+                )
+            return status_code, body, False
+        finally:
+            conn.close()
@@ -0,0 +1,110 @@
+"""
+Pluggable JSON codec for ConversAI MVP
+Uses orjson when it is installed and the standard library otherwise, for
+Flask request/response bodies, upstream replies, WebSocket frames and logs
+Author: ConversAI MVP
+Run: python bench_json.py (compares the codecs on large history payloads)
+"""
+
+import os
+import json
+import dataclasses
+from decimal import Decimal
+from typing import Any, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency: fall back to the standard library
+    orjson = None
+
+# auto (orjson if installed), orjson, or stdlib
+JSON_CODEC = os.getenv("JSON_CODEC", "auto")
+if JSON_CODEC == "stdlib":
+    orjson = None
+elif JSON_CODEC == "orjson" and orjson is None:
+    raise ImportError("JSON_CODEC=orjson but orjson is not installed (pip install orjson)")
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj: Any) -> Any:
+    """Types neither codec handles natively (mirrors Flask's provider, roughly)"""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, "tolist"):  # numpy scalars and arrays (stdlib path)
+        return obj.tolist()
+    return str(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    """Serialize to a JSON string (text WebSocket frames, log lines)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode("utf-8")
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """Parse JSON from bytes or str; raises ValueError on invalid input"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_with_raw(obj: dict, **raw: Union[bytes, str]) -> bytes:
+    """
+    Serialize obj with extra members whose values are already JSON text
+
+    Lets a response embed a JSON fragment built elsewhere (e.g. by SQLite)
+    without parsing it back into Python objects first.
+    """
+    body = dumps(obj)
+    if not raw:
+        return body
+    parts = [body[:-1]]
+    for index, (key, value) in enumerate(raw.items()):
+        separator = b"," if obj or index else b""
+        parts.append(separator + dumps(key) + b":" + (value.encode("utf-8") if isinstance(value, str) else value))
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider (jsonify, request.get_json) backed by this codec"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        """Compact JSON; sort_keys and indent=2 map to orjson options, other arguments go to Flask's provider"""
+        if not kwargs:
+            return dumps_str(obj)
+        if orjson is not None and set(kwargs) <= {"sort_keys", "indent"} and kwargs.get("indent") in (None, 2):
+            option = _ORJSON_OPTIONS
+            if kwargs.get("sort_keys"):
+                option |= orjson.OPT_SORT_KEYS
+            if kwargs.get("indent"):
+                option |= orjson.OPT_INDENT_2
+            return orjson.dumps(obj, default=_default, option=option).decode("utf-8")
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
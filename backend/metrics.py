@@ -0,0 +1,408 @@
+"""
+Multi-process metrics for ConversAI MVP
+Counters and histograms kept in memory-mapped files, one file per worker
+process, so every gunicorn worker can update them cheaply and any worker can
+serve totals merged across all of them
+Author: ConversAI MVP
+Run: served by app.py at GET /api/metrics; python bench_metrics.py for overhead
+"""
+
+import os
+import glob
+import mmap
+import time
+import bisect
+import logging
+import threading
+import weakref
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import database
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, assume a single worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_bisect_left = bisect.bisect_left
+
+# One values file (plus a small keys file) per worker process in this directory
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.splitext(database.DB_PATH)[0] + "_metrics")
+INITIAL_SLOTS = 1024
+# Default histogram buckets (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Totals of workers that have exited, so merged counters never go backwards
+ARCHIVE_NAME = "archive"
+
+
+_registries: "weakref.WeakSet[MetricsRegistry]" = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for registry in list(_registries):
+        registry._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsFile:
+    """
+    A growable array of float64 slots in a memory-mapped file, with named ranges
+
+    Values are read and written through a memoryview of the mapping, so an
+    update is a plain in-memory store with no system call and no cross-process
+    lock. Slot ranges are named in an append-only keys file written before the
+    range is first used; readers only need both files.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.values_path = os.path.join(directory, f"{name}.values")
+        self.keys_path = os.path.join(directory, f"{name}.keys")
+        self.ranges: Dict[str, Tuple[int, int]] = {}
+        self.used = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._keys_file = open(self.keys_path, "a+", encoding="utf-8")
+        self._keys_file.seek(0)
+        for line in self._keys_file:
+            start, size, key = line.rstrip("\n").split("\t", 2)
+            self.ranges[key] = (int(start), int(size))
+            self.used = max(self.used, int(start) + int(size))
+
+        self._fd = os.open(self.values_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._map(max(INITIAL_SLOTS, self.used))
+
+    def _map(self, slots: int):
+        size = slots * 8
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        # Earlier views stay valid on the old mapping until nothing uses them
+        self.values = memoryview(self._mmap).cast("d")
+
+    def allocate(self, key: str, size: int) -> int:
+        """Return the first slot of key's range, creating the range if needed"""
+        existing = self.ranges.get(key)
+        if existing is not None:
+            return existing[0]
+        start = self.used
+        if start + size > len(self.values):
+            self._map(max(2 * len(self.values), start + size))
+        self._keys_file.write(f"{start}\t{size}\t{key}\n")
+        self._keys_file.flush()
+        self.ranges[key] = (start, size)
+        self.used = start + size
+        return start
+
+    def close(self):
+        self._keys_file.close()
+        os.close(self._fd)
+
+    @staticmethod
+    def read(directory: str, name: str) -> Dict[str, np.ndarray]:
+        """Read every named range of a file (possibly another process's) as arrays"""
+        keys_path = os.path.join(directory, f"{name}.keys")
+        values_path = os.path.join(directory, f"{name}.values")
+        with open(keys_path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        with open(values_path, "rb") as f:
+            data = np.frombuffer(f.read(), dtype=np.float64)
+        result = {}
+        for line in lines:
+            start, size, key = line.split("\t", 2)
+            start, size = int(start), int(size)
+            if start + size <= data.size:
+                result[key] = data[start:start + size].copy()
+        return result
+
+
+class MetricsRegistry:
+    """
+    This process's metrics file plus the merging and cleanup done at scrape time
+
+    The file is opened lazily and every binding is dropped in a forked child,
+    so a registry created before gunicorn forks its workers still gives each
+    worker its own file. Within a process an uncontended thread lock keeps
+    concurrent updates from losing increments; no lock is shared between
+    processes.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self._pid = None
+        self._file: Optional[MetricsFile] = None
+        self._children: List["_Child"] = []
+        _registries.add(self)
+
+    def _after_fork(self):
+        # The parent's lock may have been held at fork time, and its file is not ours
+        self.lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        for child in self._children:
+            child.values = None
+            child.lock = self.lock
+
+    def file(self) -> MetricsFile:
+        if self._pid != os.getpid():
+            with self.lock:
+                if self._pid != os.getpid():
+                    self._file = MetricsFile(self.directory, f"worker_{os.getpid()}")
+                    self._pid = os.getpid()
+        return self._file
+
+    def counter(self, name: str, labelnames: Sequence[str] = ()) -> "Counter":
+        return Counter(self, name, labelnames)
+
+    def histogram(self, name: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> "Histogram":
+        return Histogram(self, name, labelnames, buckets)
+
+    def _cleanup_dead_workers(self, names: Sequence[str]):
+        """Fold the files of exited workers into the archive file, then delete them"""
+        dead = [name for name in names
+                if name != ARCHIVE_NAME and not _pid_alive(int(name.split("_", 1)[1]))]
+        if not dead:
+            return
+        archive = MetricsFile(self.directory, ARCHIVE_NAME)
+        try:
+            for name in dead:
+                for key, values in MetricsFile.read(self.directory, name).items():
+                    start = archive.allocate(key, len(values))
+                    for i, value in enumerate(values):
+                        archive.values[start + i] += value
+                archive._mmap.flush()
+                for suffix in (".keys", ".values"):
+                    os.remove(os.path.join(self.directory, name + suffix))
+        finally:
+            archive.close()
+
+    def collect(self) -> Dict[str, np.ndarray]:
+        """
+        Sum every named range over all live workers and the archive
+
+        Dead workers' files are archived first, under an exclusive file lock so
+        two workers scraping at once cannot archive the same file twice.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, "collect.lock"), "a")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            names = sorted(os.path.basename(path)[:-len(".keys")]
+                           for path in glob.glob(os.path.join(self.directory, "*.keys")))
+            self._cleanup_dead_workers(names)
+            names = sorted(os.path.basename(path)[:-len(".keys")]
+                           for path in glob.glob(os.path.join(self.directory, "*.keys")))
+
+            totals: Dict[str, np.ndarray] = {}
+            for name in names:
+                ranges = MetricsFile.read(self.directory, name)
+                for key, values in ranges.items():
+                    if key in totals and totals[key].size == values.size:
+                        totals[key] += values
+                    else:
+                        totals[key] = values
+            return totals
+        finally:
+            lock_file.close()
+
+
+def _label_key(name: str, labelnames: Sequence[str], values: Tuple[str, ...]) -> str:
+    if not labelnames:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in zip(labelnames, values)) + "}"
+
+
+class _Child:
+    """
+    One label combination, bound to its slot range in this worker's file
+
+    The binding (memoryview and first slot) is cached until a fork. A cached
+    view stays valid when the file grows: it keeps the older, smaller mapping
+    of the same file alive, which still covers this range.
+    """
+
+    __slots__ = ("registry", "key", "size", "values", "start", "lock")
+
+    def __init__(self, registry: MetricsRegistry, key: str, size: int):
+        self.registry = registry
+        self.key = key
+        self.size = size
+        self.values = None
+        self.start = 0
+        self.lock = registry.lock
+        registry._children.append(self)
+
+    def _bind(self) -> memoryview:
+        metrics_file = self.registry.file()
+        with self.lock:
+            self.start = metrics_file.allocate(self.key, self.size)
+            self.values = metrics_file.values
+        return self.values
+
+
+class CounterChild(_Child):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        values = self.values
+        if values is None:
+            values = self._bind()
+        with self.lock:
+            values[self.start] += amount
+
+
+class HistogramChild(_Child):
+    __slots__ = ("bounds",)
+
+    def __init__(self, registry, key, bounds):
+        # Layout: one count per bucket (+Inf last), then the sum of observations
+        super().__init__(registry, key, len(bounds) + 2)
+        self.bounds = bounds
+
+    def observe(self, value: float):
+        values = self.values
+        if values is None:
+            values = self._bind()
+        index = self.start + _bisect_left(self.bounds, value)
+        total = self.start + self.size - 1
+        with self.lock:
+            values[index] += 1
+            values[total] += value
+
+
+class _Metric:
+    child_class = None
+
+    def __init__(self, registry: MetricsRegistry, name: str, labelnames: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], _Child] = {}
+
+    def _make_child(self, key: str) -> _Child:
+        return self.child_class(self.registry, key, 1)
+
+    def labels(self, *values) -> _Child:
+        """Return the child for these label values (cache it for hot paths)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            key = _label_key(self.name, self.labelnames, tuple(str(value) for value in values))
+            with self.registry.lock:
+                child = self._children.setdefault(values, self._make_child(key))
+        return child
+
+
+class Counter(_Metric):
+    child_class = CounterChild
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Histogram(_Metric):
+    child_class = HistogramChild
+
+    def __init__(self, registry, name, labelnames, buckets):
+        super().__init__(registry, name, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _make_child(self, key: str) -> _Child:
+        return HistogramChild(self.registry, key, self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+def _histogram_summary(values: np.ndarray, bounds: Sequence[float]) -> dict:
+    """Count, sum, cumulative buckets and bucket-interpolated percentiles"""
+    counts = values[:-1]
+    total = float(counts.sum())
+    cumulative = np.cumsum(counts)
+    summary = {
+        "count": int(total),
+        "sum": round(float(values[-1]), 6),
+        "buckets": [{"le": b, "count": int(c)} for b, c in zip(bounds, cumulative[:-1])]
+                   + [{"le": "+Inf", "count": int(total)}],
+    }
+    for p in (50, 95, 99):
+        if not total:
+            summary[f"p{p}"] = None
+            continue
+        rank = total * p / 100
+        index = int(np.searchsorted(cumulative, rank))
+        lower = bounds[index - 1] if index > 0 else 0.0
+        if index >= len(bounds):
+            summary[f"p{p}"] = lower  # in the +Inf bucket: report the last bound
+            continue
+        below = cumulative[index - 1] if index > 0 else 0.0
+        fraction = (rank - below) / counts[index] if counts[index] else 0.0
+        summary[f"p{p}"] = round(lower + (bounds[index] - lower) * fraction, 6)
+    return summary
+
+
+registry = MetricsRegistry()
+
+# Shared metric definitions (label values are cached by the call sites)
+http_requests = registry.counter("http_requests_total", ("endpoint", "status"))
+http_request_seconds = registry.histogram("http_request_seconds", ("endpoint",))
+generation_requests = registry.counter("generation_requests_total", ("profile",))
+generation_tokens = registry.counter("generation_tokens_total", ("profile",))
+generation_seconds = registry.histogram("generation_seconds", ("profile",))
+prompt_cache_lookups = registry.counter("prompt_cache_lookups_total", ("profile", "result"))
+fast_path_lookups = registry.counter("fast_path_lookups_total", ("intent",))  # intent "none": a miss
+upstream_hedges = registry.counter("upstream_hedges_total")
+upstream_hedge_wins = registry.counter("upstream_hedge_wins_total")
+upstream_failovers = registry.counter("upstream_failovers_total")
+upstream_cold_starts = registry.counter("upstream_cold_starts_total")
+upstream_cold_start_seconds = registry.counter("upstream_cold_start_seconds_total")
+warm_pings = registry.counter("warm_pings_total", ("result",))  # result "cold": the model was loading
+batches = registry.counter("batches_total")
+batched_prompts = registry.counter("batched_prompts_total")
+
+_metrics = [http_requests, http_request_seconds, generation_requests, generation_tokens,
+            generation_seconds, prompt_cache_lookups, fast_path_lookups, upstream_hedges,
+            upstream_hedge_wins, upstream_failovers, upstream_cold_starts, upstream_cold_start_seconds,
+            warm_pings, batches, batched_prompts]
+
+
+def snapshot() -> dict:
+    """
+    Merge every worker's metrics into totals
+
+    Returns:
+        {"counters": {key: total}, "histograms": {key: {count, sum, buckets, p50, p95, p99}},
+         "workers": live worker count, "collected_at": unix time}
+    """
+    totals = registry.collect()
+    bounds_by_name = {metric.name: metric.bounds for metric in _metrics if isinstance(metric, Histogram)}
+    counters, histograms = {}, {}
+    for key, values in sorted(totals.items()):
+        name = key.split("{", 1)[0]
+        if name in bounds_by_name and values.size == len(bounds_by_name[name]) + 2:
+            histograms[key] = _histogram_summary(values, bounds_by_name[name])
+        else:
+            counters[key] = float(values[0])
+    workers = len(glob.glob(os.path.join(registry.directory, "worker_*.keys")))
+    return {"counters": counters, "histograms": histograms, "workers": workers, "collected_at": time.time()}
@@ -6,13 +6,25 @@ Run: python -c "from model import get_response; print(get_response('Hello', 'tes
 """
 
 import os
+import re
 import requests
 import logging
+import threading
 import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
 
+import json_codec
+import metrics
+from fast_path import FAST_PATH_ENABLED, IntentMatcher, load_intents
+from prompt_cache import PromptCache
+from structured_logging import setup_logging
+from upstream import EndpointPool
+from warmkeeper import WarmKeeper
+
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
@@ -21,78 +33,523 @@ load_dotenv(override=True) # Add override=True to ensure .env values take preced
 # Hugging Face Inference API configuration
 # This is the official endpoint for the Llama 3.1 8B Instruct model.
 API_URL = "https://api-inference.huggingface.co/models/meta-llama/Llama-3.1-8B-Instruct"
-# --- Sanity Check URL ---
-# If Llama-3.1 still fails, comment the line above and uncomment the one below to test with a public model.
-# API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.3"
+# Public model used for failover and hedging when Llama-3.1 is slow or cold.
+FALLBACK_API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.3"
+# Comma-separated endpoints in order of preference (first is the primary)
+UPSTREAM_URLS = [url.strip() for url in os.getenv("UPSTREAM_URLS", f"{API_URL},{FALLBACK_API_URL}").split(",") if url.strip()]
 HF_TOKEN = os.getenv("HF_TOKEN")
 
 # --- Diagnostic Check ---
 # Log the loaded token to verify it's correct. We only log the start and end to keep it secure.
 if HF_TOKEN:
-    logger.info(f"Loaded HF_TOKEN successfully. Starts with '{HF_TOKEN[:5]}' and ends with '{HF_TOKEN[-4:]}'.")
+    logger.info("Loaded HF_TOKEN successfully. Starts with '%s' and ends with '%s'.", HF_TOKEN[:5], HF_TOKEN[-4:])
 
 MAX_RETRIES = 3
 RETRY_WAIT_SECONDS = 10
 
+# Replies given instead of a generated one when the model can't be reached
+NOT_CONFIGURED_REPLY = "Sorry, the AI service is not configured correctly. Please contact the administrator."
+UNUSUAL_RESPONSE_REPLY = "I'm sorry, I received an unusual response from the AI. Please try again."
+CONNECTION_ERROR_REPLY = "I'm sorry, I'm having trouble connecting to the AI service. Please try again in a moment."
+UNEXPECTED_ERROR_REPLY = "I'm sorry, an unexpected error occurred. Please try again."
+UNAVAILABLE_REPLY = "Sorry, the AI model is currently unavailable after multiple attempts. Please try again later."
+FALLBACK_REPLIES = frozenset((NOT_CONFIGURED_REPLY, UNUSUAL_RESPONSE_REPLY, CONNECTION_ERROR_REPLY,
+                              UNEXPECTED_ERROR_REPLY, UNAVAILABLE_REPLY))
+
+# Optional micro-batching: prompts arriving within BATCH_WAIT_MS of each other
+# (same profile, up to BATCH_MAX_SIZE) share one upstream call with a list of inputs
+BATCH_ENABLED = os.getenv("BATCH_ENABLED", "0") == "1"
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_WAIT_MS = float(os.getenv("BATCH_WAIT_MS", "10"))
+
+# Named generation profiles, selected per request by the client.
+# Spoken replies are kept short because TTS time grows with reply length.
+GENERATION_PROFILES = {
+    "voice-fast": {
+        "max_new_tokens": 60,
+        "temperature": 0.6,
+        "top_p": 0.9,
+        "stop": ["\n\n", "User:"],
+    },
+    "text-full": {
+        "max_new_tokens": 250,
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "stop": ["User:"],
+    },
+}
+DEFAULT_PROFILE = os.getenv("GENERATION_PROFILE", "text-full")
+if DEFAULT_PROFILE not in GENERATION_PROFILES:
+    # A typo here would otherwise fail every request that relies on the default
+    logger.warning("Unknown GENERATION_PROFILE %r (choose from %s), using text-full",
+                   DEFAULT_PROFILE, ", ".join(GENERATION_PROFILES))
+    DEFAULT_PROFILE = "text-full"
+
+upstream_pool = EndpointPool(UPSTREAM_URLS)
+# Keep-alive pinger for the primary endpoint; app.py starts it
+warm_keeper = WarmKeeper(upstream_pool.primary_url, {"Authorization": f"Bearer {HF_TOKEN}"})
+
+
+class _Batch:
+    """Prompts collected for one upstream call, with one future per caller"""
+
+    def __init__(self):
+        self.inputs: List[str] = []
+        self.futures: List[Future] = []
+        self.closed = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent prompts into single upstream calls
+
+    The first caller for a key (the generation profile, since parameters are
+    per call) opens a batch and waits up to wait_seconds, or until max_size
+    prompts have joined, then sends them all with send(key, inputs). Every
+    caller gets a response of its own: its item of a successful reply, or the
+    shared error response or exception. No background thread is involved.
+    """
+
+    def __init__(self, send: Callable[[str, List[str]], requests.Response],
+                 max_size: int = BATCH_MAX_SIZE, wait_seconds: float = BATCH_WAIT_MS / 1000):
+        self.send = send
+        self.max_size = max(1, max_size)
+        self.wait_seconds = wait_seconds
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, user_input: str) -> requests.Response:
+        """
+        Send a prompt as part of the next batch for key
+
+        Returns:
+            requests.Response: This prompt's result, shaped like a single-input
+            reply (a one-element list), or the batch's error response
+
+        Raises:
+            requests.exceptions.RequestException, ValueError: If the batch failed
+        """
+        future = Future()
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            batch.inputs.append(user_input)
+            batch.futures.append(future)
+            if len(batch.inputs) >= self.max_size:
+                del self._open[key]  # later callers start a new batch
+                batch.closed.set()
+
+        if leader:
+            batch.closed.wait(self.wait_seconds)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            self._dispatch(key, batch)
+        return future.result()
+
+    def _dispatch(self, key: str, batch: _Batch):
+        metrics.batches.inc()
+        metrics.batched_prompts.inc(len(batch.inputs))
+        try:
+            response = self.send(key, batch.inputs)
+            if response.status_code != 200 or len(batch.inputs) == 1:
+                results = [response] * len(batch.inputs)
+            else:
+                items = json_codec.loads(response.content)
+                if not isinstance(items, list) or len(items) != len(batch.inputs):
+                    raise ValueError(f"Expected {len(batch.inputs)} results in a batched reply")
+                results = [_item_response(response, item) for item in items]
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+    def stats(self, merged: Optional[dict] = None) -> dict:
+        """Return batch and prompt counts (all workers)"""
+        counters = (merged or metrics.snapshot())["counters"]
+        batches = int(counters.get("batches_total", 0))
+        prompts = int(counters.get("batched_prompts_total", 0))
+        return {
+            "max_size": self.max_size,
+            "wait_ms": self.wait_seconds * 1000,
+            "batches": batches,
+            "prompts": prompts,
+            "avg_batch_size": prompts / batches if batches else 0.0,
+        }
+
+
+def _item_response(response: requests.Response, item) -> requests.Response:
+    """One input's result from a batched reply, as a response of its own"""
+    single = requests.Response()
+    single.status_code = response.status_code
+    single.headers = response.headers
+    single.url = response.url
+    single._content = json_codec.dumps(item if isinstance(item, list) else [item])
+    return single
+
+
+def _send_batch(profile: str, inputs: List[str]) -> requests.Response:
+    payload = {
+        "inputs": inputs if len(inputs) > 1 else inputs[0],
+        "parameters": {
+            "return_full_text": False,
+            "details": True,
+            **GENERATION_PROFILES[profile]
+        }
+    }
+    return upstream_pool.post({"Authorization": f"Bearer {HF_TOKEN}"}, payload, timeout=30)
+
+
+micro_batcher = MicroBatcher(_send_batch) if BATCH_ENABLED else None
+
+# Near-duplicate caches in front of the API, one per profile so a short voice
+# reply is never served to a text request (size/threshold come from the environment)
+prompt_caches = {name: PromptCache() for name in GENERATION_PROFILES}
+
+# Per-profile generation counters (requests, tokens, generation seconds),
+# shared across worker processes through the metrics files
+_generation_metrics = {
+    name: (metrics.generation_requests.labels(name), metrics.generation_tokens.labels(name),
+           metrics.generation_seconds.labels(name))
+    for name in GENERATION_PROFILES
+}
+_cache_metrics = {
+    name: (metrics.prompt_cache_lookups.labels(name, "hit"), metrics.prompt_cache_lookups.labels(name, "miss"))
+    for name in GENERATION_PROFILES
+}
+
+# Small talk (greetings, thanks, goodbyes) is answered locally before the
+# cache or the API; the intents can be replaced via FAST_PATH_INTENTS
+fast_path = IntentMatcher(load_intents()) if FAST_PATH_ENABLED else None
+_fast_path_metrics = {
+    name: metrics.fast_path_lookups.labels(name)
+    for name in (list(fast_path.replies) if fast_path else []) + ["none"]
+}
+
+_SENTENCE_END = re.compile(r"[.!?](?=[\"')\]]*(\s|$))")
+
+
+def truncate_at_sentence(text: str) -> str:
+    """
+    Cut text after its last complete sentence.
+
+    Used when generation stopped at the token limit, so the reply doesn't end
+    (or get spoken) mid-sentence. Text without any sentence end is returned as is.
+    """
+    text = text.strip()
+    last_end = None
+    for match in _SENTENCE_END.finditer(text):
+        last_end = match.end()
+    if last_end is None or last_end == len(text):
+        return text
+    return text[:last_end].rstrip()
+
+
+def strip_stop_sequences(text: str, stop: List[str]) -> str:
+    """
+    Remove stop sequences the endpoint left at the end of the reply.
+
+    The inference API includes the stop sequence it matched ("... User:") in
+    the generated text; it is not part of the reply.
+    """
+    text = text.strip()
+    stripped = True
+    while stripped:
+        stripped = False
+        for sequence in stop:
+            sequence = sequence.strip()
+            if sequence and text.endswith(sequence):
+                text = text[:-len(sequence)].rstrip()
+                stripped = True
+    return text
+
+
+def record_generation(profile: str, tokens: int, seconds: float):
+    """Record tokens generated and upstream time for a profile"""
+    requests_counter, tokens_counter, seconds_histogram = _generation_metrics[profile]
+    requests_counter.inc()
+    tokens_counter.inc(tokens)
+    seconds_histogram.observe(seconds)
+
+
+def cached_reply(profile: str, user_input: str) -> Optional[str]:
+    """Look up the profile's prompt cache, counting hits and misses"""
+    reply = prompt_caches[profile].get(user_input)
+    hits, misses = _cache_metrics[profile]
+    (hits if reply is not None else misses).inc()
+    return reply
+
+
+def fast_path_reply(user_input: str) -> Optional[str]:
+    """Answer recognized small talk from its templates (None: ask the model), counting hits by intent"""
+    if fast_path is None:
+        return None
+    intent = fast_path.classify(user_input)
+    _fast_path_metrics[intent or "none"].inc()
+    return fast_path.reply(intent) if intent else None
 
-def get_response(user_input: str, session_id: str) -> str:
+
+def get_fast_path_stats(merged: Optional[dict] = None) -> dict:
+    """Return fast-path hits by intent, misses and hit ratio (all workers)"""
+    merged = merged or metrics.snapshot()
+    prefix = "fast_path_lookups_total{intent="
+    lookups = {key[len(prefix):-1]: int(value) for key, value in merged["counters"].items()
+               if key.startswith(prefix)}
+    misses = lookups.pop("none", 0)
+    hits = sum(lookups.values())
+    return {
+        "enabled": fast_path is not None,
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+        "intents": lookups,
+    }
+
+
+def get_prompt_cache_stats(merged: Optional[dict] = None) -> dict:
+    """Return per-profile prompt-cache hits, misses and hit ratio (all workers)"""
+    counters = (merged or metrics.snapshot())["counters"]
+    stats = {}
+    for name in GENERATION_PROFILES:
+        hits = int(counters.get(f"prompt_cache_lookups_total{{profile={name},result=hit}}", 0))
+        misses = int(counters.get(f"prompt_cache_lookups_total{{profile={name},result=miss}}", 0))
+        stats[name] = {"hits": hits, "misses": misses,
+                       "hit_ratio": hits / (hits + misses) if hits + misses else 0.0}
+    return stats
+
+
+def get_generation_stats() -> dict:
+    """Return per-profile request counts, token totals and tokens per second (all workers)"""
+    merged = metrics.snapshot()
+    stats = {}
+    for name in GENERATION_PROFILES:
+        label = "{profile=" + name + "}"
+        tokens = int(merged["counters"].get("generation_tokens_total" + label, 0))
+        seconds = merged["histograms"].get("generation_seconds" + label, {}).get("sum", 0.0)
+        stats[name] = {
+            "requests": int(merged["counters"].get("generation_requests_total" + label, 0)),
+            "tokens": tokens,
+            "seconds": seconds,
+            "tokens_per_second": tokens / seconds if seconds else 0.0,
+        }
+    return stats
+
+
+def get_response(user_input: str, session_id: str, profile: Optional[str] = None,
+                 turn_stats: Optional[dict] = None) -> str:
     """
     Generate a response by calling the Hugging Face Inference API.
     
     Args:
         user_input: The user's message
         session_id: Unique identifier for the conversation session
+        profile: Name of a GENERATION_PROFILES entry (defaults to DEFAULT_PROFILE)
+        turn_stats: Optional dict filled with cache_hit, upstream_ms, retries and
+            tokens for this turn (stored with the conversation)
 
     Returns:
         str: The bot's response
     """
+    profile = profile or DEFAULT_PROFILE
+    if profile not in GENERATION_PROFILES:
+        raise ValueError(f"Unknown generation profile: {profile}")
+
+    local_reply = fast_path_reply(user_input)
+    if local_reply is not None:
+        return local_reply
+    return _model_reply(user_input, profile, turn_stats)
+
+def _model_reply(user_input: str, profile: str, turn_stats: Optional[dict] = None) -> str:
+    """get_response without the fast path: prompt cache, then the API with retries"""
     if not HF_TOKEN:
         logger.error("HF_TOKEN environment variable not set.")
-        return "Sorry, the AI service is not configured correctly. Please contact the administrator."
+        return NOT_CONFIGURED_REPLY
+
+    if turn_stats is None:
+        turn_stats = {}
+    prompt_cache = prompt_caches[profile]
+    cached_response = cached_reply(profile, user_input)
+    turn_stats["cache_hit"] = cached_response is not None
+    if cached_response is not None:
+        return cached_response
 
     headers = {"Authorization": f"Bearer {HF_TOKEN}"}
     payload = {
         "inputs": user_input,
         "parameters": {
             "return_full_text": False,
-            "max_new_tokens": 250
+            "details": True,
+            **GENERATION_PROFILES[profile]
         }
     }
 
+    upstream_seconds = 0.0
     for attempt in range(MAX_RETRIES):
+        turn_stats["retries"] = attempt
         try:
-            response = requests.post(API_URL, headers=headers, json=payload, timeout=30)
+            start_time = time.perf_counter()
+            try:
+                if micro_batcher is not None:
+                    response = micro_batcher.submit(profile, user_input)
+                else:
+                    response = upstream_pool.post(headers, payload, timeout=30)
+            finally:
+                upstream_seconds += time.perf_counter() - start_time
+                turn_stats["upstream_ms"] = round(upstream_seconds * 1000, 1)
+            warm_keeper.record_traffic()
             
             # If the model is loading, Hugging Face returns a 503 error.
             # We should wait and retry.
             if response.status_code == 503:
-                wait_time = response.json().get("estimated_time", RETRY_WAIT_SECONDS)
-                logger.info(f"Model is loading, retrying in {wait_time:.2f} seconds... (Attempt {attempt + 1}/{MAX_RETRIES})")
+                wait_time = json_codec.loads(response.content).get("estimated_time", RETRY_WAIT_SECONDS)
+                warm_keeper.record_cold_start(wait_time)
+                logger.info("Model is loading, retrying in %.2f seconds... (Attempt %d/%d)", wait_time, attempt + 1, MAX_RETRIES)
                 time.sleep(wait_time)
                 continue
 
             response.raise_for_status()  # Raise an exception for other bad status codes (4xx or 5xx)
 
-            result = response.json()
+            result = json_codec.loads(response.content)
             
             if result and isinstance(result, list) and 'generated_text' in result[0]:
-                bot_response = result[0]['generated_text'].strip()
+                elapsed = time.perf_counter() - start_time
+                bot_response = strip_stop_sequences(result[0]['generated_text'],
+                                                    GENERATION_PROFILES[profile].get("stop", []))
+                details = result[0].get('details') or {}
+                tokens = details.get('generated_tokens') or len(bot_response.split())
+                if details.get('finish_reason', 'length') == 'length':
+                    # Stopped at the token limit, possibly mid-sentence
+                    bot_response = truncate_at_sentence(bot_response)
+                record_generation(profile, tokens, elapsed)
+                turn_stats["tokens"] = tokens
+                logger.info("Generated tokens", extra={"fields": {
+                    "profile": profile,
+                    "tokens": tokens,
+                    "seconds": round(elapsed, 3),
+                    "tokens_per_second": round(tokens / elapsed, 1) if elapsed else None,
+                }})
+                if bot_response:
+                    prompt_cache.put(user_input, bot_response)
                 return bot_response
             else:
-                logger.error(f"Unexpected API response format: {result}")
-                return "I'm sorry, I received an unusual response from the AI. Please try again."
+                logger.error("Unexpected API response format: %s", result)
+                return UNUSUAL_RESPONSE_REPLY
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API request failed on attempt {attempt + 1}: {e}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # ValueError: a body that is not JSON (e.g. a proxy error page)
+            logger.error("API request failed on attempt %d: %s", attempt + 1, e)
             if attempt < MAX_RETRIES - 1:
                 time.sleep(2) # Wait a couple of seconds before the next retry for general network issues
             else:
-                return "I'm sorry, I'm having trouble connecting to the AI service. Please try again in a moment."
+                return CONNECTION_ERROR_REPLY
         except Exception as e:
-            logger.error(f"Error processing API response: {e}")
-            return "I'm sorry, an unexpected error occurred. Please try again."
+            logger.error("Error processing API response: %s", e)
+            return UNEXPECTED_ERROR_REPLY
+    
+    return UNAVAILABLE_REPLY
+
+def stream_response(user_input: str, session_id: str, profile: Optional[str] = None,
+                    cancelled: Optional[threading.Event] = None, turn_stats: Optional[dict] = None):
+    """
+    Generate a response token by token using the API's streaming mode.
     
-    return "Sorry, the AI model is currently unavailable after multiple attempts. Please try again later."
+    Args:
+        user_input: The user's message
+        session_id: Unique identifier for the conversation session
+        profile: Name of a GENERATION_PROFILES entry (defaults to DEFAULT_PROFILE)
+        cancelled: Event that stops generation and closes the upstream stream when set
+        turn_stats: Optional dict filled as in get_response
+
+    Yields:
+        tuple: ("partial", text delta) while generating, then ("final", full reply).
+        Nothing more is yielded once cancelled is set.
+    """
+    profile = profile or DEFAULT_PROFILE
+    if profile not in GENERATION_PROFILES:
+        raise ValueError(f"Unknown generation profile: {profile}")
+    if turn_stats is None:
+        turn_stats = {}
+    local_reply = fast_path_reply(user_input)
+    if local_reply is not None:
+        yield "final", local_reply
+        return
+    if not HF_TOKEN:
+        yield "final", _model_reply(user_input, profile, turn_stats)
+        return
+
+    prompt_cache = prompt_caches[profile]
+    cached_response = cached_reply(profile, user_input)
+    turn_stats["cache_hit"] = cached_response is not None
+    if cached_response is not None:
+        yield "final", cached_response
+        return
+
+    headers = {"Authorization": f"Bearer {HF_TOKEN}"}
+    payload = {
+        "inputs": user_input,
+        "stream": True,
+        "parameters": {
+            "return_full_text": False,
+            "details": True,
+            **GENERATION_PROFILES[profile]
+        }
+    }
+
+    parts = []
+    finish_reason = None
+    tokens = 0
+    try:
+        start_time = time.perf_counter()
+        response = requests.post(upstream_pool.primary_url(), data=json_codec.dumps(payload),
+                                 headers={**headers, "Content-Type": "application/json"},
+                                 timeout=30, stream=True)
+        warm_keeper.record_traffic()
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if cancelled is not None and cancelled.is_set():
+                    return  # leaving the with-block closes the upstream connection
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json_codec.loads(line[len("data:"):])
+                token = event.get("token") or {}
+                if token.get("text") and not token.get("special"):
+                    tokens += 1
+                    parts.append(token["text"])
+                    yield "partial", token["text"]
+                if event.get("details"):
+                    finish_reason = event["details"].get("finish_reason")
+                    tokens = event["details"].get("generated_tokens", tokens)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if cancelled is not None and cancelled.is_set():
+            return
+        if parts:
+            # Interrupted mid-reply: the client already has these partials, so a
+            # fresh full request would contradict them. End with what was sent
+            # (not cached, since it is incomplete).
+            logger.warning("Streaming request failed after %d tokens, ending the reply there: %s", len(parts), e)
+            turn_stats.update(upstream_ms=round((time.perf_counter() - start_time) * 1000, 1),
+                              retries=0, tokens=tokens)
+            yield "final", "".join(parts)
+            return
+        # Streaming unsupported or failed before any text: fall back to the hedged full request
+        logger.warning("Streaming request failed, falling back to a full request: %s", e)
+        yield "final", _model_reply(user_input, profile, turn_stats)
+        return
+
+    elapsed = time.perf_counter() - start_time
+    bot_response = strip_stop_sequences("".join(parts), GENERATION_PROFILES[profile].get("stop", []))
+    if finish_reason in (None, "length"):
+        bot_response = truncate_at_sentence(bot_response)
+    record_generation(profile, tokens, elapsed)
+    turn_stats.update(upstream_ms=round(elapsed * 1000, 1), retries=0, tokens=tokens)
+    if bot_response:
+        prompt_cache.put(user_input, bot_response)
+    yield "final", bot_response
 
 if __name__ == "__main__":
     # Test the model
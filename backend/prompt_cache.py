@@ -0,0 +1,244 @@
+"""
+Near-duplicate prompt cache for ConversAI MVP
+Reuses replies for prompts that only differ by transcription noise
+("what's your name" / "what is your name?" / "whats ur name")
+Author: ConversAI MVP
+Run: python bench_prompt_cache.py
+"""
+
+import os
+import re
+import time
+import threading
+import zlib
+from typing import Optional
+
+import numpy as np
+
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "10000"))  # 0 disables the cache
+PROMPT_CACHE_THRESHOLD = float(os.getenv("PROMPT_CACHE_THRESHOLD", "0.78"))
+# Replies older than this are not reused ("what's the weather" changes); 0 keeps them until evicted
+PROMPT_CACHE_TTL_SECONDS = float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+
+EMBEDDING_DIM = 256
+NGRAM_SIZES = (2, 3, 4)
+
+# Candidate index for large caches (prefix filtering): every entry is indexed
+# under its rarest n-grams, and a lookup only scores entries posted under the
+# query's rarest n-grams. Near duplicates keep most of their rare n-grams, so
+# they are still found, while common n-grams ("wha", "the") are never probed.
+INDEX_NGRAMS = 6
+PROBE_NGRAMS = 10
+# Below this many entries a full matrix scan is cheaper than the index
+BRUTE_FORCE_LIMIT = 4096
+
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+_SPACES = re.compile(r"\s+")
+
+# Words that flip a prompt's meaning while barely moving its embedding
+# ("turn on the lights" / "turn off the lights", "weather today" / "weather
+# tomorrow"): a hit needs the same set of these, and of numbers, in both prompts
+GUARD_WORDS = frozenset((
+    "no", "not", "never", "nothing", "none", "nor", "without", "dont", "doesnt", "didnt", "isnt",
+    "arent", "wasnt", "werent", "cant", "cannot", "wont", "wouldnt", "shouldnt", "couldnt", "havent",
+    "on", "off", "up", "down", "out", "open", "close", "start", "stop", "enable", "disable",
+    "yes", "more", "less", "before", "after", "first", "last", "next", "previous",
+    "now", "today", "tonight", "tomorrow", "yesterday", "morning", "afternoon", "evening", "night",
+    "week", "weekend", "month", "year", "monday", "tuesday", "wednesday", "thursday", "friday",
+    "saturday", "sunday", "january", "february", "march", "april", "may", "june", "july", "august",
+    "september", "october", "november", "december",
+    "zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven",
+    "twelve", "twenty", "thirty", "fifty", "hundred", "thousand", "million",
+))
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation/apostrophes and collapse whitespace"""
+    text = _NON_WORD.sub("", text.lower().replace("-", " "))
+    return _SPACES.sub(" ", text).strip()
+
+
+def guard_terms(text: str) -> frozenset:
+    """Return the numbers and GUARD_WORDS of the normalized text"""
+    return frozenset(word for word in normalize(text).split()
+                     if word in GUARD_WORDS or any(c.isdigit() for c in word))
+
+
+def ngram_hashes(text: str) -> np.ndarray:
+    """Return the crc32 of every character n-gram of the normalized text"""
+    padded = f" {normalize(text)} "
+    return np.array([
+        zlib.crc32(padded[i:i + n].encode("utf-8"))
+        for n in NGRAM_SIZES
+        for i in range(len(padded) - n + 1)
+    ], dtype=np.uint32)
+
+
+def embed(text: str, dim: int = EMBEDDING_DIM, hashes: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Embed text as an L2-normalized vector of signed, hashed character n-grams
+
+    Args:
+        text: Prompt to embed
+        dim: Number of hash buckets
+        hashes: Precomputed ngram_hashes(text), if available
+
+    Returns:
+        np.ndarray: float32 vector of length dim (all zeros for empty text)
+    """
+    if hashes is None:
+        hashes = ngram_hashes(text)
+    if hashes.size == 0:
+        return np.zeros(dim, dtype=np.float32)
+
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+    vector = np.bincount(hashes % dim, weights=signs, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class PromptCache:
+    """
+    Bounded prompt -> reply cache with cosine-similarity lookup
+
+    Embeddings live in one preallocated NumPy matrix. Lookups score the query
+    against every row (small caches) or against the candidate rows from the
+    rare n-gram index (large caches), and return the best-scoring reply above
+    threshold that is younger than ttl_seconds and has the same guard terms
+    (numbers, negations, time words) as the query. When full, the least
+    recently used entry is evicted.
+    """
+
+    def __init__(self, capacity: int = PROMPT_CACHE_SIZE, threshold: float = PROMPT_CACHE_THRESHOLD,
+                 dim: int = EMBEDDING_DIM, ttl_seconds: float = PROMPT_CACHE_TTL_SECONDS):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.dim = dim
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._replies = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._stored_at = np.zeros(capacity, dtype=np.float64)
+        self._guards = [None] * capacity
+        self._clock = 0
+        self._size = 0
+
+        # n-gram -> number of entries containing it, and rare n-gram -> slots
+        self._doc_freq = {}
+        self._postings = {}
+        self._slot_ngrams = [None] * capacity
+        self._slot_index = [()] * capacity
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _rarest(self, ngrams, count: int, known_only: bool):
+        doc_freq = self._doc_freq
+        if known_only:
+            ngrams = [h for h in ngrams if h in doc_freq]
+        return sorted(ngrams, key=lambda h: doc_freq.get(h, 0))[:count]
+
+    def _candidates(self, ngrams) -> np.ndarray:
+        slots = set()
+        for ngram in self._rarest(ngrams, PROBE_NGRAMS, known_only=True):
+            slots.update(self._postings.get(ngram, ()))
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def get(self, prompt: str) -> Optional[str]:
+        """Return a cached reply for a prompt similar enough to this one, or None"""
+        if self.capacity <= 0:
+            return None
+        hashes = ngram_hashes(prompt)
+        vector = embed(prompt, self.dim, hashes)
+        guards = guard_terms(prompt)
+
+        with self._lock:
+            if self._size == 0 or not vector.any():
+                self.misses += 1
+                return None
+
+            if self._size <= BRUTE_FORCE_LIMIT:
+                slots = np.arange(self._size)
+                scores = self._matrix[:self._size] @ vector
+            else:
+                slots = self._candidates(set(hashes.tolist()))
+                scores = self._matrix[slots] @ vector
+
+            # Entries above threshold, best first: usually none or one
+            above = np.flatnonzero(scores >= self.threshold)
+            oldest = time.monotonic() - self.ttl_seconds if self.ttl_seconds > 0 else -np.inf
+            best = None
+            for i in above[np.argsort(-scores[above])]:
+                slot = int(slots[i])
+                if self._stored_at[slot] >= oldest and self._guards[slot] == guards:
+                    best = slot
+                    break
+            if best is None:
+                self.misses += 1
+                return None
+
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self.hits += 1
+            return self._replies[best]
+
+    def put(self, prompt: str, reply: str):
+        """Store a reply, evicting the least recently used entry when full"""
+        if self.capacity <= 0:
+            return
+        hashes = ngram_hashes(prompt)
+        vector = embed(prompt, self.dim, hashes)
+        if not vector.any():
+            return
+        ngrams = set(hashes.tolist())
+
+        with self._lock:
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(self._last_used.argmin())
+                self._unindex(slot)
+
+            self._matrix[slot] = vector
+            self._replies[slot] = reply
+            self._stored_at[slot] = time.monotonic()
+            self._guards[slot] = guard_terms(prompt)
+            self._clock += 1
+            self._last_used[slot] = self._clock
+
+            for ngram in ngrams:
+                self._doc_freq[ngram] = self._doc_freq.get(ngram, 0) + 1
+            index = self._rarest(ngrams, INDEX_NGRAMS, known_only=False)
+            for ngram in index:
+                self._postings.setdefault(ngram, set()).add(slot)
+            self._slot_ngrams[slot] = ngrams
+            self._slot_index[slot] = index
+
+    def _unindex(self, slot: int):
+        for ngram in self._slot_index[slot]:
+            postings = self._postings[ngram]
+            postings.discard(slot)
+            if not postings:
+                del self._postings[ngram]
+        for ngram in self._slot_ngrams[slot]:
+            remaining = self._doc_freq[ngram] - 1
+            if remaining:
+                self._doc_freq[ngram] = remaining
+            else:
+                del self._doc_freq[ngram]
+
+    def stats(self) -> dict:
+        """Return size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": self._size,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Traffic replay harness for ConversAI MVP
+Replays recorded sessions from conversations.db against /api/chat at 1x..Nx
+speed (turn order and inter-arrival gaps preserved) with a stubbed upstream,
+and reports how latency and error rates degrade as the speed goes up
+Author: ConversAI MVP
+Run: python replay_traffic.py --db conversations.db --sessions 500 --speeds 1 4 16 64
+"""
+
+import argparse
+import heapq
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+import database
+
+
+def load_sessions(db_path: str, shards: int, limit: int, max_idle: float = None) -> list:
+    """
+    Return the most recent sessions as lists of (offset_seconds, user_input)
+
+    Offsets are relative to the earliest turn replayed, so sessions keep their
+    original start times relative to each other. With max_idle, quiet periods
+    longer than that (between session starts or between turns) are shortened
+    to max_idle seconds.
+    """
+    database.DB_PATH = db_path
+    database.DB_SHARDS = shards
+    session_ids = database.get_all_sessions()[:limit]
+
+    by_shard = {}
+    for session_id in session_ids:
+        by_shard.setdefault(database.get_db_path(session_id), []).append(session_id)
+
+    turns = {}
+    for path, ids in by_shard.items():
+        conn = sqlite3.connect(path)
+        for first in range(0, len(ids), 500):
+            chunk = ids[first:first + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for session_id, user_input, timestamp in conn.execute(f'''
+                SELECT session_id, user_input, timestamp FROM conversations
+                WHERE session_id IN ({placeholders})
+                ORDER BY timestamp, id
+            ''', chunk):
+                seconds = datetime.fromisoformat(timestamp).timestamp()
+                turns.setdefault(session_id, []).append((seconds, user_input))
+        conn.close()
+
+    if not turns:
+        return []
+    ordered = sorted(turns.values(), key=lambda session: session[0][0])
+    sessions = []
+    previous_start = ordered[0][0][0]
+    start = 0.0
+    for session in ordered:
+        gap = session[0][0] - previous_start
+        start += min(gap, max_idle) if max_idle else gap
+        previous_start = session[0][0]
+
+        offset = start
+        replayed = [(offset, session[0][1])]
+        for (before, _), (seconds, user_input) in zip(session, session[1:]):
+            gap = seconds - before
+            offset += min(gap, max_idle) if max_idle else gap
+            replayed.append((offset, user_input))
+        sessions.append(replayed)
+    return sessions
+
+
+def start_local_server(upstream_ms: float, cache: bool) -> str:
+    """Run app.py in-process against a stub upstream and a scratch database"""
+    from bench_hedging import start_stub
+
+    stub_url = start_stub(upstream_ms / 1000, upstream_ms / 1000, 0.0, seed=0)
+    scratch = tempfile.mkdtemp(prefix="replay_")
+    os.environ.update({
+        "HF_TOKEN": os.getenv("HF_TOKEN", "replay-token"),
+        "UPSTREAM_URLS": stub_url,
+        "WARMKEEPER_ENABLED": "0",
+        "LOG_LEVEL": "WARNING",
+        "IDEMPOTENCY_DB_PATH": os.path.join(scratch, "idempotency.db"),
+        # Small-talk turns answered in-process would never reach the stub and
+        # make latency look better than the upstream allows
+        "FAST_PATH_ENABLED": "0",
+    })
+    if not cache:
+        os.environ["PROMPT_CACHE_SIZE"] = "0"
+    database.DB_PATH = os.path.join(scratch, "conversations.db")
+    database.DB_SHARDS = 1
+
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def replay(base_url: str, sessions: list, speed: float, workers: int, timeout: float) -> dict:
+    """
+    Replay sessions at the given speed; each turn is sent once the previous turn
+    of its session has answered and its (scaled) original gap has passed
+
+    Non-200 responses, request failures and the model's fallback replies
+    ("I'm having trouble connecting...", sent with a 200) count as errors.
+    """
+    # Imported here: the in-process server sets the model's environment first
+    from model import FALLBACK_REPLIES
+
+    results = []
+    results_lock = threading.Lock()
+    events = []  # (due, sequence, session index, turn index, session_id)
+    events_lock = threading.Condition()
+    sequence = 0
+
+    start = time.monotonic()
+    for index, session in enumerate(sessions):
+        events.append((start + session[0][0] / speed, sequence, index, 0, f"replay_{index}_{int(start)}"))
+        sequence += 1
+    heapq.heapify(events)
+    remaining = sum(len(session) for session in sessions)
+
+    def send(index, turn, session_id):
+        nonlocal sequence, remaining
+        session = sessions[index]
+        sent = time.monotonic()
+        error = None
+        try:
+            response = requests.post(f"{base_url}/api/chat", timeout=timeout,
+                                     json={"message": session[turn][1], "session_id": session_id})
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}"
+            else:
+                body = response.json()
+                if isinstance(body, dict) and body.get("reply") in FALLBACK_REPLIES:
+                    error = "fallback reply"
+        except (requests.exceptions.RequestException, ValueError) as e:
+            error = type(e).__name__
+        done = time.monotonic()
+        with results_lock:
+            results.append((done - sent, error))
+
+        with events_lock:
+            remaining -= 1
+            if turn + 1 < len(session):
+                gap = (session[turn + 1][0] - session[turn][0]) / speed
+                heapq.heappush(events, (max(done, sent + gap), sequence, index, turn + 1, session_id))
+                sequence += 1
+            events_lock.notify()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        with events_lock:
+            while remaining > 0:
+                if not events:
+                    events_lock.wait()
+                    continue
+                due = events[0][0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    events_lock.wait(delay)
+                    continue
+                _, _, index, turn, session_id = heapq.heappop(events)
+                executor.submit(send, index, turn, session_id)
+    elapsed = time.monotonic() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, error in results if error)
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": errors / len(results) if results else 0.0,
+        "throughput": len(results) / elapsed if elapsed else 0.0,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded conversations against /api/chat")
+    parser.add_argument("--db", default="conversations.db", help="database to read sessions from")
+    parser.add_argument("--shards", type=int, default=1, help="shard count of --db")
+    parser.add_argument("--sessions", type=int, default=200, help="most recent sessions to replay")
+    parser.add_argument("--max-idle", type=float, default=60,
+                        help="shorten recorded quiet periods to this many seconds (0 keeps them)")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1, 4, 16], help="replay speed multipliers")
+    parser.add_argument("--url", help="replay against a running server instead of an in-process one")
+    parser.add_argument("--upstream-ms", type=float, default=300, help="stub upstream latency (in-process server)")
+    parser.add_argument("--cache", action="store_true", help="keep the prompt cache enabled")
+    parser.add_argument("--workers", type=int, default=256, help="maximum concurrent requests")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.db, args.shards, args.sessions, args.max_idle or None)
+    if not sessions:
+        raise SystemExit(f"No sessions found in {args.db}")
+    turns = sum(len(session) for session in sessions)
+    span = max(session[-1][0] for session in sessions)
+    print(f"Replaying {len(sessions)} sessions, {turns} turns, {span / 60:.1f} minutes at 1x")
+
+    base_url = args.url or start_local_server(args.upstream_ms, args.cache)
+    print(f"{'speed':>7} {'requests':>9} {'req/s':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for speed in args.speeds:
+        stats = replay(base_url, sessions, speed, args.workers, args.timeout)
+        print(f"{speed:>6g}x {stats['requests']:>9} {stats['throughput']:>8.1f} {stats['error_rate']:>7.1%} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,11 @@ Run: python run_tests.py
 import sys
 import os
 import time
+import tempfile
 import subprocess
 import requests
 import json
+from contextlib import contextmanager
 from datetime import datetime
 
 # Add current directory to path
@@ -30,6 +32,25 @@ def print_test_result(test_name, success, details=""):
     if details:
         print(f"  Details: {details}")
 
+@contextmanager
+def temporary_database(shards=1):
+    """
+    Point database.py at a new conversations.db in a temporary directory
+
+    Yields the directory. DB_PATH and DB_SHARDS are restored afterwards, also
+    when the test changed them itself (e.g. after rebalancing shards).
+    """
+    import database
+    
+    original_path, original_shards = database.DB_PATH, database.DB_SHARDS
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            database.DB_PATH = os.path.join(tmp_dir, "conversations.db")
+            database.DB_SHARDS = shards
+            yield tmp_dir
+    finally:
+        database.DB_PATH, database.DB_SHARDS = original_path, original_shards
+
 def test_imports():
     """Test that all required modules can be imported"""
     print_header("Testing Imports")
@@ -82,6 +103,1018 @@ def test_database():
         print_test_result("Database operations", False, str(e))
         return False
 
+def test_sharded_storage():
+    """Test session routing, fan-out and rebalancing of sharded storage"""
+    print_header("Testing Sharded Storage")
+    
+    import database
+    
+    try:
+        checks = []
+        with temporary_database(shards=4):
+            database.init_db()
+            
+            sessions = [f"shard_test_{i}" for i in range(20)]
+            for session_id in sessions:
+                database.save_conversation(session_id, "Hello", "Hi there!")
+            
+            used = {database.shard_index(s) for s in sessions}
+            success = len(used) > 1
+            print_test_result("Sessions spread over shards", success, f"{len(used)}/4 shards used")
+            checks.append(success)
+            
+            success = all(len(database.get_recent(s, 5)) == 1 for s in sessions)
+            print_test_result("Read from owning shard", success)
+            checks.append(success)
+            
+            success = sorted(database.get_all_sessions()) == sorted(sessions)
+            print_test_result("Session listing fan-out", success)
+            checks.append(success)
+            
+            moved = database.rebalance_shards(4, 2)
+            database.DB_SHARDS = 2
+            success = moved == len(sessions) and all(len(database.get_recent(s, 5)) == 1 for s in sessions)
+            print_test_result("Rebalance 4 -> 2 shards", success, f"Moved {moved} rows")
+            checks.append(success)
+            
+            # A stray single-file database is not part of the 2-shard layout: never overwrite it
+            import sqlite3
+            database._create_schema(database.DB_PATH)
+            conn = sqlite3.connect(database.DB_PATH)
+            conn.execute("INSERT INTO conversations (session_id, user_input, bot_response) VALUES ('stray', 'a', 'b')")
+            conn.commit()
+            conn.close()
+            try:
+                database.rebalance_shards(2, 1)
+                success = False
+            except ValueError:
+                success = all(len(database.get_recent(s, 5)) == 1 for s in sessions)
+            print_test_result("Stray target file kept", success)
+            checks.append(success)
+            
+            os.remove(database.DB_PATH)
+            moved = database.rebalance_shards(2, 1)
+            database.DB_SHARDS = 1
+            leftovers = [name for name in os.listdir(os.path.dirname(database.DB_PATH)) if "shard" in name]
+            success = (moved == len(sessions) and not leftovers
+                       and all(len(database.get_recent(s, 5)) == 1 for s in sessions))
+            print_test_result("Rebalance 2 -> 1 shard", success, f"Moved {moved} rows, left: {leftovers}")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Sharded storage", False, str(e))
+        return False
+
+def test_turn_stats():
+    """Test per-turn performance columns, schema migration and rollup stats"""
+    print_header("Testing Turn Stats Rollups")
+    
+    import sqlite3
+    import multiprocessing
+    import database
+    
+    try:
+        checks = []
+        with temporary_database(shards=2):
+            # A shard written before the performance columns existed
+            legacy_path = database.shard_paths()[0]
+            conn = sqlite3.connect(legacy_path)
+            conn.execute('''
+                CREATE TABLE conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,
+                    user_input TEXT NOT NULL, bot_response TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.executemany("INSERT INTO conversations (session_id, user_input, bot_response) VALUES (?, ?, ?)",
+                             [(f"legacy_{i}", "Hello", "Hi") for i in range(5)])
+            conn.commit()
+            conn.close()
+            
+            # Every worker migrates at import; they must not trip over each other
+            processes = [multiprocessing.Process(target=database._create_schema, args=(legacy_path,))
+                         for _ in range(4)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            success = all(process.exitcode == 0 for process in processes)
+            print_test_result("Concurrent migration", success, f"Exit codes: {[p.exitcode for p in processes]}")
+            checks.append(success)
+            
+            database.init_db()
+            stats = database.get_turn_stats("hour", 24)
+            success = stats["overall"]["turns"] == 5
+            print_test_result("Legacy rows migrated and backfilled", success, f"Turns: {stats['overall']['turns']}")
+            checks.append(success)
+            
+            latencies = [50, 150, 250, 400, 900, 1200, 2500, 4000, 8000, 20000]
+            for i, total_ms in enumerate(latencies):
+                database.save_conversation(f"stats_{i}", "Question", "Answer", upstream_ms=total_ms * 0.8,
+                                           total_ms=total_ms, retries=i % 3 == 0, cache_hit=i % 2 == 0,
+                                           tokens=20)
+            
+            stats = database.get_turn_stats("hour", 24)
+            overall = stats["overall"]
+            success = (overall["turns"] == 15 and overall["tokens"] == 200
+                       and abs(overall["cache_hit_rate"] - 5 / 15) < 1e-3
+                       and abs(overall["retry_rate"] - 4 / 15) < 1e-3
+                       and abs(overall["avg_total_ms"] - sum(latencies) / 10) < 0.1)
+            print_test_result("Counts, rates and averages", success,
+                              f"Cache hit rate: {overall['cache_hit_rate']}, retry rate: {overall['retry_rate']}")
+            checks.append(success)
+            
+            success = 750 <= overall["p50_ms"] <= 1200 and overall["p95_ms"] >= 8000
+            print_test_result("Percentiles from histograms", success,
+                              f"p50 {overall['p50_ms']} ms, p95 {overall['p95_ms']} ms")
+            checks.append(success)
+            
+            daily = database.get_turn_stats("day", 7)
+            success = daily["overall"]["turns"] == 15
+            print_test_result("Daily rollup matches hourly", success)
+            checks.append(success)
+            
+            # Another worker running init_db() during a bulk load must not bring the trigger back early
+            with database.rollups_deferred():
+                database.save_conversation("bulk_0", "Question", "Answer", total_ms=100)
+                database.init_db()
+                for i in range(1, 4):
+                    database.save_conversation(f"bulk_{i}", "Question", "Answer", total_ms=100)
+            database.save_conversation("bulk_4", "Question", "Answer", total_ms=100)
+            turns = database.get_turn_stats("hour", 24)["overall"]["turns"]
+            success = turns == 20
+            print_test_result("init_db() during deferred rollups", success, f"Turns: {turns} (expected 20)")
+            checks.append(success)
+            overall = database.get_turn_stats("hour", 24)["overall"]
+            
+            database.rebalance_shards(2, 3)
+            database.DB_SHARDS = 3
+            moved = database.get_turn_stats("hour", 24)["overall"]
+            success = moved["turns"] == 20 and moved["avg_total_ms"] == overall["avg_total_ms"]
+            print_test_result("Rollups survive rebalancing", success)
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Turn stats", False, str(e))
+        return False
+
+def test_prompt_cache():
+    """Test near-duplicate lookups and eviction of the prompt cache"""
+    print_header("Testing Prompt Cache")
+    
+    try:
+        from prompt_cache import PromptCache
+        
+        cache = PromptCache(capacity=2, threshold=0.78)
+        cache.put("What's your name?", "I'm ConversAI.")
+        
+        success = cache.get("what is your name") == "I'm ConversAI."
+        print_test_result("Near-duplicate hit", success)
+        
+        success = cache.get("tell me a joke") is None
+        print_test_result("Unrelated prompt misses", success)
+        
+        cache.put("tell me a joke", "Why did the chicken...")
+        cache.get("whats your name")
+        cache.put("how is the weather", "Sunny!")
+        evicted = cache.get("tell me a joke") is None and cache.get("what's your name") is not None
+        print_test_result("LRU eviction", evicted, f"Stats: {cache.stats()}")
+        
+        # Similar-looking prompts that ask for something else must never share a reply
+        cache = PromptCache(capacity=16, threshold=0.78)
+        pairs = [("turn on the lights", "turn off the lights"),
+                 ("what is the weather today", "what is the weather tomorrow"),
+                 ("set a timer for 5 minutes", "set a timer for 15 minutes"),
+                 ("is it going to rain", "is it not going to rain")]
+        for stored, _ in pairs:
+            cache.put(stored, f"Reply to {stored}")
+        false_hits = [query for _, query in pairs if cache.get(query) is not None]
+        guarded = not false_hits and cache.get("whats ur name") is None and cache.get("turn on the lights") is not None
+        print_test_result("Different meanings never match", guarded, f"False hits: {false_hits}")
+        
+        cache = PromptCache(capacity=2, threshold=0.78, ttl_seconds=0.05)
+        cache.put("What's your name?", "I'm ConversAI.")
+        fresh = cache.get("whats ur name") == "I'm ConversAI."
+        time.sleep(0.1)
+        expired = fresh and cache.get("whats ur name") is None
+        print_test_result("Entries expire after the TTL", expired)
+        
+        return success and evicted and guarded and expired
+        
+    except Exception as e:
+        print_test_result("Prompt cache", False, str(e))
+        return False
+
+def test_fast_path():
+    """Test small-talk classification, custom intents and the fast-path hit ratio"""
+    print_header("Testing Fast Path")
+    
+    try:
+        import model
+        from fast_path import DEFAULT_INTENTS, IntentMatcher, load_intents
+        
+        checks = []
+        matcher = IntentMatcher(DEFAULT_INTENTS)
+        cases = {"Hi!": "greeting", "hello there, how are you?": "how_are_you", "Thanks so much": "thanks",
+                 "ok thanks bye": "goodbye", "thanks, what's the weather": None,
+                 "What is machine learning?": None, "um": None}
+        results = {text: matcher.classify(text) for text in cases}
+        success = results == cases
+        print_test_result("Whole-utterance intents", success, f"Results: {results}")
+        checks.append(success)
+        
+        start_time = time.perf_counter()
+        for _ in range(1000):
+            matcher.classify("thanks, what's the weather")
+        per_lookup_us = (time.perf_counter() - start_time) * 1000
+        success = per_lookup_us < 100
+        print_test_result("Classification cost", success, f"{per_lookup_us:.1f} us/lookup")
+        checks.append(success)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "intents.json")
+            with open(path, "w") as f:
+                json.dump({"weather": {"phrases": ["nice weather"], "replies": ["Lovely, isn't it?"]}}, f)
+            custom = IntentMatcher(load_intents(path))
+            success = custom.classify("Nice weather!") == "weather" and custom.classify("hello") is None
+            print_test_result("Intents from FAST_PATH_INTENTS", success)
+            checks.append(success)
+            
+            with open(path, "w") as f:
+                f.write("{not json")
+            success = load_intents(path) is DEFAULT_INTENTS
+            print_test_result("Bad intents file falls back", success)
+            checks.append(success)
+        
+        if model.fast_path is not None:
+            before = model.get_fast_path_stats()
+            reply = model.get_response("Good morning!", "fast_path_test")
+            after = model.get_fast_path_stats()
+            success = reply in DEFAULT_INTENTS["greeting"]["replies"] and after["hits"] == before["hits"] + 1
+            print_test_result("Answered without the model", success, f"Hit ratio: {after['hit_ratio']:.2f}")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Fast path", False, str(e))
+        return False
+
+def test_generation_profiles():
+    """Test profile validation and sentence-boundary truncation"""
+    print_header("Testing Generation Profiles")
+    
+    try:
+        from model import truncate_at_sentence, GENERATION_PROFILES
+        from app import app
+        
+        success = truncate_at_sentence("Hi there. I can help with that and") == "Hi there."
+        print_test_result("Truncate at sentence end", success)
+        
+        kept = truncate_at_sentence("no sentence end here") == "no sentence end here"
+        print_test_result("Keep text without sentence end", kept)
+        
+        profiles = {"voice-fast", "text-full"} <= set(GENERATION_PROFILES)
+        print_test_result("Built-in profiles", profiles, f"Profiles: {list(GENERATION_PROFILES)}")
+        
+        with app.test_client() as client:
+            response = client.post('/api/chat', json={'message': 'Hello', 'profile': 'nope'})
+            rejected = response.status_code == 400
+            print_test_result("Unknown profile rejected", rejected, f"Status: {response.status_code}")
+        
+        # The endpoint leaves the matched stop sequence at the end of the text
+        import model
+        from bench_hedging import start_stub
+        from prompt_cache import PromptCache
+        from upstream import EndpointPool
+        stop = GENERATION_PROFILES["voice-fast"]["stop"]
+        stripped = (model.strip_stop_sequences("Sure, I can help.\nUser:", stop) == "Sure, I can help."
+                    and model.strip_stop_sequences("Tell me, User: what next?", stop) == "Tell me, User: what next?")
+        
+        original = model.HF_TOKEN, model.upstream_pool, model.prompt_caches
+        try:
+            model.HF_TOKEN = "test"
+            model.upstream_pool = EndpointPool([start_stub(0.01, 0.01, 0.0, seed=1,
+                                                           text="Glad to help! User:")])
+            model.prompt_caches = {name: PromptCache(capacity=0) for name in GENERATION_PROFILES}
+            reply = model._model_reply("Can you help me?", "text-full", {})
+        finally:
+            model.HF_TOKEN, model.upstream_pool, model.prompt_caches = original
+        stripped = stripped and reply == "Glad to help!"
+        print_test_result("Trailing stop sequence removed", stripped, f"Reply: {reply!r}")
+        
+        # A stream that breaks after some tokens ends with those, not a different full reply
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        class BrokenStreamHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for text in ("Paris is", " the capital"):
+                    line = f'data: {{"token": {{"text": "{text}", "special": false}}}}\n\n'.encode()
+                    self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+                self.close_connection = True  # no terminating chunk: the client sees a broken stream
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer(("127.0.0.1", 0), BrokenStreamHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        original = model.HF_TOKEN, model.upstream_pool, model.prompt_caches
+        try:
+            model.HF_TOKEN = "test"
+            model.upstream_pool = EndpointPool([f"http://127.0.0.1:{server.server_address[1]}/"])
+            model.prompt_caches = {name: PromptCache(capacity=0) for name in GENERATION_PROFILES}
+            events = list(model.stream_response("What is the capital of France?", "stream_test", "voice-fast"))
+        finally:
+            model.HF_TOKEN, model.upstream_pool, model.prompt_caches = original
+            server.shutdown()
+        partial_text = "".join(chunk for kind, chunk in events if kind == "partial")
+        interrupted = (partial_text == "Paris is the capital" and events[-1][0] == "final"
+                       and events[-1][1].startswith(partial_text))
+        print_test_result("Interrupted stream ends with its partials", interrupted, f"Events: {events}")
+        
+        return success and kept and profiles and rejected and stripped and interrupted
+        
+    except Exception as e:
+        print_test_result("Generation profiles", False, str(e))
+        return False
+
+def test_micro_batching():
+    """Test that concurrent prompts share upstream calls and get their own results"""
+    print_header("Testing Micro-Batching")
+    
+    import threading
+    
+    try:
+        import requests as http
+        from model import MicroBatcher
+        
+        calls = []
+        checks = []
+        
+        def send(key, inputs):
+            calls.append(list(inputs))
+            if any("fail" in text for text in inputs):
+                raise http.exceptions.ConnectionError("upstream down")
+            response = http.Response()
+            response.status_code = 200
+            response._content = json.dumps([{"generated_text": f"{key}: {text}"} for text in inputs]).encode()
+            return response
+        
+        batcher = MicroBatcher(send, max_size=4, wait_seconds=0.2)
+        results = {}
+        
+        def submit(text):
+            try:
+                results[text] = json.loads(batcher.submit("voice-fast", text).content)[0]["generated_text"]
+            except Exception as e:
+                results[text] = type(e).__name__
+        
+        threads = [threading.Thread(target=submit, args=(f"prompt {i}",)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        success = len(calls) == 2 and sorted(len(batch) for batch in calls) == [2, 4]
+        print_test_result("Prompts coalesced into batches", success, f"Batch sizes: {[len(b) for b in calls]}")
+        checks.append(success)
+        
+        success = all(results[f"prompt {i}"] == f"voice-fast: prompt {i}" for i in range(6))
+        print_test_result("Each caller gets its own result", success)
+        checks.append(success)
+        
+        calls.clear()
+        threads = [threading.Thread(target=submit, args=(text,)) for text in ("fail now", "innocent")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        success = len(calls) == 1 and results["fail now"] == results["innocent"] == "ConnectionError"
+        print_test_result("Batch errors reach every caller", success, f"Results: {results['innocent']}")
+        checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Micro-batching", False, str(e))
+        return False
+
+def test_upstream_failover():
+    """Test that a failing primary endpoint fails over to the next one"""
+    print_header("Testing Upstream Failover")
+    
+    try:
+        from bench_hedging import start_stub
+        from upstream import EndpointPool
+        
+        # Nothing listens on port 9 (discard), so the primary fails to connect
+        pool = EndpointPool(["http://127.0.0.1:9/", start_stub(0.01, 0.01, 0.0, seed=1)])
+        before = pool.stats()
+        response = pool.post({}, {"inputs": "Hello"}, timeout=5)
+        success = response.ok and pool.stats()["failovers"] == before["failovers"] + 1
+        print_test_result("Failover to secondary", success, f"Status: {response.status_code}")
+        
+        stats = pool.stats()
+        recorded = stats["endpoints"][0]["failures"] == 1
+        print_test_result("Failure recorded", recorded, f"Stats: {stats['endpoints'][0]}")
+        
+        # A primary that always takes 2s gets hedged; the loser must be aborted, not left running
+        import threading
+        import time
+        import upstream
+        original_delay = upstream.HEDGE_DELAY_SECONDS
+        upstream.HEDGE_DELAY_SECONDS = 0.1
+        try:
+            pool = EndpointPool([start_stub(2.0, 2.0, 1.0, seed=1), start_stub(0.01, 0.01, 0.0, seed=1)])
+            before = pool.stats()
+            start_time = time.perf_counter()
+            response = pool.post({}, {"inputs": "Hello"}, timeout=5)
+            elapsed = time.perf_counter() - start_time
+            time.sleep(0.2)
+            running = [t for t in threading.enumerate() if t.name == "upstream"]
+        finally:
+            upstream.HEDGE_DELAY_SECONDS = original_delay
+        aborted = response.ok and pool.stats()["hedge_wins"] == before["hedge_wins"] + 1 and elapsed < 1.0 and not running
+        print_test_result("Hedge loser aborted", aborted,
+                          f"Took {elapsed:.2f}s, {len(running)} upstream call(s) still running")
+        
+        return success and recorded and aborted
+        
+    except Exception as e:
+        print_test_result("Upstream failover", False, str(e))
+        return False
+
+def test_voice_session():
+    """Test the voice WebSocket session protocol with an in-memory socket"""
+    print_header("Testing Voice Session")
+    
+    import threading
+    import voice_session
+    
+    original_stream, original_save = voice_session.stream_response, voice_session.save_conversation
+    try:
+        from voice_session import VoiceSession
+        
+        class FakeSocket:
+            def __init__(self, frames, wait_for=None):
+                self.frames = list(frames)
+                self.sent = []
+                self.wait_for = wait_for
+                self.done = threading.Event()
+            def receive(self):
+                if self.frames:
+                    frame = self.frames.pop(0)
+                    delay, frame = frame if isinstance(frame, tuple) else (0, frame)
+                    time.sleep(delay)
+                    return frame
+                if self.wait_for:
+                    self.done.wait(5)  # keep the connection open until the last turn finishes
+                return None
+            def send(self, data):
+                message = json.loads(data)
+                self.sent.append(message)
+                if self.wait_for and message.get("type") == "final" and message.get("id") == self.wait_for:
+                    self.done.set()
+        
+        ws = FakeSocket(['not json', json.dumps({"type": "utterance", "id": "1", "message": ""})])
+        VoiceSession(ws, "voice_test").run()
+        
+        types = [message["type"] for message in ws.sent]
+        success = types == ["ready", "error", "error"]
+        print_test_result("Ready and error frames", success, f"Frames: {types}")
+        
+        session = VoiceSession(FakeSocket([]), "voice_test")
+        session.cancel("missing")
+        cancel_noop = session.ws.sent == []
+        print_test_result("Cancel without turn is a no-op", cancel_noop)
+        
+        def fake_stream(text, session_id, profile, cancelled, turn_stats=None):
+            for i in range(5):
+                if cancelled.is_set():
+                    return
+                yield "partial", f"{text} {i} "
+                time.sleep(0.05)
+            yield "final", f"Reply to {text}"
+        
+        saved = []
+        voice_session.stream_response = fake_stream
+        voice_session.save_conversation = lambda session_id, text, reply, **stats: saved.append((text, reply))
+        
+        # Turn 1 is still streaming when turn 2 arrives (barge-in)
+        ws = FakeSocket([json.dumps({"type": "utterance", "id": "1", "message": "first"}),
+                         (0.12, json.dumps({"type": "utterance", "id": "2", "message": "second"}))], wait_for="2")
+        VoiceSession(ws, "voice_test").run()
+        
+        frames = [(m["type"], m.get("id")) for m in ws.sent]
+        partials = [m["text"] for m in ws.sent if m["type"] == "partial" and m["id"] == "2"]
+        finals = [m for m in ws.sent if m["type"] == "final"]
+        streamed = (partials == [f"second {i} " for i in range(5)] and len(finals) == 1
+                    and finals[0]["id"] == "2" and finals[0]["reply"] == "Reply to second")
+        print_test_result("Partial and final frames", streamed, f"Frames: {frames}")
+        
+        first_partials = frames.count(("partial", "1"))
+        barged_in = (("cancelled", "1") in frames and 0 < first_partials < 5
+                     and saved == [("second", "Reply to second")])
+        print_test_result("Barge-in cancels the turn", barged_in, f"Saved: {saved}")
+        
+        # A failed turn frees its slot: a later cancel has nothing to cancel
+        def failing_stream(text, session_id, profile, cancelled, turn_stats=None):
+            raise RuntimeError("upstream exploded")
+            yield
+        
+        voice_session.stream_response = failing_stream
+        session = VoiceSession(FakeSocket([]), "voice_test")
+        session.start_turn("3", "third", "voice-fast")
+        deadline = time.time() + 2
+        while not session.ws.sent and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        session.cancel()
+        frames = [m["type"] for m in session.ws.sent]
+        released = frames == ["error"] and session._turn_id is None
+        print_test_result("Failed turn released", released, f"Frames: {frames}")
+        
+        from app import app
+        with app.test_client() as client:
+            response = client.get('/ws/voice', headers={'Origin': 'https://evil.example'})
+            rejected = response.status_code == 403
+        with app.test_request_context('/ws/voice', headers={'Origin': 'http://localhost:5001'}):
+            from app import check_websocket_origin
+            rejected = rejected and check_websocket_origin() is None
+        print_test_result("Cross-site handshake rejected", rejected, f"Status: {response.status_code}")
+        
+        return success and cancel_noop and streamed and barged_in and released and rejected
+        
+    except Exception as e:
+        print_test_result("Voice session", False, str(e))
+        return False
+    finally:
+        voice_session.stream_response, voice_session.save_conversation = original_stream, original_save
+
+def test_structured_logging():
+    """Test JSON formatting, payload truncation and error rate limiting"""
+    print_header("Testing Structured Logging")
+    
+    try:
+        import logging
+        from structured_logging import JsonFormatter, RateLimitFilter
+        
+        checks = []
+        record = logging.LogRecord("app", logging.INFO, __file__, 1, "Generated response", None, None)
+        record.fields = {"session_id": "abc", "bot_reply": "x" * 1000}
+        entry = json.loads(JsonFormatter(sample_rate=1.0, max_chars=50).format(record))
+        success = entry["session_id"] == "abc" and len(entry["bot_reply"]) < 100
+        print_test_result("Payload truncated", success, f"Length: {len(entry['bot_reply'])}")
+        checks.append(success)
+        
+        entry = json.loads(JsonFormatter(sample_rate=0.0).format(record))
+        success = "bot_reply" not in entry and entry["bot_reply_chars"] == 1000
+        print_test_result("Payload sampled out", success)
+        checks.append(success)
+        
+        rate_limit = RateLimitFilter(limit=3, window=60)
+        error = logging.LogRecord("db", logging.ERROR, __file__, 1, "Error saving conversation: %s", ("locked",), None)
+        passed = sum(rate_limit.filter(error) for _ in range(10))
+        success = passed == 3
+        print_test_result("Repeated errors rate-limited", success, f"{passed}/10 passed")
+        checks.append(success)
+        
+        # A worker forked after setup (gunicorn --preload) still gets its records written
+        if hasattr(os, "fork"):
+            script = (
+                "import logging, os, sys\n"
+                "from structured_logging import setup_logging, shutdown_logging\n"
+                "setup_logging(level='INFO', async_mode=True, stream=sys.stdout)\n"
+                "pid = os.fork()\n"
+                "if pid == 0:\n"
+                "    logging.getLogger('worker').warning('from the child')\n"
+                "    shutdown_logging()\n"
+                "    os._exit(0)\n"
+                "os.waitpid(pid, 0)\n"
+            )
+            result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=30,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            success = "from the child" in result.stdout
+            print_test_result("Listener restarted after fork", success, result.stderr.strip()[-200:])
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Structured logging", False, str(e))
+        return False
+
+def test_idempotency():
+    """Test that an Idempotency-Key runs its handler only once"""
+    print_header("Testing Idempotency Keys")
+    
+    import threading
+    
+    try:
+        from idempotency import IdempotencyStore
+        
+        checks = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = IdempotencyStore(os.path.join(tmp_dir, "idempotency.db"))
+            calls = []
+            
+            def handler():
+                calls.append(1)
+                return 200, '{"reply": "Hi there!"}'
+            
+            first = store.execute("key-1", "body-hash", handler)
+            retry = store.execute("key-1", "body-hash", handler)
+            success = len(calls) == 1 and retry == (200, '{"reply": "Hi there!"}', True)
+            print_test_result("Retry replays stored response", success, f"Handler calls: {len(calls)}")
+            checks.append(success)
+            
+            status_code, _, _ = store.execute("key-1", "other-hash", handler)
+            success = status_code == 422
+            print_test_result("Key reuse with other body rejected", success, f"Status: {status_code}")
+            checks.append(success)
+            
+            store.execute("key-2", "body-hash", lambda: (500, '{"error": true}'))
+            store.execute("key-2", "body-hash", handler)
+            success = len(calls) == 2
+            print_test_result("Server errors not stored", success)
+            checks.append(success)
+            
+            store.execute("key-3", "body-hash", lambda: (200, '{"reply": "Sorry"}'),
+                          failed=lambda status_code, body: "Sorry" in body)
+            store.execute("key-3", "body-hash", handler)
+            success = len(calls) == 3
+            print_test_result("Failed replies not stored", success)
+            checks.append(success)
+            
+            # A handler outliving the lease keeps its key: the retry waits instead of running it again
+            store = IdempotencyStore(os.path.join(tmp_dir, "idempotency.db"), lease_seconds=0.3)
+            
+            def slow_handler():
+                time.sleep(1.0)
+                return handler()
+            
+            worker = threading.Thread(target=store.execute, args=("key-4", "body-hash", slow_handler))
+            worker.start()
+            time.sleep(0.6)
+            retry = store.execute("key-4", "body-hash", handler)
+            worker.join()
+            success = len(calls) == 4 and retry[2]
+            print_test_result("Lease renewed while the handler runs", success, f"Handler calls: {len(calls)}")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Idempotency keys", False, str(e))
+        return False
+
+def test_warm_keeper():
+    """Test warm-keeper leader election and ping scheduling"""
+    print_header("Testing Warm Keeper")
+    
+    try:
+        import warmkeeper
+        from warmkeeper import WarmKeeper
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lock_path = os.path.join(tmp_dir, "warmkeeper.lock")
+            activity_path = os.path.join(tmp_dir, "activity")
+            first = WarmKeeper(lambda: "http://127.0.0.1:9/", {}, lock_path, activity_path)
+            second = WarmKeeper(lambda: "http://127.0.0.1:9/", {}, lock_path, activity_path)
+            
+            leaders = [first._acquire_leadership(), second._acquire_leadership()]
+            success = warmkeeper.fcntl is None or leaders == [True, False]
+            print_test_result("Single leader elected", success, f"Leaders: {leaders}")
+            first.stop()
+            second.stop()
+            
+            first.record_traffic()
+            now = time.time()
+            success = not first.should_ping(now)
+            print_test_result("No pings during steady traffic", success)
+            
+            success = first.should_ping(now + first.interval + 1)
+            print_test_result("Ping after idle interval", success)
+            
+            stopped = not first.should_ping(now + warmkeeper.WARM_KEEP_SECONDS + 1)
+            print_test_result("Stop pinging after long idle", stopped)
+            
+            # A cold start in another worker process shows up in this one's stats
+            import multiprocessing
+            before = first.stats()
+            worker = multiprocessing.get_context("fork").Process(target=second.record_cold_start, args=(2.5,))
+            worker.start()
+            worker.join()
+            after = first.stats()
+            merged = (after["cold_starts"] == before["cold_starts"] + 1
+                      and after["cold_start_seconds"] == round(before["cold_start_seconds"] + 2.5, 2))
+            print_test_result("Cold starts merged across workers", merged, f"Stats: {after}")
+            
+            # The leader pings at the interval a cold start in another worker shortened
+            second.record_traffic()
+            worker = multiprocessing.get_context("fork").Process(target=second.record_cold_start, args=(2.5,))
+            worker.start()
+            worker.join()
+            shared = first._update_interval() == warmkeeper.WARM_INTERVAL_SECONDS * 0.75
+            second._previous_traffic = time.time() - warmkeeper.WARM_KEEP_SECONDS - 1
+            second.record_cold_start(2.5)
+            shared = shared and first._update_interval() == warmkeeper.WARM_INTERVAL_SECONDS * 0.75
+            print_test_result("Interval shared, not shortened after long idle", shared,
+                              f"Interval: {first.interval}")
+        
+        return success and stopped and merged and shared
+        
+    except Exception as e:
+        print_test_result("Warm keeper", False, str(e))
+        return False
+
+def test_metrics():
+    """Test that metrics from several worker processes merge into exact totals"""
+    print_header("Testing Multi-Process Metrics")
+    
+    import multiprocessing
+    
+    try:
+        import metrics
+        from bench_metrics import worker
+        
+        checks = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            registry = metrics.MetricsRegistry(tmp_dir)
+            registry.counter("bench_total").inc(5)
+            
+            processes = [multiprocessing.Process(target=worker, args=(tmp_dir, 1000)) for _ in range(3)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            
+            totals = registry.collect()
+            success = totals["bench_total"][0] == 3005 and totals["bench_seconds"][:-1].sum() == 3000
+            print_test_result("Totals merged across workers", success, f"bench_total: {totals['bench_total'][0]:.0f}")
+            checks.append(success)
+            
+            worker_files = [name for name in os.listdir(tmp_dir) if name.startswith("worker_")]
+            success = len(worker_files) == 2
+            print_test_result("Exited workers archived", success, f"Files left: {worker_files}")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Metrics", False, str(e))
+        return False
+
+def test_json_codec():
+    """Test the pluggable JSON codec and spliced history responses"""
+    print_header("Testing JSON Codec")
+    
+    import database
+    
+    try:
+        import json_codec
+        from app import app
+        
+        checks = []
+        data = {"reply": "Hi – there", "count": 3, "tags": {"a"}, "nested": [1.5, None, True]}
+        decoded = json_codec.loads(json_codec.dumps(data))
+        success = decoded == {**data, "tags": ["a"]} and json_codec.loads(json_codec.dumps_str(data)) == decoded
+        print_test_result("Round trip", success, f"Backend: {json_codec.BACKEND}")
+        checks.append(success)
+        
+        provider = json_codec.FastJSONProvider(app)
+        pretty = provider.dumps({"b": 1, "a": [2]}, sort_keys=True, indent=2)
+        success = pretty.index('"a"') < pretty.index('"b"') and "\n  " in pretty
+        success = success and provider.dumps({"b": 1}, separators=(", ", ": ")) == '{"b": 1}'
+        print_test_result("Provider honors dumps arguments", success, repr(pretty))
+        checks.append(success)
+        
+        with temporary_database():
+            database.init_db()
+            for i in range(3):
+                database.save_conversation("codec", f'Say "{i}"', f"Reply {i}\n")
+            body = json_codec.dumps_with_raw({"session_id": "codec"},
+                                             conversations=database.get_recent_json("codec", 10))
+            turns = json_codec.loads(body)["conversations"]
+            expected = [(row[0], row[2], row[3]) for row in database.get_recent("codec", 10)]
+            success = [(t["id"], t["user_input"], t["bot_response"]) for t in turns] == expected
+            print_test_result("History rows serialized by SQLite", success, f"{len(body)} bytes")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("JSON codec", False, str(e))
+        return False
+
+def test_telemetry():
+    """Test timing beacon ingestion and percentile aggregation"""
+    print_header("Testing Turn Telemetry")
+    
+    try:
+        from telemetry import TelemetryStore
+        
+        checks = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = TelemetryStore(os.path.join(tmp_dir, "telemetry.db"), buffer_max=100)
+            for i in range(20):
+                store.record_server(f"turn-{i}", "s", "http", "voice-fast", model_ms=400 + i, db_ms=2, total_ms=410 + i)
+                store.record_client({"turn_id": f"turn-{i}", "transport": "http", "recognition_ms": 1500,
+                                     "network_ms": 450 + i, "first_audio_ms": 700 + i, "tts_ms": 2000})
+            rejected = not store.record_client({"turn_id": "bad", "network_ms": "fast"})
+            success = rejected and store.flush() == 40
+            print_test_result("Beacons buffered", success, "40 records written")
+            checks.append(success)
+            
+            summary = store.summary(hours=1, bucket_minutes=5)
+            metrics = summary["overall"]["metrics"]
+            success = (summary["overall"]["turns"] == 20 and metrics["first_audio_ms"]["p50"] >= 700
+                       and metrics["network_overhead_ms"]["p50"] == 40.0)
+            print_test_result("Percentiles joined to server timings", success,
+                              f"overhead p50: {metrics.get('network_overhead_ms', {}).get('p50')}ms")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Telemetry", False, str(e))
+        return False
+
+def test_database_fixtures():
+    """Test the synthetic fixture generator and database microbenchmarks"""
+    print_header("Testing Database Fixtures")
+    
+    import sqlite3
+    import database
+    
+    try:
+        from generate_fixtures import generate
+        from bench_database import run_suite
+        
+        checks = []
+        with temporary_database() as tmp_dir:
+            written = generate(os.path.join(tmp_dir, "conversations.db"), 2000, mean_turns=5, shards=2)
+            sessions = database.get_all_sessions()
+            success = written == 2000 and len(sessions) > 100
+            print_test_result("Generate fixture", success, f"{written} rows, {len(sessions)} sessions")
+            checks.append(success)
+            
+            before = database.get_turn_stats("day", 60)["overall"]
+            results = run_suite(iterations=20, max_seconds=5, seed=0)
+            success = all(stats["ops"] > 0 for stats in results.values())
+            print_test_result("Microbenchmarks", success, f"Functions: {list(results)}")
+            checks.append(success)
+            
+            rows = sum(sqlite3.connect(path).execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+                       for path in database.shard_paths())
+            after = database.get_turn_stats("day", 60)["overall"]
+            success = rows == written and after == before
+            print_test_result("Fixture left unchanged", success, f"{rows} rows, {after['turns']} rolled-up turns after the write benchmark")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Database fixtures", False, str(e))
+        return False
+
+def test_traffic_replay():
+    """Test loading recorded sessions and replaying them at speed"""
+    print_header("Testing Traffic Replay")
+    
+    try:
+        from generate_fixtures import generate
+        from replay_traffic import load_sessions, replay
+        from bench_hedging import start_stub
+        
+        checks = []
+        with temporary_database() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "conversations.db")
+            generate(db_path, 300, mean_turns=4, days=1)
+            sessions = load_sessions(db_path, 1, 20, max_idle=1.0)
+            gaps = [b[0] - a[0] for session in sessions for a, b in zip(session, session[1:])]
+            success = len(sessions) == 20 and all(0 <= gap <= 1.0 for gap in gaps)
+            print_test_result("Load sessions", success, f"{sum(map(len, sessions))} turns, max gap {max(gaps, default=0):.2f}s")
+            checks.append(success)
+            
+            stats = replay(start_stub(0.01, 0.01, 0.0, seed=0).rstrip("/"), sessions, speed=50, workers=16, timeout=5)
+            success = stats["requests"] == sum(map(len, sessions)) and stats["errors"] == 0
+            print_test_result("Replay", success, f"{stats['requests']} requests, p95 {stats['p95_ms']:.1f}ms")
+            checks.append(success)
+            
+            # A server that answers every turn with a fallback reply (and a 200) is failing
+            import threading
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            from model import CONNECTION_ERROR_REPLY
+            
+            class FallbackHandler(BaseHTTPRequestHandler):
+                def do_POST(self):
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                    body = json.dumps({"reply": CONNECTION_ERROR_REPLY}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                
+                def log_message(self, format, *args):
+                    pass
+            
+            server = ThreadingHTTPServer(("127.0.0.1", 0), FallbackHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                stats = replay(f"http://127.0.0.1:{server.server_port}", sessions[:5], speed=50, workers=16, timeout=5)
+            finally:
+                server.shutdown()
+            success = stats["requests"] > 0 and stats["errors"] == stats["requests"]
+            print_test_result("Fallback replies count as errors", success,
+                              f"{stats['errors']}/{stats['requests']} errors")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Traffic replay", False, str(e))
+        return False
+
+def test_bulk_transfer():
+    """Test streaming export and chunked import of conversations"""
+    print_header("Testing Bulk Export/Import")
+    
+    import sqlite3
+    import database
+    
+    try:
+        from bulk_transfer import export_rows, read_rows
+        
+        checks = []
+        with temporary_database(shards=2) as tmp_dir:
+            database.init_db()
+            for i in range(25):
+                database.save_conversation(f"bulk_{i % 5}", f"question {i}", f"answer, \"quoted\"\n{i}",
+                                           upstream_ms=i * 10.0, total_ms=i * 12.5, retries=i % 3,
+                                           cache_hit=i % 4 == 0, tokens=i if i % 2 else None)
+            source_stats = database.get_turn_stats("day", 1)["overall"]
+            
+            export_path = os.path.join(tmp_dir, "export.csv.gz")
+            written, watermark = export_rows(export_path, "csv", chunk_size=4)
+            success = written == 25
+            print_test_result("Export", success, f"{written} rows, watermark {watermark}")
+            checks.append(success)
+            
+            database.save_conversation("bulk_0", "question 25", "answer 25")
+            incremental, _ = export_rows(os.path.join(tmp_dir, "delta.jsonl"), "jsonl", watermark)
+            success = incremental == 1
+            print_test_result("Incremental export", success, f"{incremental} new rows")
+            checks.append(success)
+            
+            database.DB_PATH, database.DB_SHARDS = os.path.join(tmp_dir, "target.db"), 1
+            database.init_db()
+            inserted = database.insert_conversations(read_rows(export_path, "csv"), chunk_size=10)
+            turns = database.get_recent("bulk_1", 10)
+            success = inserted == 25 and len(turns) == 5 and turns[0][3].startswith('answer, "quoted"')
+            print_test_result("Import", success, f"{inserted} rows, {len(turns)} turns for bulk_1")
+            checks.append(success)
+            
+            target_stats = database.get_turn_stats("day", 1)["overall"]
+            success = target_stats == source_stats
+            print_test_result("Performance columns and rollups kept", success, f"Target: {target_stats}")
+            checks.append(success)
+            
+            # A database written before the performance columns existed
+            database.DB_PATH = os.path.join(tmp_dir, "legacy.db")
+            conn = sqlite3.connect(database.DB_PATH)
+            conn.execute('''
+                CREATE TABLE conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,
+                    user_input TEXT NOT NULL, bot_response TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute("INSERT INTO conversations (session_id, user_input, bot_response) VALUES ('legacy', 'Hello', 'Hi')")
+            conn.commit()
+            conn.close()
+            legacy, _ = export_rows(os.path.join(tmp_dir, "legacy.jsonl"), "jsonl")
+            success = legacy == 1
+            print_test_result("Export from a legacy database", success, f"{legacy} rows")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("Bulk transfer", False, str(e))
+        return False
+
 def test_model_loading():
     """Test model loading and basic inference"""
     print_header("Testing Model Loading")
@@ -146,6 +1179,48 @@ def test_flask_app():
         print_test_result("Flask application", False, str(e))
         return False
 
+def test_history_sync():
+    """Test delta sync and conditional requests on /api/history"""
+    print_header("Testing History Delta Sync")
+    
+    try:
+        from app import app
+        from database import save_conversation
+        
+        checks = []
+        session_id = f"history_test_{int(time.time() * 1000)}"
+        for i in range(3):
+            save_conversation(session_id, f"Question {i}", f"Answer {i}")
+        
+        with app.test_client() as client:
+            response = client.get(f'/api/history/{session_id}')
+            etag = response.headers.get('ETag')
+            data = response.get_json()
+            success = response.status_code == 200 and etag and len(data['conversations']) == 3
+            print_test_result("Full history with ETag", success, f"ETag: {etag}")
+            checks.append(success)
+            
+            response = client.get(f'/api/history/{session_id}', headers={'If-None-Match': etag})
+            success = response.status_code == 304
+            print_test_result("Unchanged session returns 304", success, f"Status: {response.status_code}")
+            checks.append(success)
+            
+            save_conversation(session_id, "Question 3", "Answer 3")
+            response = client.get(f'/api/history/{session_id}?since_id={data["last_id"]}',
+                                  headers={'If-None-Match': etag})
+            delta = response.get_json()
+            success = (response.status_code == 200 and response.headers.get('ETag') != etag
+                       and [c['user_input'] for c in delta['conversations']] == ["Question 3"])
+            print_test_result("since_id returns only new turns", success,
+                              f"Turns: {len(delta['conversations'])}")
+            checks.append(success)
+        
+        return all(checks)
+        
+    except Exception as e:
+        print_test_result("History sync", False, str(e))
+        return False
+
 def test_frontend_files():
     """Test that frontend files exist and are valid"""
     print_header("Testing Frontend Files")
@@ -262,8 +1337,26 @@ def main():
     
     test_results.append(("Imports", test_imports()))
     test_results.append(("Database", test_database()))
+    test_results.append(("Sharded Storage", test_sharded_storage()))
+    test_results.append(("Database Fixtures", test_database_fixtures()))
+    test_results.append(("Traffic Replay", test_traffic_replay()))
+    test_results.append(("Bulk Export/Import", test_bulk_transfer()))
+    test_results.append(("Turn Stats Rollups", test_turn_stats()))
+    test_results.append(("Prompt Cache", test_prompt_cache()))
+    test_results.append(("Fast Path", test_fast_path()))
+    test_results.append(("Generation Profiles", test_generation_profiles()))
+    test_results.append(("Upstream Failover", test_upstream_failover()))
+    test_results.append(("Micro-Batching", test_micro_batching()))
+    test_results.append(("Voice Session", test_voice_session()))
+    test_results.append(("Structured Logging", test_structured_logging()))
+    test_results.append(("Idempotency Keys", test_idempotency()))
+    test_results.append(("Warm Keeper", test_warm_keeper()))
+    test_results.append(("JSON Codec", test_json_codec()))
+    test_results.append(("Turn Telemetry", test_telemetry()))
+    test_results.append(("Multi-Process Metrics", test_metrics()))
     test_results.append(("Model Loading", test_model_loading()))
     test_results.append(("Flask App", test_flask_app()))
+    test_results.append(("History Sync", test_history_sync()))
     test_results.append(("Frontend Files", test_frontend_files()))
     test_results.append(("Integration", test_integration()))
     test_results.append(("Performance", run_performance_test()))
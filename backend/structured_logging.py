@@ -0,0 +1,193 @@
+"""
+Asynchronous structured logging for ConversAI MVP
+Request threads only enqueue log records; a background listener formats them
+as JSON lines and writes them out
+Author: ConversAI MVP
+Run: python bench_logging.py
+"""
+
+import os
+import sys
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+import json_codec
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1"
+LOG_QUEUE_SIZE = 10000
+# Payload fields (user messages, bot replies) are only logged for a sample of
+# records and are truncated; the rest log just the payload length.
+PAYLOAD_FIELDS = {"user_message", "bot_reply"}
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
+LOG_FIELD_MAX_CHARS = int(os.getenv("LOG_FIELD_MAX_CHARS", "200"))
+# Identical warnings/errors beyond this many per window are dropped and counted
+LOG_ERROR_RATE_LIMIT = int(os.getenv("LOG_ERROR_RATE_LIMIT", "5"))
+LOG_ERROR_WINDOW_SECONDS = 60.0
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def _truncate(value: str, limit: int) -> str:
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...(+{len(value) - limit} chars)"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line
+
+    Structured fields are passed with extra={"fields": {...}}. The message is
+    only %-formatted here, so with the async pipeline formatting happens on
+    the listener thread rather than the request thread.
+    """
+
+    def __init__(self, sample_rate: float = LOG_PAYLOAD_SAMPLE_RATE, max_chars: int = LOG_FIELD_MAX_CHARS):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage(), self.max_chars),
+        }
+
+        fields = getattr(record, "fields", None)
+        if fields:
+            include_payload = random.random() < self.sample_rate
+            for key, value in fields.items():
+                if key in PAYLOAD_FIELDS and isinstance(value, str):
+                    if not include_payload:
+                        entry[f"{key}_chars"] = len(value)
+                        continue
+                    value = _truncate(value, self.max_chars)
+                elif isinstance(value, str):
+                    value = _truncate(value, self.max_chars)
+                entry[key] = value
+
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json_codec.dumps_str(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drop repeats of the same warning/error beyond a limit per time window
+
+    Records are keyed by logger, call site and message template. The first
+    record let through in a new window carries the number suppressed in the
+    previous one.
+    """
+
+    def __init__(self, limit: int = LOG_ERROR_RATE_LIMIT, window: float = LOG_ERROR_WINDOW_SECONDS):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._counts.get(key, (now, 0, 0))
+            if now - window_start >= self.window:
+                window_start, count = now, 0
+            if count >= self.limit:
+                self._counts[key] = (window_start, count, suppressed + 1)
+                return False
+            self._counts[key] = (window_start, count + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class AsyncQueueHandler(QueueHandler):
+    """QueueHandler that defers all formatting to the listener and never blocks"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the message on the calling thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            AsyncQueueHandler.dropped += 1
+
+
+def setup_logging(level: str = LOG_LEVEL, async_mode: bool = LOG_ASYNC, stream=None):
+    """
+    Configure the root logger once for the whole process (safe to call repeatedly)
+
+    Args:
+        level: Root log level name
+        async_mode: Write through a background queue listener instead of inline
+        stream: Output stream (defaults to stderr)
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        root = logging.getLogger()
+        if getattr(root, "_structured_logging", False):
+            return
+        root._structured_logging = True
+
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(level)
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter())
+
+        if async_mode:
+            handler = _queue_handler = AsyncQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            _listener = QueueListener(handler.queue, output, respect_handler_level=False)
+            _listener.start()
+            atexit.register(shutdown_logging)
+        else:
+            handler = output
+        handler.addFilter(RateLimitFilter())
+        root.addHandler(handler)
+
+
+def _restart_after_fork():
+    """Give a forked worker its own queue and listener (threads do not survive fork)"""
+    # Without this, records queued in a gunicorn worker forked from a master
+    # that set up logging are never written. Records the parent had queued
+    # are left to the parent's listener.
+    global _listener
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue_handler.queue, *_listener.handlers, respect_handler_level=False)
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
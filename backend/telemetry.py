@@ -0,0 +1,262 @@
+"""
+Turn timing telemetry for ConversAI MVP
+Collects client-side timing beacons (speech recognition, network, time to
+first audio, TTS) and server-side stage timings for the same turns, and
+reports latency percentiles over time
+Author: ConversAI MVP
+Run: served by app.py at POST /api/telemetry and GET /api/telemetry/summary
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+import database
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+# Timings live in their own SQLite file (shared by all workers on the host) so
+# ingestion never contends with conversation writes.
+TELEMETRY_DB_PATH = os.getenv(
+    "TELEMETRY_DB_PATH", os.path.splitext(database.DB_PATH)[0] + "_telemetry.db"
+)
+# Records are buffered in memory and appended in one transaction per flush
+TELEMETRY_FLUSH_SECONDS = float(os.getenv("TELEMETRY_FLUSH_SECONDS", "2"))
+TELEMETRY_BUFFER_MAX = int(os.getenv("TELEMETRY_BUFFER_MAX", "10000"))
+TELEMETRY_RETENTION_DAYS = float(os.getenv("TELEMETRY_RETENTION_DAYS", "14"))
+MAX_BEACONS_PER_REQUEST = 50
+# Anything slower than this is a broken clock or a tab left in the background
+MAX_TIMING_MS = 600000
+
+CLIENT_METRICS = ("recognition_ms", "network_ms", "first_audio_ms", "tts_ms")
+SERVER_METRICS = ("first_token_ms", "model_ms", "db_ms", "total_ms")
+
+
+def _timing(value) -> Optional[float]:
+    """A valid duration in ms, or None"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if not 0 <= value <= MAX_TIMING_MS:
+        return None
+    return float(value)
+
+
+def _text(value, max_chars: int = 64) -> Optional[str]:
+    return value[:max_chars] if isinstance(value, str) and value else None
+
+
+class TelemetryStore:
+    """
+    Buffered, append-only store of client beacons and server stage timings
+
+    record_client() and record_server() only append to an in-memory list; a
+    background thread writes the list out every TELEMETRY_FLUSH_SECONDS. When
+    the buffer is full new records are dropped (and counted) rather than
+    slowing requests down.
+    """
+
+    def __init__(self, path: str = TELEMETRY_DB_PATH, flush_seconds: float = TELEMETRY_FLUSH_SECONDS,
+                 buffer_max: int = TELEMETRY_BUFFER_MAX, retention_days: float = TELEMETRY_RETENTION_DAYS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.buffer_max = buffer_max
+        self.retention_days = retention_days
+        self.dropped = 0
+
+        self._client: List[tuple] = []
+        self._server: List[tuple] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_purge = 0.0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS client_timings (
+                turn_id TEXT NOT NULL,
+                session_id TEXT,
+                transport TEXT,
+                created_at REAL NOT NULL,
+                recognition_ms REAL,
+                network_ms REAL,
+                first_audio_ms REAL,
+                tts_ms REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS server_timings (
+                turn_id TEXT NOT NULL,
+                session_id TEXT,
+                transport TEXT,
+                profile TEXT,
+                created_at REAL NOT NULL,
+                first_token_ms REAL,
+                model_ms REAL,
+                db_ms REAL,
+                total_ms REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_client_created ON client_timings (created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_server_turn ON server_timings (turn_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_server_created ON server_timings (created_at)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _append(self, buffer: List[tuple], record: tuple) -> bool:
+        with self._lock:
+            if len(self._client) + len(self._server) >= self.buffer_max:
+                self.dropped += 1
+                return False
+            buffer.append(record)
+            return True
+
+    def record_client(self, beacon: dict) -> bool:
+        """
+        Buffer one client beacon
+
+        Args:
+            beacon: {"turn_id", "session_id", "transport", "recognition_ms",
+                     "network_ms", "first_audio_ms", "tts_ms"}; missing or
+                     out-of-range timings are stored as NULL
+
+        Returns:
+            bool: False if the beacon was invalid or dropped
+        """
+        if not isinstance(beacon, dict):
+            return False
+        turn_id = _text(beacon.get("turn_id"))
+        timings = [_timing(beacon.get(name)) for name in CLIENT_METRICS]
+        if turn_id is None or all(value is None for value in timings):
+            return False
+        record = (turn_id, _text(beacon.get("session_id"), 128), _text(beacon.get("transport"), 16),
+                  time.time(), *timings)
+        return self._append(self._client, record)
+
+    def record_server(self, turn_id: Optional[str], session_id: str, transport: str, profile: str,
+                      first_token_ms: Optional[float] = None, model_ms: Optional[float] = None,
+                      db_ms: Optional[float] = None, total_ms: Optional[float] = None) -> bool:
+        """Buffer the server-side stage timings of one turn (no-op without a turn id)"""
+        turn_id = _text(turn_id)
+        if turn_id is None:
+            return False
+        record = (turn_id, session_id, transport, profile, time.time(),
+                  first_token_ms, model_ms, db_ms, total_ms)
+        return self._append(self._server, record)
+
+    def flush(self) -> int:
+        """Append buffered records to the database; returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                client, self._client = self._client, []
+                server, self._server = self._server, []
+            if not client and not server:
+                return 0
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("INSERT INTO client_timings VALUES (?, ?, ?, ?, ?, ?, ?, ?)", client)
+                    conn.executemany("INSERT INTO server_timings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", server)
+                    if time.time() - self._last_purge > 3600:
+                        self._purge(conn)
+                conn.close()
+                return len(client) + len(server)
+            except Exception as e:
+                logger.error("Error writing telemetry: %s", e)
+                return 0
+
+    def _purge(self, conn: sqlite3.Connection):
+        cutoff = time.time() - self.retention_days * 86400
+        conn.execute("DELETE FROM client_timings WHERE created_at < ?", (cutoff,))
+        conn.execute("DELETE FROM server_timings WHERE created_at < ?", (cutoff,))
+        self._last_purge = time.time()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_seconds):
+            self.flush()
+
+    def start(self):
+        """Start the background flush thread (idempotent); flushes again at exit"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    def summary(self, hours: float = 24, bucket_minutes: float = 60) -> dict:
+        """
+        Latency percentiles per time bucket, client beacons joined to server timings
+
+        Besides the raw client and server metrics, network_overhead_ms is the
+        client's network time minus the server's handling time for the same
+        turn (transport, queueing and proxies).
+
+        Returns:
+            {"overall": {...}, "buckets": [{"start", "turns", "metrics"}, ...]}
+        """
+        self.flush()
+        since = time.time() - hours * 3600
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+                SELECT c.created_at, c.recognition_ms, c.network_ms, c.first_audio_ms, c.tts_ms,
+                       s.first_token_ms, s.model_ms, s.db_ms, s.total_ms
+                FROM client_timings c
+                LEFT JOIN server_timings s ON s.turn_id = c.turn_id
+                WHERE c.created_at >= ?
+                ORDER BY c.created_at
+            ''', (since,)).fetchall()
+        finally:
+            conn.close()
+
+        names = CLIENT_METRICS + tuple(f"server_{name}" for name in SERVER_METRICS)
+        if not rows:
+            return {"hours": hours, "bucket_minutes": bucket_minutes, "overall": {"turns": 0, "metrics": {}},
+                    "buckets": [], "dropped": self.dropped}
+
+        data = np.array(rows, dtype=float)  # NULL -> nan
+        columns = {name: data[:, i + 1] for i, name in enumerate(names)}
+        columns["network_overhead_ms"] = columns["network_ms"] - columns["server_total_ms"]
+
+        def percentiles(mask) -> dict:
+            result = {}
+            for name, values in columns.items():
+                values = values[mask]
+                values = values[~np.isnan(values)]
+                if values.size:
+                    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                    result[name] = {"count": int(values.size), "p50": round(float(p50), 1),
+                                    "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+            return result
+
+        bucket_seconds = bucket_minutes * 60
+        bucket_of_row = np.floor(data[:, 0] / bucket_seconds)
+        buckets = []
+        for bucket in np.unique(bucket_of_row):
+            mask = bucket_of_row == bucket
+            buckets.append({
+                "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(bucket * bucket_seconds)),
+                "turns": int(mask.sum()),
+                "metrics": percentiles(mask),
+            })
+        return {
+            "hours": hours,
+            "bucket_minutes": bucket_minutes,
+            "overall": {"turns": len(rows), "metrics": percentiles(np.ones(len(rows), dtype=bool))},
+            "buckets": buckets,
+            "dropped": self.dropped,
+        }
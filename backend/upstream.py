@@ -0,0 +1,312 @@
+"""
+Upstream endpoint pool for ConversAI MVP
+Health tracking, failover and hedged requests across inference endpoints
+Author: ConversAI MVP
+Run: python -c "from upstream import EndpointPool; print(EndpointPool(['http://localhost']).stats())"
+"""
+
+import os
+import queue
+import socket
+import logging
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import json_codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Hedge to a secondary endpoint once the primary is slower than its observed p95.
+# Until enough latencies are observed, HEDGE_DELAY_SECONDS is used instead.
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "3.0"))
+MIN_HEDGE_DELAY_SECONDS = 0.05
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 200
+# Hedges may add at most this fraction of extra upstream calls (token bucket)
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_BURST = 5.0
+# Consecutive failures after which an endpoint is skipped for a cool-down period
+FAILURE_THRESHOLD = 3
+COOLDOWN_SECONDS = 30.0
+# Idle keep-alive connections kept per endpoint (busier moments open more)
+CONNECTIONS_PER_ENDPOINT = int(os.getenv("UPSTREAM_CONNECTIONS", "32"))
+
+
+class _CallAbort:
+    """
+    Lets another thread abort one in-flight upstream call
+
+    The call's socket is shut down, so a thread blocked waiting for the
+    response wakes up at once with a connection error instead of holding
+    on until the reply or the timeout.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def attach(self, sock: socket.socket):
+        with self._lock:
+            self._sock = sock
+            if not self.aborted:
+                return
+        self._shutdown(sock)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            sock = self._sock
+        if sock is not None:
+            self._shutdown(sock)
+
+    @staticmethod
+    def _shutdown(sock: socket.socket):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # already closed
+
+
+# The abort handle of the call running on this thread (set by EndpointPool._call)
+_current_call = threading.local()
+
+
+class _AbortableConnection:
+    """Hands the socket of each request to the running call's abort handle"""
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        abort = getattr(_current_call, "abort", None)
+        if abort is not None and self.sock is not None:
+            abort.attach(self.sock)
+
+
+class _AbortableHTTPConnection(_AbortableConnection, HTTPConnection):
+    pass
+
+
+class _AbortableHTTPSConnection(_AbortableConnection, HTTPSConnection):
+    pass
+
+
+class _AbortableHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class _AbortableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _AbortableHTTPPool, "https": _AbortableHTTPSPool}
+
+
+class Endpoint:
+    """One upstream URL with its recent latencies and failure state"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def p95(self) -> Optional[float]:
+        """Return the 95th percentile latency, or None with too few samples"""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def hedge_delay(self) -> float:
+        p95 = self.p95()
+        return HEDGE_DELAY_SECONDS if p95 is None else max(p95, MIN_HEDGE_DELAY_SECONDS)
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= FAILURE_THRESHOLD:
+            self.down_until = time.monotonic() + COOLDOWN_SECONDS
+            logger.warning("Upstream %s marked down for %.0fs after %d consecutive failures",
+                           self.url, COOLDOWN_SECONDS, self.consecutive_failures)
+
+
+class EndpointPool:
+    """
+    Sends each request to the preferred healthy endpoint and hedges slow ones
+
+    If the primary has not answered within its observed p95, the same request
+    is also sent to the next endpoint and the first successful response wins.
+    A failed response fails over to the next endpoint straight away. Hedges
+    are limited by a token bucket that earns HEDGE_BUDGET tokens per request.
+    The losing call is aborted as soon as a winner is known. Each call runs on
+    its own thread (a greenlet under gevent), so there is no fixed cap on
+    concurrent upstream calls.
+    """
+
+    def __init__(self, urls: List[str], hedge_budget: float = HEDGE_BUDGET):
+        if not urls:
+            raise ValueError("EndpointPool needs at least one URL")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.hedge_budget = hedge_budget
+
+        self._lock = threading.Lock()
+        self._hedge_tokens = HEDGE_BURST if hedge_budget > 0 else 0.0
+        # Keep-alive connections shared by all calls; pool_block=False opens
+        # extra connections instead of waiting when every pooled one is busy
+        self._session = requests.Session()
+        adapter = _AbortableAdapter(pool_connections=len(urls), pool_maxsize=CONNECTIONS_PER_ENDPOINT)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _ordered(self) -> List[Endpoint]:
+        """Healthy endpoints first, each group in configured order"""
+        healthy = [e for e in self.endpoints if e.healthy]
+        return healthy + [e for e in self.endpoints if not e.healthy]
+
+    def primary_url(self) -> str:
+        """Return the URL of the preferred healthy endpoint (for streaming calls)"""
+        return self._ordered()[0].url
+
+    def _take_hedge_token(self) -> bool:
+        with self._lock:
+            if self._hedge_tokens >= 1.0:
+                self._hedge_tokens -= 1.0
+                return True
+            return False
+
+    def _call(self, endpoint: Endpoint, abort: _CallAbort, headers: dict, body: bytes,
+              timeout: float, results: queue.Queue):
+        """Run one upstream call (on its own thread) and put (endpoint, response, error) on results"""
+        start_time = time.perf_counter()
+        _current_call.abort = abort
+        try:
+            response = self._session.post(endpoint.url, headers=headers, data=body, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            # An aborted hedge loser says nothing about the endpoint's health
+            if not abort.aborted:
+                with self._lock:
+                    endpoint.requests += 1
+                    endpoint.record_failure()
+            results.put((endpoint, None, e))
+            return
+        finally:
+            _current_call.abort = None
+
+        with self._lock:
+            if not abort.aborted:
+                endpoint.requests += 1
+                if response.ok:
+                    endpoint.record_success(time.perf_counter() - start_time)
+                elif response.status_code >= 500 or response.status_code == 429:
+                    endpoint.record_failure()
+        results.put((endpoint, response, None))
+
+    def post(self, headers: dict, payload: dict, timeout: float = 30) -> requests.Response:
+        """
+        POST payload upstream, hedging and failing over between endpoints
+
+        Returns:
+            requests.Response: The first successful response, otherwise the last
+            unsuccessful one (so callers can still inspect e.g. a 503)
+
+        Raises:
+            requests.exceptions.RequestException: If every attempt failed to connect
+        """
+        candidates = self._ordered()
+        primary, backups = candidates[0], candidates[1:]
+        with self._lock:
+            self._hedge_tokens = min(HEDGE_BURST, self._hedge_tokens + self.hedge_budget)
+
+        results = queue.Queue()
+        in_flight = {}
+        # Serialized once and shared by the primary call, hedges and failovers
+        body = json_codec.dumps(payload)
+        headers = {**headers, "Content-Type": "application/json"}
+
+        def launch(endpoint):
+            in_flight[endpoint] = _CallAbort()
+            threading.Thread(target=self._call, args=(endpoint, in_flight[endpoint], headers, body, timeout, results),
+                             name="upstream", daemon=True).start()
+
+        launch(primary)
+        hedge_delay = primary.hedge_delay() if backups else None
+        last_response, last_error = None, None
+
+        while in_flight:
+            try:
+                endpoint, response, error = results.get(timeout=hedge_delay)
+            except queue.Empty:
+                # The primary is slower than usual: hedge once if the budget allows
+                hedge_delay = None
+                if backups and self._take_hedge_token():
+                    metrics.upstream_hedges.inc()
+                    launch(backups.pop(0))
+                continue
+
+            in_flight.pop(endpoint)
+            if error is not None:
+                logger.warning("Upstream %s failed: %s", endpoint.url, error)
+                last_error = error
+            elif response.ok:
+                # Abort the loser rather than letting it run to its timeout
+                for other in in_flight.values():
+                    other.abort()
+                if endpoint is not primary:
+                    metrics.upstream_hedge_wins.inc()
+                return response
+            else:
+                last_response = response
+
+            if not in_flight and backups:
+                # Everything in flight failed: fail over without waiting
+                hedge_delay = None
+                metrics.upstream_failovers.inc()
+                launch(backups.pop(0))
+
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    def stats(self, merged: Optional[dict] = None) -> dict:
+        """
+        Return hedging and failover counters (all workers) and per-endpoint
+        health as seen by this worker
+        """
+        counters = (merged or metrics.snapshot())["counters"]
+        with self._lock:
+            return {
+                "hedges": int(counters.get("upstream_hedges_total", 0)),
+                "hedge_wins": int(counters.get("upstream_hedge_wins_total", 0)),
+                "failovers": int(counters.get("upstream_failovers_total", 0)),
+                "endpoints": [
+                    {
+                        "url": e.url,
+                        "healthy": e.healthy,
+                        "requests": e.requests,
+                        "failures": e.failures,
+                        "p95_seconds": e.p95(),
+                    }
+                    for e in self.endpoints
+                ],
+            }
@@ -0,0 +1,163 @@
+"""
+WebSocket voice sessions for ConversAI MVP
+Keeps one connection per voice session, streams replies and handles barge-in
+Author: ConversAI MVP
+Run: served by app.py at ws://localhost:5001/ws/voice
+
+Protocol (JSON text frames):
+    client -> {"type": "utterance", "id": "turn id", "message": "...", "profile": "optional",
+               "turn_id": "optional globally unique id, to join timing beacons"}
+    client -> {"type": "cancel", "id": "optional turn id"}
+    server -> {"type": "ready", "session_id": "..."}
+    server -> {"type": "partial", "id": "...", "text": "delta"}
+    server -> {"type": "final", "id": "...", "reply": "...", "session_id": "..."}
+    server -> {"type": "cancelled", "id": "..."}
+    server -> {"type": "error", "id": "optional", "message": "..."}
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+import json_codec
+from model import stream_response, GENERATION_PROFILES
+from database import save_conversation
+
+logger = logging.getLogger(__name__)
+
+# Turns kept in memory per connection
+HISTORY_SIZE = 20
+
+
+class VoiceSession:
+    """State and in-flight generation of one voice WebSocket connection"""
+
+    def __init__(self, ws, session_id: str, profile: str = "voice-fast", telemetry=None):
+        self.ws = ws
+        self.session_id = session_id
+        self.profile = profile
+        self.telemetry = telemetry
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+        self._send_lock = threading.Lock()
+        self._turn_lock = threading.Lock()
+        self._turn_id = None
+        self._turn_cancelled = None
+
+    def send(self, **message) -> bool:
+        """Send one JSON frame; returns False once the connection is gone"""
+        try:
+            with self._send_lock:
+                self.ws.send(json_codec.dumps_str(message))
+            return True
+        except Exception as e:
+            logger.info("Voice session %s send failed: %s", self.session_id, e)
+            return False
+
+    def run(self):
+        """Serve the connection until the client disconnects"""
+        self.send(type="ready", session_id=self.session_id)
+        try:
+            while True:
+                raw = self.ws.receive()
+                if raw is None:
+                    break
+                self.handle(raw)
+        except Exception as e:
+            # ConnectionClosed and friends: the client went away
+            logger.info("Voice session %s closed: %s", self.session_id, e)
+        finally:
+            self.cancel(notify=False)
+
+    def handle(self, raw: str):
+        """Dispatch one client frame"""
+        try:
+            message = json_codec.loads(raw)
+        except ValueError:
+            self.send(type="error", message="Invalid JSON")
+            return
+
+        kind = message.get("type")
+        if kind == "utterance":
+            text = (message.get("message") or "").strip()
+            profile = message.get("profile") or self.profile
+            if not text:
+                self.send(type="error", id=message.get("id"), message="No message provided")
+            elif profile not in GENERATION_PROFILES:
+                self.send(type="error", id=message.get("id"), message=f"Unknown profile: {profile}")
+            else:
+                self.start_turn(message.get("id"), text, profile, message.get("turn_id"))
+        elif kind == "cancel":
+            self.cancel(message.get("id"))
+        else:
+            self.send(type="error", message=f"Unknown message type: {kind}")
+
+    def start_turn(self, turn_id, text: str, profile: str, telemetry_id=None):
+        """Start generating a reply, cancelling any turn still in flight (barge-in)"""
+        self.cancel()
+        cancelled = threading.Event()
+        with self._turn_lock:
+            self._turn_id = turn_id
+            self._turn_cancelled = cancelled
+        thread = threading.Thread(target=self._run_turn, args=(turn_id, text, profile, cancelled, telemetry_id),
+                                  daemon=True)
+        thread.start()
+
+    def cancel(self, turn_id=None, notify: bool = True):
+        """Cancel the in-flight turn (only if it matches turn_id, when given)"""
+        with self._turn_lock:
+            if self._turn_cancelled is None or (turn_id is not None and turn_id != self._turn_id):
+                return
+            cancelled_id = self._turn_id
+            self._turn_cancelled.set()
+            self._turn_id = None
+            self._turn_cancelled = None
+        if notify:
+            self.send(type="cancelled", id=cancelled_id)
+
+    def _run_turn(self, turn_id, text: str, profile: str, cancelled: threading.Event, telemetry_id=None):
+        reply = None
+        start_time = time.perf_counter()
+        first_token = None
+        turn_stats = {}
+        try:
+            for kind, chunk in stream_response(text, self.session_id, profile, cancelled, turn_stats):
+                if cancelled.is_set():
+                    return
+                if kind == "partial":
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    if not self.send(type="partial", id=turn_id, text=chunk):
+                        cancelled.set()
+                        return
+                else:
+                    reply = chunk
+        except Exception as e:
+            logger.error("Error generating voice reply: %s", e)
+            self.send(type="error", id=turn_id, message="Internal server error occurred")
+            return
+        finally:
+            # Free the in-flight slot however the turn ended, unless a newer turn already took it
+            with self._turn_lock:
+                owned = self._turn_cancelled is cancelled
+                if owned:
+                    self._turn_id = None
+                    self._turn_cancelled = None
+        if not owned or cancelled.is_set():
+            return
+
+        self.history.append((text, reply))
+        db_start = time.perf_counter()
+        save_conversation(self.session_id, text, reply,
+                          total_ms=(db_start - start_time) * 1000, **turn_stats)
+        db_end = time.perf_counter()
+        self.send(type="final", id=turn_id, reply=reply, session_id=self.session_id)
+
+        if self.telemetry:
+            self.telemetry.record_server(
+                telemetry_id, self.session_id, "ws", profile,
+                first_token_ms=(first_token - start_time) * 1000 if first_token else None,
+                model_ms=(db_start - start_time) * 1000, db_ms=(db_end - db_start) * 1000,
+                total_ms=(db_end - start_time) * 1000,
+            )
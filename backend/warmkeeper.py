@@ -0,0 +1,204 @@
+"""
+Upstream warm-keeping for ConversAI MVP
+Sends cheap keep-alive inferences so the first user after a quiet spell does
+not hit the 503 "model is loading" wait
+Author: ConversAI MVP
+Run: started by app.py (one elected worker pings; the others stand by)
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+import requests
+
+import database
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, assume a single worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+WARMKEEPER_ENABLED = os.getenv("WARMKEEPER_ENABLED", "1") == "1"
+# Ping interval while warm-keeping; adapted between the min and max depending
+# on whether pings still find the model cold
+WARM_INTERVAL_SECONDS = float(os.getenv("WARM_INTERVAL_SECONDS", "240"))
+MIN_WARM_INTERVAL_SECONDS = 60.0
+MAX_WARM_INTERVAL_SECONDS = 600.0
+# Real traffic this recent keeps the model warm by itself: no pings needed
+STEADY_TRAFFIC_SECONDS = 60.0
+# Keep the model warm for this long after the last real request, then let it go cold
+WARM_KEEP_SECONDS = float(os.getenv("WARM_KEEP_SECONDS", "7200"))
+TICK_SECONDS = 10.0
+ACTIVITY_TOUCH_SECONDS = 1.0
+
+_base_path = os.path.splitext(database.DB_PATH)[0]
+WARMKEEPER_LOCK_PATH = _base_path + "_warmkeeper.lock"
+# Every worker touches this file on real traffic so the elected pinger sees all of it
+ACTIVITY_PATH = _base_path + "_activity"
+
+
+class WarmKeeper:
+    """
+    Background thread that keeps the primary upstream endpoint warm
+
+    Only the worker holding an exclusive file lock pings. It pings while there
+    has been real traffic within WARM_KEEP_SECONDS but none within
+    STEADY_TRAFFIC_SECONDS. Every worker counts the cold starts its users hit
+    and the seconds they cost in the shared metrics files, and shortens the
+    ping interval kept in a file next to the activity file, where the leader
+    reads it.
+    """
+
+    def __init__(self, url_provider: Callable[[], str], headers: dict,
+                 lock_path: str = WARMKEEPER_LOCK_PATH, activity_path: str = ACTIVITY_PATH):
+        self.url_provider = url_provider
+        self.headers = headers
+        self.lock_path = lock_path
+        self.activity_path = activity_path
+        self.interval_path = activity_path + "_interval"
+        self.interval = WARM_INTERVAL_SECONDS
+        self.is_leader = False
+
+        self._last_touch = 0.0
+        self._previous_traffic = 0.0
+        self._last_ping = 0.0
+        self._lock_file = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record_traffic(self):
+        """Note a real upstream request (cheap: touches a shared file at most once a second)"""
+        now = time.time()
+        if now - self._last_touch < ACTIVITY_TOUCH_SECONDS:
+            return
+        self._last_touch = now
+        # The traffic before this request tells an expected cold start (after a
+        # quiet spell the warm-keeper had given up on) from one pings should have prevented
+        self._previous_traffic = self._last_traffic()
+        try:
+            with open(self.activity_path, "a"):
+                os.utime(self.activity_path, None)
+        except OSError as e:
+            logger.warning("Could not record upstream activity: %s", e)
+
+    def record_cold_start(self, wait_seconds: float):
+        """Note that a user request waited for the model to load"""
+        metrics.upstream_cold_starts.inc()
+        metrics.upstream_cold_start_seconds.inc(wait_seconds)
+        if time.time() - self._previous_traffic > WARM_KEEP_SECONDS:
+            return
+        # Pings did not keep up with the upstream idle timeout: ping more often
+        self._update_interval(0.75)
+
+    def _update_interval(self, factor: Optional[float] = None) -> float:
+        """Read the ping interval shared by all workers, optionally scaling it"""
+        try:
+            with open(self.interval_path, "a+") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    interval = float(f.read())
+                except ValueError:
+                    interval = self.interval
+                if factor is not None:
+                    interval = min(MAX_WARM_INTERVAL_SECONDS, max(MIN_WARM_INTERVAL_SECONDS, interval * factor))
+                    f.truncate(0)
+                    f.write(repr(interval))
+        except OSError as e:
+            logger.warning("Could not update the warm-keeping interval: %s", e)
+            interval = self.interval * (factor or 1.0)
+            interval = min(MAX_WARM_INTERVAL_SECONDS, max(MIN_WARM_INTERVAL_SECONDS, interval))
+        self.interval = interval
+        return interval
+
+    def _last_traffic(self) -> float:
+        try:
+            return os.path.getmtime(self.activity_path)
+        except OSError:
+            return 0.0
+
+    def _acquire_leadership(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _ping(self):
+        payload = {"inputs": "Hi", "parameters": {"max_new_tokens": 1, "return_full_text": False}}
+        start_time = time.perf_counter()
+        try:
+            response = requests.post(self.url_provider(), headers=self.headers, json=payload, timeout=30)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Warm-keeping ping failed: %s", e)
+            return
+        elapsed = time.perf_counter() - start_time
+
+        metrics.warm_pings.labels("cold" if response.status_code == 503 else "warm").inc()
+        if response.status_code == 503:
+            # Already cold when we pinged: the idle timeout is shorter than our interval
+            self._update_interval(0.75)
+        else:
+            self._update_interval(1.1)
+        logger.info("Warm-keeping ping", extra={"fields": {
+            "status": response.status_code, "seconds": round(elapsed, 3), "next_interval": round(self.interval),
+        }})
+
+    def should_ping(self, now: float) -> bool:
+        """Decide whether a keep-alive is due given the latest traffic"""
+        idle = now - max(self._last_traffic(), self._last_ping)
+        since_traffic = now - self._last_traffic()
+        if since_traffic < STEADY_TRAFFIC_SECONDS or since_traffic > WARM_KEEP_SECONDS:
+            return False
+        return idle >= self.interval
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self.is_leader:
+                self.is_leader = self._acquire_leadership()
+                if self.is_leader:
+                    logger.info("This worker is now the upstream warm-keeper")
+            if self.is_leader:
+                now = time.time()
+                self._update_interval()  # other workers shorten it on cold starts
+                if self.should_ping(now):
+                    self._last_ping = now
+                    self._ping()
+            self._stopped.wait(TICK_SECONDS)
+
+    def start(self):
+        """Start the background thread (idempotent)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warmkeeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
+
+    def stats(self, merged: Optional[dict] = None) -> dict:
+        """Return cold-start and ping counters and the ping interval (all workers) and this worker's leadership"""
+        counters = (merged or metrics.snapshot())["counters"]
+        cold_pings = int(counters.get("warm_pings_total{result=cold}", 0))
+        return {
+            "leader": self.is_leader,
+            "interval_seconds": round(self._update_interval()),
+            "pings": cold_pings + int(counters.get("warm_pings_total{result=warm}", 0)),
+            "cold_pings": cold_pings,
+            "cold_starts": int(counters.get("upstream_cold_starts_total", 0)),
+            "cold_start_seconds": round(counters.get("upstream_cold_start_seconds_total", 0.0), 2),
+        }
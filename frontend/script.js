@@ -12,6 +12,15 @@ class ConversAI {
         this.recognition = null;
         this.synth = window.speechSynthesis;
         
+        // Persistent voice connection (falls back to HTTP when unavailable)
+        this.voiceSocket = null;
+        this.pendingTurn = null;
+        this.turnCounter = 0;
+        
+        // Client-side turn timings, sent to the backend in batches
+        this.telemetryQueue = [];
+        this.recognitionStart = null;
+        
         // DOM elements
         this.micButton = document.getElementById('mic-button');
         this.micStatus = document.getElementById('mic-status');
@@ -40,6 +49,12 @@ class ConversAI {
         // Set up event listeners
         this.setupEventListeners();
         
+        // Open the voice WebSocket
+        this.initVoiceSocket();
+        
+        // Flush timing beacons periodically and when the page goes away
+        this.initTelemetry();
+        
         // Check for Web Speech API support
         this.checkSpeechSupport();
     }
@@ -48,6 +63,111 @@ class ConversAI {
         return 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
     }
     
+    generateTurnId() {
+        return (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : this.generateSessionId();
+    }
+    
+    initTelemetry() {
+        setInterval(() => this.flushTelemetry(), 15000);
+        window.addEventListener('pagehide', () => this.flushTelemetry());
+        document.addEventListener('visibilitychange', () => {
+            if (document.hidden) this.flushTelemetry();
+        });
+    }
+    
+    queueTelemetry(timing) {
+        this.telemetryQueue.push({
+            turn_id: timing.turnId,
+            session_id: this.sessionId,
+            transport: timing.transport,
+            recognition_ms: timing.recognitionMs,
+            network_ms: timing.networkMs,
+            first_audio_ms: timing.firstAudioMs,
+            tts_ms: timing.ttsMs
+        });
+        if (this.telemetryQueue.length >= 10) {
+            this.flushTelemetry();
+        }
+    }
+    
+    flushTelemetry() {
+        if (this.telemetryQueue.length === 0) return;
+        const body = JSON.stringify({ beacons: this.telemetryQueue.splice(0) });
+        const url = 'http://localhost:5001/api/telemetry';
+        // sendBeacon survives page unload and never delays the UI
+        if (!(navigator.sendBeacon && navigator.sendBeacon(url, body))) {
+            fetch(url, { method: 'POST', body, keepalive: true }).catch(() => {});
+        }
+    }
+    
+    initVoiceSocket() {
+        if (!('WebSocket' in window)) return;
+        
+        const socket = new WebSocket(`ws://localhost:5001/ws/voice?session_id=${encodeURIComponent(this.sessionId)}`);
+        
+        socket.onopen = () => {
+            console.log('Voice socket connected');
+            this.voiceSocket = socket;
+        };
+        
+        socket.onmessage = (event) => this.handleSocketMessage(JSON.parse(event.data));
+        
+        socket.onclose = () => {
+            console.log('Voice socket closed, reconnecting shortly');
+            this.voiceSocket = null;
+            if (this.pendingTurn) {
+                this.pendingTurn.reject(new Error('Voice socket closed'));
+                this.pendingTurn = null;
+            }
+            setTimeout(() => this.initVoiceSocket(), 2000);
+        };
+    }
+    
+    handleSocketMessage(message) {
+        const turn = this.pendingTurn;
+        if (!turn || message.id !== turn.id) return;
+        
+        if (message.type === 'partial') {
+            turn.text += message.text;
+            if (!turn.element) {
+                turn.element = this.addMessage('', 'bot');
+            }
+            turn.element.querySelector('.message-content').innerHTML = `<strong>ConversAI:</strong> ${turn.text}`;
+        } else if (message.type === 'final') {
+            this.pendingTurn = null;
+            turn.resolve({ reply: message.reply, session_id: message.session_id, element: turn.element });
+        } else if (message.type === 'cancelled') {
+            this.pendingTurn = null;
+            turn.resolve({ cancelled: true, element: turn.element });
+        } else if (message.type === 'error') {
+            this.pendingTurn = null;
+            turn.reject(new Error(message.message));
+        }
+    }
+    
+    sendOverSocket(message, profile, turnId) {
+        return new Promise((resolve, reject) => {
+            const id = String(++this.turnCounter);
+            const previous = this.pendingTurn;
+            if (previous) {
+                // The server cancels it for this one; its 'cancelled' frame would no longer match
+                previous.resolve({ cancelled: true, element: previous.element });
+            }
+            this.pendingTurn = { id, text: '', element: null, resolve, reject };
+            this.voiceSocket.send(JSON.stringify({ type: 'utterance', id, message, profile, turn_id: turnId }));
+        });
+    }
+    
+    cancelPendingTurn() {
+        // Barge-in: the user started talking while a reply was still coming
+        if (this.pendingTurn && this.voiceSocket) {
+            this.voiceSocket.send(JSON.stringify({ type: 'cancel', id: this.pendingTurn.id }));
+        }
+        if (this.synth) {
+            this.synth.cancel();
+        }
+    }
+    
     initSpeechRecognition() {
         if ('webkitSpeechRecognition' in window || 'SpeechRecognition' in window) {
             console.log('Speech recognition is supported');
@@ -68,6 +188,8 @@ class ConversAI {
             
             this.recognition.onstart = () => {
                 console.log('Speech recognition started');
+                this.cancelPendingTurn();
+                this.recognitionStart = performance.now();
                 this.isRecording = true;
                 this.micButton.classList.add('recording');
                 this.micStatus.textContent = 'Listening... Speak now';
@@ -109,7 +231,7 @@ class ConversAI {
                 if (finalTranscript) {
                     console.log('Processing final transcript:', finalTranscript);
                     this.interimTranscript.textContent = '';
-                    this.handleUserInput(finalTranscript.trim());
+                    this.handleUserInput(finalTranscript.trim(), 'voice-fast');
                 }
             };
             
@@ -163,7 +285,7 @@ class ConversAI {
         this.sendButton.addEventListener('click', () => {
             const message = this.textInput.value.trim();
             if (message) {
-                this.handleUserInput(message);
+                this.handleUserInput(message, 'text-full');
                 this.textInput.value = '';
             }
         });
@@ -213,26 +335,53 @@ class ConversAI {
         }
     }
     
-    async handleUserInput(message) {
+    async handleUserInput(message, profile) {
         if (!message.trim()) return;
         
         // Add user message to chat
         this.addMessage(message, 'user');
         
+        // Voice turns go over the persistent socket, which also allows barge-in
+        const useSocket = profile === 'voice-fast' && this.voiceSocket && this.voiceSocket.readyState === WebSocket.OPEN;
+        
+        const inputEnd = performance.now();
+        const timing = {
+            turnId: this.generateTurnId(),
+            transport: useSocket ? 'ws' : 'http',
+            inputEnd,
+            recognitionMs: profile === 'voice-fast' && this.recognitionStart ? inputEnd - this.recognitionStart : null,
+            networkMs: null,
+            firstAudioMs: null,
+            ttsMs: null
+        };
+        this.recognitionStart = null;
+        
         // Show loading with longer timeout for detailed responses
-        this.showLoading(true);
+        this.showLoading(true, useSocket);
         this.micStatus.textContent = 'AI is thinking... This may take a moment for detailed responses.';
         
         try {
             // Send to backend
-            const response = await this.sendToBackend(message);
+            const sent = performance.now();
+            const response = useSocket
+                ? await this.sendOverSocket(message, profile, timing.turnId)
+                : await this.sendToBackend(message, profile, timing.turnId);
+            timing.networkMs = performance.now() - sent;
+            
+            if (response.cancelled) {
+                return;
+            }
             
             if (response.reply) {
-                // Add bot response to chat
-                this.addMessage(response.reply, 'bot');
+                // Add bot response to chat (replacing the streamed partial text)
+                if (response.element) {
+                    response.element.querySelector('.message-content').innerHTML = `<strong>ConversAI:</strong> ${response.reply}`;
+                } else {
+                    this.addMessage(response.reply, 'bot');
+                }
                 
-                // Speak the response
-                this.speak(response.reply);
+                // Speak the response (the timing beacon is queued once speech ends)
+                this.speak(response.reply, timing);
             } else {
                 this.addMessage('Sorry, I didn\'t get a response. Please try again.', 'bot');
             }
@@ -244,16 +393,20 @@ class ConversAI {
         }
     }
     
-    async sendToBackend(message) {
+    async sendToBackend(message, profile, turnId) {
         console.log('Sending message to backend:', message);
         const response = await fetch('http://localhost:5001/api/chat', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                // Lets the server answer a retried request without a second model call
+                'Idempotency-Key': (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : this.generateSessionId(),
             },
             body: JSON.stringify({
                 message: message,
-                session_id: this.sessionId
+                session_id: this.sessionId,
+                profile: profile,
+                turn_id: turnId
             })
         });
         
@@ -281,9 +434,10 @@ class ConversAI {
         
         this.chatMessages.appendChild(messageDiv);
         this.scrollToBottom();
+        return messageDiv;
     }
     
-    speak(text) {
+    speak(text, timing = null) {
         if (this.synth) {
             // Cancel any ongoing speech
             this.synth.cancel();
@@ -305,13 +459,30 @@ class ConversAI {
                 utterance.voice = preferredVoice;
             }
             
+            if (timing) {
+                let audioStart = null;
+                utterance.onstart = () => {
+                    audioStart = performance.now();
+                    timing.firstAudioMs = audioStart - timing.inputEnd;
+                };
+                // Also fires (as an error) when barge-in cancels the speech
+                const done = () => {
+                    if (audioStart !== null) timing.ttsMs = performance.now() - audioStart;
+                    this.queueTelemetry(timing);
+                };
+                utterance.onend = done;
+                utterance.onerror = done;
+            }
+            
             this.synth.speak(utterance);
+        } else if (timing) {
+            this.queueTelemetry(timing);
         }
     }
     
-    showLoading(show) {
+    showLoading(show, allowBargeIn = false) {
         this.loading.style.display = show ? 'flex' : 'none';
-        this.micButton.disabled = show;
+        this.micButton.disabled = show && !allowBargeIn;
     }
     
     scrollToBottom() {